@@ -0,0 +1,61 @@
+"""
+Compare two result files of benchmarks.run and fail when a case got slower than the threshold.
+
+    python -m benchmarks.compare baseline.json results.json --threshold 0.1
+"""
+import argparse
+import json
+import sys
+
+METRICS = ['wall_seconds', 'cpu_seconds', 'peak_rss_bytes']
+
+
+def compare(baseline, current, threshold):
+    """
+    Return (rows, regressed) where rows are (case, metric, baseline, current, relative change).
+    """
+    rows = []
+    regressed = False
+    for case, result in current['results'].items():
+        previous = baseline['results'].get(case)
+        if previous is None:
+            continue
+        for metric in METRICS:
+            before, after = previous.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            rows.append((case, metric, before, after, change))
+            if metric == 'wall_seconds' and change > threshold:
+                regressed = True
+    return rows, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative wall time increase reported as a regression')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    if baseline.get('profile') != current.get('profile') or baseline.get('seed') != current.get('seed'):
+        print('Warning: results were measured on different app trees.', file=sys.stderr)
+
+    rows, regressed = compare(baseline, current, args.threshold)
+    print(f'{"case":<20} {"metric":<16} {"baseline":>14} {"current":>14} {"change":>8}')
+    for case, metric, before, after, change in rows:
+        print(f'{case:<20} {metric:<16} {before:>14.4g} {after:>14.4g} {change:>+8.1%}')
+
+    if regressed:
+        print(f'Wall time regressed by more than {args.threshold:.0%}.', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Benchmark the file scan, build and push of nak on a synthetic app tree.
+
+    python -m benchmarks.run --profile small --output results.json
+    python -m benchmarks.compare baseline.json results.json
+    python -m benchmarks.run --cases build_large --large-size 4608
+
+Every case runs in its own interpreter with the app tree as working directory, like the nak
+command, so peak RSS is measured per case. Results are printed as JSON.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.server import StandInServer
+from benchmarks.tree import PROFILES, generate_tree
+
+# build_incremental and push reuse the archive left by build_cold
+CASES = ['scan', 'build_cold', 'build_incremental', 'push']
+# only run when asked for, build_large writes an archive of --large-size MB
+EXTRA_CASES = ['build_large']
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_commit():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def get_tree_size(file_list):
+    return sum(os.path.getsize(file) for file in file_list)
+
+
+def measure(function, repeat, setup=None):
+    """
+    Call function repeat times and return its last value with the wall and CPU seconds of every call.
+    """
+    walls = []
+    cpus = []
+    value = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        wall, cpu = time.perf_counter(), time.process_time()
+        value = function()
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+    return value, walls, cpus
+
+
+def summarize(walls, cpus, files, size):
+    wall = statistics.median(walls)
+    return {
+        'runs': len(walls),
+        'wall_seconds': wall,
+        'wall_seconds_min': min(walls),
+        'cpu_seconds': statistics.median(cpus),
+        'files': files,
+        'bytes': size,
+        'files_per_second': files / wall if wall else None,
+        'mb_per_second': size / wall / 1024 / 1024 if wall else None,
+    }
+
+
+def run_scan(args):
+    from nak.utils import get_all_file
+
+    file_list, walls, cpus = measure(lambda: get_all_file(path='.'), args.repeat)
+    return summarize(walls, cpus, len(file_list), get_tree_size(file_list))
+
+
+def run_build(args, incremental=False):
+    from nak.command import Command
+    from nak.settings import ZIP_DESTINATION_DIRECTORY
+    from nak.utils import get_all_file
+
+    parser = argparse.Namespace(jobs=args.jobs)
+
+    def build():
+        Command().build(parser)
+
+    def clean():
+        shutil.rmtree(ZIP_DESTINATION_DIRECTORY, ignore_errors=True)
+
+    if incremental and not os.path.exists(ZIP_DESTINATION_DIRECTORY):
+        build()
+    _, walls, cpus = measure(build, args.repeat, setup=None if incremental else clean)
+
+    file_list = get_all_file(path='.')
+    return summarize(walls, cpus, len(file_list), get_tree_size(file_list))
+
+
+def run_push(args):
+    from nak import gateway
+    from nak.command import Command
+    from nak.settings import ZIP_DESTINATION_DIRECTORY
+    from nak.utils import get_lastest_build_file
+
+    gateway.API_URL = args.url
+    if not os.path.exists(ZIP_DESTINATION_DIRECTORY) or not get_lastest_build_file():
+        Command().build(argparse.Namespace(jobs=args.jobs))
+
+    # every run uploads, the archive did not change since the first one
+    _, walls, cpus = measure(lambda: Command().push(argparse.Namespace(force=True)), args.repeat)
+    return summarize(walls, cpus, 1, os.path.getsize(get_lastest_build_file()))
+
+
+def run_build_large(args):
+    """
+    Build the app with one extra sparse video of args.large_size MB, peak RSS must not grow with it.
+
+    The app is built once without the video first, its peak RSS plus BUILD_LARGE_FILE_SIZE is the
+    budget of the builds with the video, whatever its size.
+    """
+    from nak.command import Command
+    from nak.settings import BUILD_LARGE_FILE_SIZE, ZIP_DESTINATION_DIRECTORY
+
+    def clean():
+        shutil.rmtree(ZIP_DESTINATION_DIRECTORY, ignore_errors=True)
+
+    clean()
+    Command().build(argparse.Namespace(jobs=args.jobs))
+    baseline = get_peak_rss()
+
+    size = args.large_size * 1024 * 1024
+    os.makedirs('large', exist_ok=True)
+    path = os.path.join('large', 'promo.mp4')
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+    try:
+        _, walls, cpus = measure(lambda: Command().build(argparse.Namespace(jobs=args.jobs)), args.repeat, setup=clean)
+    finally:
+        shutil.rmtree('large', ignore_errors=True)
+        clean()
+
+    result = summarize(walls, cpus, 1, size)
+    result['large_file_bytes'] = size
+    result['peak_rss_budget_bytes'] = None if baseline is None else baseline + BUILD_LARGE_FILE_SIZE
+    return result
+
+
+def get_over_budget(report):
+    """
+    Return the cases whose peak RSS went over their budget.
+    """
+    over_budget = []
+    for case, result in report['results'].items():
+        budget = result.get('peak_rss_budget_bytes')
+        if budget is not None and result['peak_rss_bytes'] > budget:
+            over_budget.append(case)
+    return over_budget
+
+
+def run_case(args):
+    """
+    Run one case in the current interpreter, the working directory being the app tree.
+    """
+    output = sys.stdout
+    # progress bars and log lines of the commands are part of the cost but not of the results
+    sys.stdout = open(os.devnull, 'w')
+    logging.disable(logging.CRITICAL)
+
+    if args.case == 'scan':
+        result = run_scan(args)
+    elif args.case == 'build_cold':
+        result = run_build(args)
+    elif args.case == 'build_incremental':
+        result = run_build(args, incremental=True)
+    elif args.case == 'build_large':
+        result = run_build_large(args)
+    else:
+        result = run_push(args)
+
+    result['peak_rss_bytes'] = get_peak_rss()
+    output.write(json.dumps(result))
+    output.flush()
+
+
+def run_in_subprocess(case, root, args, url):
+    command = [sys.executable, '-m', 'benchmarks.run', '--case', case, '--repeat', str(args.repeat), '--url', url,
+               '--large-size', str(args.large_size)]
+    if args.jobs:
+        command += ['--jobs', str(args.jobs)]
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPOSITORY_ROOT, env.get('PYTHONPATH')]))
+    result = subprocess.run(command, cwd=root, env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(result.stdout)
+
+
+def run(args):
+    small_files, media_files, media_size, depth = PROFILES[args.profile]
+    workdir = tempfile.mkdtemp(prefix='nak-benchmark-', dir=args.workdir)
+    # the app directory name is part of the archive name
+    root = os.path.join(workdir, 'app')
+    os.mkdir(root)
+
+    try:
+        files, size = generate_tree(root, small_files, media_files, media_size, depth, seed=args.seed)
+        results = {}
+        with StandInServer() as server:
+            for case in args.cases:
+                print(f'Running {case}...', file=sys.stderr)
+                results[case] = run_in_subprocess(case, root, args, server.url)
+    finally:
+        if args.keep:
+            print(f'Kept app tree in {root}', file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'profile': args.profile,
+        'seed': args.seed,
+        'jobs': args.jobs,
+        'tree': {'files': files, 'bytes': size, 'depth': depth},
+        'results': results,
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmark nak on a synthetic app tree.')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small', help='size of the app tree')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the app tree contents')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every case, the median is reported')
+    parser.add_argument('--jobs', type=int, default=None, help='build workers, defaults to the number of CPUs')
+    parser.add_argument('--cases', type=lambda value: value.split(','), default=CASES,
+                        help=f'comma separated cases to run, from {",".join(CASES + EXTRA_CASES)}')
+    parser.add_argument('--large-size', type=int, default=4608, help='size in MB of the video of build_large')
+    parser.add_argument('--workdir', default=None, help='directory to create the app tree in')
+    parser.add_argument('--keep', action='store_true', help='keep the app tree after the run')
+    parser.add_argument('--output', default=None, help='file to write the JSON results to instead of stdout')
+    # internal, used by the per case subprocesses
+    parser.add_argument('--case', choices=CASES + EXTRA_CASES, help=argparse.SUPPRESS)
+    parser.add_argument('--url', default=None, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.case:
+        run_case(args)
+        return
+
+    unknown_cases = [case for case in args.cases if case not in CASES + EXTRA_CASES]
+    if unknown_cases:
+        get_parser().error(f'unknown cases {", ".join(unknown_cases)}')
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(report, indent=2) + '\n')
+    else:
+        print(json.dumps(report, indent=2))
+
+    over_budget = get_over_budget(report)
+    if over_budget:
+        print(f'Peak RSS went over its budget in {", ".join(over_budget)}.', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
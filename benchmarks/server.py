@@ -0,0 +1,94 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP stand-in for API_URL answering with scripted (status, delay) responses, once the
+    script runs out every request gets a 200. Every request is recorded in requests with the
+    size of its body, the body itself is only kept with keep_bodies, benchmark uploads are big.
+    """
+    daemon_threads = True
+
+    def __init__(self, responses=(), keep_bodies=False):
+        self.responses = list(responses)
+        self.keep_bodies = keep_bodies
+        self.requests = []
+        self.lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # clients giving up on a slow response are expected
+        pass
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def read(self, size, chunks):
+        while size > 0:
+            data = self.rfile.read(min(size, READ_CHUNK_SIZE))
+            if not data:
+                break
+            size -= len(data)
+            if chunks is not None:
+                chunks.append(data)
+
+    def read_body(self):
+        """
+        Return the size of the request body and the body when the server keeps them, else None.
+        """
+        chunks = [] if self.server.keep_bodies else None
+        if self.headers.get('Transfer-Encoding') != 'chunked':
+            size = int(self.headers.get('Content-Length', 0))
+            self.read(size, chunks)
+        else:
+            size = 0
+            while True:
+                chunk_size = int(self.rfile.readline().strip(), 16)
+                self.read(chunk_size, chunks)
+                self.rfile.readline()
+                size += chunk_size
+                if not chunk_size:
+                    break
+        return size, None if chunks is None else b''.join(chunks)
+
+    def do_PATCH(self):
+        size, body = self.read_body()
+        with self.server.lock:
+            self.server.requests.append({
+                'method': self.command,
+                'path': self.path,
+                'size': size,
+                'body': body,
+                'port': self.client_address[1],
+                'authorization': self.headers.get('Authorization'),
+            })
+            status, delay = self.server.responses.pop(0) if self.server.responses else (200, 0)
+        # time.sleep is patched by the gateway tests to skip the retry backoff
+        threading.Event().wait(delay)
+
+        content = json.dumps({'error': 'failed'} if status >= 400 else {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_PATCH
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,82 @@
+import os
+import random
+
+WORDS = [
+    'app', 'cart', 'checkout', 'product', 'price', 'order', 'customer', 'shipping', 'payment', 'offer',
+    'title', 'image', 'button', 'section', 'container', 'header', 'footer', 'item', 'quantity', 'total',
+]
+
+TEXT_TEMPLATES = {
+    '.html': '<div class="{0}">{{% if {1} %}}<span>{{{{ {2}.{3} }}}}</span>{{% endif %}}</div>\n',
+    '.js': 'function {0}{1}({2}) {{ return {2}.{3} + {4}; }}\n',
+    '.css': '.{0}-{1} {{ margin: {4}px; color: #{4:06x}; }}\n',
+    '.json': '{{"{0}": "{1} {2}", "{3}": {4}}},\n',
+}
+MEDIA_EXTENSIONS = ['.mp4', '.png', '.jpg']
+
+# name -> (small files, media files, media file size, maximum directory depth)
+PROFILES = {
+    'tiny': (200, 2, 1024 * 1024, 4),
+    'small': (2000, 4, 8 * 1024 * 1024, 6),
+    'default': (10000, 4, 32 * 1024 * 1024, 8),
+    'large': (40000, 8, 128 * 1024 * 1024, 12),
+}
+
+
+def random_bytes(rng, size, chunk_size=1024 * 1024):
+    while size > 0:
+        length = min(size, chunk_size)
+        yield rng.getrandbits(length * 8).to_bytes(length, 'little')
+        size -= length
+
+
+def random_text(rng, extension, size):
+    template = TEXT_TEMPLATES[extension]
+    lines = []
+    length = 0
+    while length < size:
+        line = template.format(*rng.sample(WORDS, 4), rng.randrange(1 << 16))
+        lines.append(line)
+        length += len(line)
+    return ''.join(lines)
+
+
+def generate_tree(root, small_files, media_files, media_size, depth, seed=0):
+    """
+    Write a synthetic app under root and return (number of files, total bytes).
+
+    The same arguments and seed always produce the same paths and contents, so results of
+    different commits are measured on identical trees.
+    """
+    rng = random.Random(seed)
+    directories = ['']
+    for index in range(max(1, small_files // 50)):
+        parts = [f'dir{rng.randrange(6)}' for _ in range(rng.randint(1, depth))]
+        directories.append(os.path.join(*parts))
+
+    total = 0
+    for index in range(small_files):
+        extension = rng.choice(list(TEXT_TEMPLATES))
+        # mostly small templates and scripts with a long tail of bigger ones
+        size = min(int(rng.lognormvariate(8, 1)), 256 * 1024)
+        path = os.path.join(root, rng.choice(directories), f'file{index}{extension}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        content = random_text(rng, extension, size).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(content)
+        total += len(content)
+
+    for index in range(media_files):
+        path = os.path.join(root, 'assets', 'media', f'media{index}{rng.choice(MEDIA_EXTENSIONS)}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            for chunk in random_bytes(rng, media_size):
+                f.write(chunk)
+        total += media_size
+
+    with open(os.path.join(root, 'config.yml'), 'w') as f:
+        f.write('client_id: benchmark\n')
+    with open(os.path.join(root, '.env'), 'w') as f:
+        f.write('email=benchmark@29next.com\npassword=benchmark')
+
+    return small_files + media_files, total
@@ -0,0 +1,192 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from nak.compression import ZLIB_BACKEND
+from nak.progress import format_size
+from nak.settings import ANALYZE_DEPTH, ANALYZE_TOP, BUILD_CHUNK_SIZE, BUILD_JOBS, COMPRESSION_DEFLATE
+
+
+class Member(object):
+    """
+    A file of the app with its size, its compressed size, the bytes of its zip headers and
+    whether it is deflated or stored.
+    """
+
+    def __init__(self, name, size, compressed_size, overhead=0, deflated=False):
+        self.name = name
+        self.size = size
+        self.compressed_size = compressed_size
+        self.overhead = overhead
+        self.deflated = deflated
+
+    @property
+    def archived_size(self):
+        return self.compressed_size + self.overhead
+
+    @property
+    def ratio(self):
+        return self.compressed_size / self.size if self.size else 1.0
+
+    @property
+    def is_grown(self):
+        # deflated for nothing, stored files are as large as on disk by design
+        return self.deflated and self.size > 0 and self.compressed_size >= self.size
+
+    def to_dict(self):
+        return {'name': self.name, 'size': self.size, 'compressed_size': self.compressed_size,
+                'archived_size': self.archived_size, 'ratio': round(self.ratio, 4)}
+
+
+def get_overhead(zinfo):
+    # local header and central directory record, both repeat the name and the extra field
+    name_size = len(zinfo.filename.encode('utf-8'))
+    return zipfile.sizeFileHeader + zipfile.sizeCentralDir + 2 * (name_size + len(zinfo.extra))
+
+
+def read_archive(archive_file):
+    """
+    Return the members of a zip from its central directory, without decompressing them.
+    """
+    with zipfile.ZipFile(archive_file) as zip_file:
+        return [Member(zinfo.filename, zinfo.file_size, zinfo.compress_size, get_overhead(zinfo),
+                       deflated=zinfo.compress_type == zipfile.ZIP_DEFLATED)
+                for zinfo in zip_file.infolist() if not zinfo.is_dir()]
+
+
+def measure_file(path, method, level, backend=ZLIB_BACKEND):
+    """
+    Return the size of a file and its size once compressed by method at level, streaming it.
+    """
+    compressor = backend.compressobj(level) if method == COMPRESSION_DEFLATE else None
+    size = 0
+    compressed_size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BUILD_CHUNK_SIZE), b''):
+            size += len(chunk)
+            if compressor:
+                compressed_size += len(compressor.compress(chunk))
+    if not compressor:
+        return size, size
+    compressed_size += len(compressor.flush())
+    # the builder stores a file deflate makes bigger
+    return size, min(compressed_size, size)
+
+
+def scan_files(file_list, root, policy, jobs=BUILD_JOBS):
+    """
+    Return the members a build of file_list would have, compressing every file with the policy.
+    """
+    def measure(path):
+        name = os.path.relpath(path, root).replace(os.sep, '/')
+        method, level = policy.resolve(path)
+        size, compressed_size = measure_file(path, method, level, backend=policy.backend)
+        return Member(name, size, compressed_size, get_overhead(zipfile.ZipInfo(name)),
+                      deflated=method == COMPRESSION_DEFLATE)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(measure, file_list))
+
+
+class Report(object):
+    """
+    Sizes of the members of a build grouped by directory and by extension, heaviest first.
+    """
+
+    def __init__(self, members, source, top=ANALYZE_TOP, depth=ANALYZE_DEPTH):
+        self.members = members
+        self.source = source
+        self.top = top
+        self.depth = depth
+
+    @property
+    def size(self):
+        return sum(member.size for member in self.members)
+
+    @property
+    def compressed_size(self):
+        return sum(member.compressed_size for member in self.members)
+
+    @property
+    def overhead(self):
+        return sum(member.overhead for member in self.members)
+
+    @property
+    def archived_size(self):
+        return sum(member.archived_size for member in self.members)
+
+    def get_directory(self, member):
+        directories = member.name.split('/')[:-1][:self.depth]
+        return '/'.join(directories) + '/' if directories else './'
+
+    def get_extension(self, member):
+        return os.path.splitext(member.name)[1].lower() or '(none)'
+
+    def group(self, key):
+        groups = {}
+        for member in self.members:
+            files, size, compressed_size = groups.get(key(member), (0, 0, 0))
+            groups[key(member)] = (files + 1, size + member.size, compressed_size + member.compressed_size)
+        return [
+            {'name': name, 'files': files, 'size': size, 'compressed_size': compressed_size,
+             'ratio': round(compressed_size / size if size else 1.0, 4)}
+            for name, (files, size, compressed_size) in sorted(groups.items(), key=lambda item: (-item[1][2], item[0]))
+        ]
+
+    def get_directories(self):
+        return self.group(self.get_directory)
+
+    def get_extensions(self):
+        return self.group(self.get_extension)
+
+    def get_heaviest(self):
+        return sorted(self.members, key=lambda member: (-member.compressed_size, member.name))[:self.top]
+
+    def get_grown(self):
+        return sorted((member for member in self.members if member.is_grown),
+                      key=lambda member: (member.size - member.compressed_size, member.name))
+
+    def to_dict(self):
+        return {
+            'source': self.source,
+            'files': len(self.members),
+            'size': self.size,
+            'compressed_size': self.compressed_size,
+            'overhead': self.overhead,
+            'archived_size': self.archived_size,
+            'directories': self.get_directories(),
+            'extensions': self.get_extensions(),
+            'heaviest': [member.to_dict() for member in self.get_heaviest()],
+            'grown': [member.to_dict() for member in self.get_grown()],
+        }
+
+    def format_rows(self, title, rows):
+        width = max([len(row['name']) for row in rows] + [len(title)])
+        lines = [f'{title:<{width}} {"files":>7} {"size":>10} {"compressed":>10} {"ratio":>6} {"share":>6}']
+        for row in rows:
+            share = 100 * row['compressed_size'] / self.compressed_size if self.compressed_size else 0
+            lines.append(
+                f'{row["name"]:<{width}} {row["files"]:>7} {format_size(row["size"]):>10} '
+                f'{format_size(row["compressed_size"]):>10} {100 * row["ratio"]:>5.1f}% {share:>5.1f}%')
+        return lines
+
+    def format_members(self, title, members):
+        width = max([len(member.name) for member in members] + [len(title)])
+        lines = [f'{title:<{width}} {"size":>10} {"compressed":>10} {"ratio":>6}']
+        for member in members:
+            lines.append(f'{member.name:<{width}} {format_size(member.size):>10} '
+                         f'{format_size(member.compressed_size):>10} {100 * member.ratio:>5.1f}%')
+        return lines
+
+    def format_summary(self):
+        ratio = 100 * self.compressed_size / self.size if self.size else 100
+        lines = [f'{self.source}: {len(self.members)} files, {format_size(self.size)} compressed to '
+                 f'{format_size(self.compressed_size)} ({ratio:.1f}%), '
+                 f'{format_size(self.archived_size)} with {format_size(self.overhead)} of zip headers.']
+        lines += [''] + self.format_rows('directory', self.get_directories())
+        lines += [''] + self.format_rows('extension', self.get_extensions())
+        lines += [''] + self.format_members(f'top {self.top} files', self.get_heaviest())
+        grown = self.get_grown()
+        if grown:
+            lines += [''] + self.format_members(f'{len(grown)} deflated files not made smaller', grown[:self.top])
+        return lines
@@ -0,0 +1,547 @@
+import hashlib
+import io
+import json
+import os
+import stat as stat_module
+import struct
+import threading
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from nak.compression import ZLIB_BACKEND, CompressionPolicy
+from nak.settings import (BUILD_CHUNK_SIZE, BUILD_COMPRESSION_LEVEL, BUILD_JOBS, BUILD_LARGE_BUFFER_SIZE,
+                          BUILD_LARGE_FILE_SIZE, BUILD_MANIFEST_PATH, COMPRESSION_DEFLATE, COMPRESSION_STORE,
+                          ZIP_DATE_TIME, ZIP_FILE_MODE)
+from nak.timings import timings
+from nak.progress import Progress
+
+
+def get_file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BUILD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_raw_member(zip_file, zinfo):
+    """
+    Yield the still-compressed bytes of a member from an archive opened for reading.
+    The local header is parsed because its extra field may differ from the central directory.
+    """
+    fp = zip_file.fp
+    fp.seek(zinfo.header_offset)
+    header = fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[0:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f'Bad local file header for {zinfo.filename}')
+
+    fheader = struct.unpack(zipfile.structFileHeader, header)
+    fp.seek(fheader[zipfile._FH_FILENAME_LENGTH] + fheader[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+    remaining = zinfo.compress_size
+    while remaining:
+        chunk = fp.read(min(BUILD_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f'Truncated member {zinfo.filename}')
+        remaining -= len(chunk)
+        yield chunk
+
+
+def write_raw_member(zip_file, zinfo, chunks):
+    """
+    Write already-compressed chunks into an archive opened for writing.
+    zinfo must carry the final CRC, file_size and compress_size, so no data descriptor is needed.
+    """
+    zinfo.flag_bits &= ~zipfile._MASK_USE_DATA_DESCRIPTOR
+    if zip_file._seekable:
+        zip_file.fp.seek(zip_file.start_dir)
+    zinfo.header_offset = zip_file.fp.tell()
+
+    zip_file._writecheck(zinfo)
+    zip_file._didModify = True
+
+    zip_file.fp.write(zinfo.FileHeader())
+    for chunk in chunks:
+        zip_file.fp.write(chunk)
+
+    zip_file.start_dir = zip_file.fp.tell()
+    zip_file.filelist.append(zinfo)
+    zip_file.NameToInfo[zinfo.filename] = zinfo
+
+
+def make_zinfo(arcname):
+    """
+    Member info that does not depend on the file system: fixed timestamp, mode and creator.
+    """
+    zinfo = zipfile.ZipInfo(arcname, date_time=ZIP_DATE_TIME)
+    zinfo.create_system = 3
+    zinfo.external_attr = (stat_module.S_IFREG | ZIP_FILE_MODE) << 16
+    return zinfo
+
+
+class HashingWriter(object):
+    """
+    Write-only file object hashing what goes through it, so the digest of an archive comes out
+    of the pass writing it. It can't seek, so ZipFile writes strictly sequentially.
+
+    When fileobj can seek and be read back, bytes written between hold() and release() can be
+    patched and are hashed by release() from fileobj, once final.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.digest = hashlib.sha256()
+        self.position = 0
+        self.hashed = 0
+        self.held = False
+
+    def write(self, data):
+        self.fileobj.write(data)
+        if not self.held:
+            self.digest.update(data)
+            self.hashed += len(data)
+        self.position += len(data)
+        return len(data)
+
+    def seekable(self):
+        try:
+            return self.fileobj.seekable() and self.fileobj.readable()
+        except (AttributeError, ValueError):
+            return False
+
+    def hold(self):
+        self.held = True
+
+    def patch(self, offset, data):
+        if offset < self.hashed:
+            raise ValueError('Unable to patch bytes that were already hashed.')
+        self.fileobj.seek(offset)
+        self.fileobj.write(data)
+        self.fileobj.seek(self.position)
+
+    def release(self):
+        # the held bytes were just written, so they are usually read back from the page cache
+        buffer = bytearray(min(BUILD_LARGE_BUFFER_SIZE, max(self.position - self.hashed, 1)))
+        view = memoryview(buffer)
+        self.fileobj.seek(self.hashed)
+        while self.hashed < self.position:
+            size = self.fileobj.readinto(view[:self.position - self.hashed])
+            if not size:
+                raise IOError('The archive was truncated while it was being written.')
+            self.digest.update(view[:size])
+            self.hashed += size
+        self.fileobj.seek(self.position)
+        self.held = False
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def iter_large_file(path, buffer_size=None):
+    """
+    Yield the content of a file as views of one reused buffer, each view is only valid until the next one.
+    """
+    buffer = bytearray(buffer_size or BUILD_LARGE_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            yield view[:size]
+
+
+def scan_large_file(path, zinfo, buffer_size=None):
+    """
+    Fill in the zinfo of a large file that is stored, without holding it in memory.
+    Returns the sha256 digest of the file, its content is streamed later by stream_large_file.
+    """
+    digest = hashlib.sha256()
+    crc = 0
+    file_size = 0
+    for chunk in iter_large_file(path, buffer_size):
+        digest.update(chunk)
+        crc = zlib.crc32(chunk, crc)
+        file_size += len(chunk)
+
+    zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = file_size
+    return digest.hexdigest()
+
+
+def stream_large_file(path, zinfo, buffer_size=None):
+    """
+    Yield the content of a large file scanned by scan_large_file, checking it did not change since.
+    The header written before it already holds the CRC and size, so a change can't be fixed anymore.
+    """
+    crc = 0
+    file_size = 0
+    for chunk in iter_large_file(path, buffer_size):
+        crc = zlib.crc32(chunk, crc)
+        file_size += len(chunk)
+        yield chunk
+    if crc != zinfo.CRC or file_size != zinfo.file_size:
+        raise IOError(f'File {path} changed while it was being archived.')
+
+
+def write_large_member(zip_file, writer, zinfo, path, buffer_size=None):
+    """
+    Store a large file into an archive written through a seekable HashingWriter, reading it once.
+    The local header is written with the size from stat and patched with the CRC once the file
+    was read, as zipfile does. Returns the sha256 digest of the file.
+    """
+    digest = hashlib.sha256()
+    file_size = zinfo.file_size
+
+    def iter_chunks():
+        crc = 0
+        size = 0
+        for chunk in iter_large_file(path, buffer_size):
+            digest.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            yield chunk
+        # the size in the header decides whether it has a ZIP64 extra field, it can't change anymore
+        if size != file_size:
+            raise IOError(f'File {path} changed while it was being archived.')
+        zinfo.CRC = crc
+
+    writer.hold()
+    write_raw_member(zip_file, zinfo, iter_chunks())
+    writer.patch(zinfo.header_offset, zinfo.FileHeader())
+    writer.release()
+    return digest.hexdigest()
+
+
+def copy_compress_info(source_info, zinfo):
+    zinfo.compress_type = source_info.compress_type
+    zinfo.CRC = source_info.CRC
+    zinfo.file_size = source_info.file_size
+    zinfo.compress_size = source_info.compress_size
+    return zinfo
+
+
+def compress_file(path, zinfo, method=COMPRESSION_DEFLATE, level=BUILD_COMPRESSION_LEVEL, data=None, backend=None):
+    """
+    Read a file into memory, deflated by backend (zlib by default) or stored, and fill in the
+    zinfo sizes and CRC. When data is given it is compressed instead of the content of path
+    (a minified file). Returns the chunks and the sha256 digest of the compressed content.
+    """
+    backend = backend or ZLIB_BACKEND
+    compressor = backend.compressobj(level) if method == COMPRESSION_DEFLATE else None
+    digest = hashlib.sha256()
+    chunks = []
+    crc = 0
+    file_size = 0
+    with open(path, 'rb') if data is None else io.BytesIO(data) as f:
+        for chunk in iter(lambda: f.read(BUILD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            crc = backend.crc32(chunk, crc)
+            file_size += len(chunk)
+            chunks.append(compressor.compress(chunk) if compressor else chunk)
+    if compressor:
+        chunks.append(compressor.flush())
+
+    compress_size = sum(len(chunk) for chunk in chunks)
+    if compressor and compress_size >= file_size:
+        # deflate made it bigger, the file is stored instead
+        return compress_file(path, zinfo, COMPRESSION_STORE, data=data, backend=backend)
+
+    zinfo.compress_type = zipfile.ZIP_DEFLATED if compressor else zipfile.ZIP_STORED
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = compress_size
+    return chunks, digest.hexdigest()
+
+
+class Builder(object):
+    """
+    Build an app archive, reusing unchanged members of the previous build.
+
+    The manifest records size, mtime and sha256 per entry. Entries whose stat matches are
+    copied raw out of the previous archive; entries whose stat changed are hashed first and
+    only recompressed when their content really changed. An entry whose mtime is not older
+    than the manifest may have been changed again within the same timestamp tick (racily clean
+    in git terms), it is hashed too.
+
+    How each file is compressed comes from the CompressionPolicy, a manifest entry is only
+    reused when the policy rule for the file and, for deflated members, the deflate backend did
+    not change. With a Minifier, text assets are
+    minified before they are compressed; the manifest keeps the digest of the source file.
+    With a GitIndex the manifest also keeps the git blob of entries, a file git knows is
+    unchanged is then reused without being hashed, even when its mtime changed (a new checkout).
+
+    Files of BUILD_LARGE_FILE_SIZE and more are stored and streamed from disk while the archive
+    is written, so memory stays bounded whatever their size. They are read once and their
+    header patched afterwards when the archive is written to a file, an unseekable stream needs
+    their CRC before they are written, so they are scanned first.
+
+    With jobs > 1 hashing and deflating run in a thread pool (zlib and hashlib release the GIL)
+    while members are still written in arcname order.
+
+    Archives are reproducible: members are sorted and get a fixed timestamp and mode, so the same
+    sources give the same bytes. The sha256 of the archive is kept in digest after a write.
+    """
+
+    def __init__(self, destination_file=None, root='.', manifest_file=BUILD_MANIFEST_PATH, policy=None,
+                 jobs=BUILD_JOBS, show_progress=True, minifier=None, git_index=None):
+        self.destination_file = destination_file
+        self.root = root
+        self.manifest_file = manifest_file
+        self.policy = policy or CompressionPolicy()
+        self.jobs = jobs
+        self.show_progress = show_progress
+        self.minifier = minifier
+        self.git_index = git_index
+        self.reused = 0
+        self.compressed = 0
+        self.digest = None
+        # write time of the manifest of the previous build, by the clock of the file system
+        self.manifest_mtime_ns = 0
+        # whether the archive being written can be patched, large files are then read only once
+        self.seekable = False
+        # extension -> [files, bytes before, bytes after] of the minified members
+        self.minified = {}
+
+    def get_arcname(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def load_manifest(self):
+        self.manifest_mtime_ns = 0
+        if not os.path.exists(self.manifest_file):
+            return {}
+
+        try:
+            with open(self.manifest_file, 'r') as f:
+                manifest = json.load(f)
+                self.manifest_mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+        except ValueError:
+            return {}
+
+        archive = manifest.get('archive')
+        if not archive or not os.path.exists(archive):
+            return {}
+        return manifest
+
+    def save_manifest(self, entries):
+        with open(self.manifest_file, 'w') as f:
+            json.dump({'archive': self.destination_file, 'digest': self.digest, 'entries': entries}, f)
+
+    def is_minified(self, path):
+        return self.minifier is not None and self.minifier.can_minify(path)
+
+    def get_git_blob(self, arcname, stat):
+        return self.git_index.get_blob(arcname, stat) if self.git_index is not None else None
+
+    def is_reusable(self, path, arcname, stat, entry, previous_zip):
+        if not entry or previous_zip is None or entry.get('rule') != list(self.policy.get_rule(path)):
+            return False
+        if entry.get('minify', False) != self.is_minified(path):
+            return False
+        if arcname not in previous_zip.NameToInfo:
+            return False
+        # another deflate backend gives other bytes, the archive would depend on the build history
+        if (previous_zip.NameToInfo[arcname].compress_type == zipfile.ZIP_DEFLATED
+                and entry.get('deflate') != self.policy.backend.name):
+            return False
+        if (entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns
+                and entry['mtime'] < self.manifest_mtime_ns):
+            return True
+        blob = self.get_git_blob(arcname, stat)
+        if blob is not None and entry.get('git') == blob:
+            return True
+        return entry['size'] == stat.st_size and entry['sha256'] == get_file_digest(path)
+
+    def prepare_member(self, file, previous_entries, previous_zip):
+        """
+        Decide how a file goes into the archive, safe to run in a worker thread.
+        Returns (zinfo, stat, digest, source) where source is either the member info of the
+        previous archive to copy raw, the list of freshly compressed chunks, or the path of a
+        large file to stream.
+        """
+        arcname = self.get_arcname(file)
+        stat = os.stat(file)
+        entry = previous_entries.get(arcname)
+        zinfo = make_zinfo(arcname)
+
+        if self.is_reusable(file, arcname, stat, entry, previous_zip):
+            old_info = previous_zip.getinfo(arcname)
+            copy_compress_info(old_info, zinfo)
+            return zinfo, stat, entry['sha256'], old_info
+
+        if stat.st_size >= BUILD_LARGE_FILE_SIZE and not self.is_minified(file):
+            if self.seekable:
+                # hashed while it is written
+                zinfo.compress_type = zipfile.ZIP_STORED
+                zinfo.file_size = zinfo.compress_size = stat.st_size
+                zinfo.CRC = 0
+                return zinfo, stat, None, file
+            with timings.phase('archive.scan_large') as phase:
+                digest = scan_large_file(file, zinfo)
+                phase.add(files=1, bytes_in=zinfo.file_size)
+            return zinfo, stat, digest, file
+
+        if self.is_minified(file):
+            with timings.phase('archive.minify') as phase, open(file, 'rb') as f:
+                data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                minified = self.minifier.minify(file, data)
+                phase.add(files=1, bytes_in=len(data), bytes_out=len(minified))
+        else:
+            minified = digest = None
+
+        with timings.phase('archive.compress') as phase:
+            method, level = self.policy.resolve(file)
+            chunks, file_digest = compress_file(file, zinfo, method, level, data=minified, backend=self.policy.backend)
+            digest = digest or file_digest
+            phase.add(files=1, bytes_in=zinfo.file_size, bytes_out=zinfo.compress_size)
+        return zinfo, stat, digest, chunks
+
+    def iter_members(self, file_list, previous_entries, previous_zip):
+        if self.jobs <= 1:
+            for file in file_list:
+                yield self.prepare_member(file, previous_entries, previous_zip)
+            return
+
+        # keep a bounded window of futures so memory does not grow with the tree size
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pending = deque()
+            for file in file_list:
+                pending.append(executor.submit(self.prepare_member, file, previous_entries, previous_zip))
+                if len(pending) >= self.jobs * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def write(self, fileobj, file_list):
+        """
+        Write the archive of file_list into fileobj, which may be an unseekable stream.
+        Returns the manifest entries of the written members.
+        """
+        # the scan order depends on the file system, the archive order must not
+        file_list = sorted(file_list, key=self.get_arcname)
+        manifest = self.load_manifest()
+        previous_entries = manifest.get('entries', {})
+        previous_zip = zipfile.ZipFile(manifest['archive'], 'r') if manifest else None
+
+        self.reused = 0
+        self.compressed = 0
+        self.minified = {}
+        self.digest = None
+        entries = {}
+        writer = HashingWriter(fileobj)
+        self.seekable = writer.seekable()
+        try:
+            total = sum(os.path.getsize(file) for file in file_list) if self.show_progress else None
+            progress = Progress(total, prefix='Compressing:', enabled=self.show_progress)
+            with timings.phase('archive') as phase, progress, zipfile.ZipFile(writer, 'w') as new_zip:
+                members = self.iter_members(file_list, previous_entries, previous_zip)
+                for zinfo, stat, digest, source in members:
+                    with timings.phase('archive.write', bytes_out=zinfo.compress_size):
+                        if isinstance(source, zipfile.ZipInfo):
+                            write_raw_member(new_zip, zinfo, read_raw_member(previous_zip, source))
+                            self.reused += 1
+                        elif isinstance(source, str) and digest is None:
+                            digest = write_large_member(new_zip, writer, zinfo, source)
+                            self.compressed += 1
+                        elif isinstance(source, str):
+                            write_raw_member(new_zip, zinfo, stream_large_file(source, zinfo))
+                            self.compressed += 1
+                        else:
+                            write_raw_member(new_zip, zinfo, source)
+                            self.compressed += 1
+                    phase.add(files=1, bytes_in=zinfo.file_size, bytes_out=zinfo.compress_size)
+                    progress.advance(stat.st_size)
+
+                    entries[zinfo.filename] = {
+                        'size': stat.st_size,
+                        'mtime': stat.st_mtime_ns,
+                        'sha256': digest,
+                        'rule': list(self.policy.get_rule(zinfo.filename)),
+                        'minify': self.is_minified(zinfo.filename),
+                        'deflate': self.policy.backend.name if zinfo.compress_type == zipfile.ZIP_DEFLATED else None,
+                        'git': self.get_git_blob(zinfo.filename, stat),
+                    }
+                    if entries[zinfo.filename]['minify']:
+                        extension = os.path.splitext(zinfo.filename)[1].lower()
+                        minified = self.minified.setdefault(extension, [0, 0, 0])
+                        minified[0] += 1
+                        minified[1] += stat.st_size
+                        minified[2] += zinfo.file_size
+            self.digest = writer.hexdigest()
+        finally:
+            if previous_zip is not None:
+                previous_zip.close()
+        return entries
+
+    def build(self, file_list):
+        # write next to the destination first, the previous archive may share its name
+        partial_file = f'{self.destination_file}.part'
+        # readable too, the headers of large files are patched and hashed once written
+        with open(partial_file, 'w+b') as f:
+            entries = self.write(f, file_list)
+
+        os.replace(partial_file, self.destination_file)
+        with timings.phase('manifest'):
+            self.save_manifest(entries)
+        return self.destination_file
+
+
+class ArchiveStream(object):
+    """
+    Readable end of an archive that a Builder writes in a background thread.
+
+    The archive goes through an OS pipe, so only the pipe buffer is held in memory and compression
+    overlaps with whoever reads the stream. A failed build raises on read instead of ending the
+    stream, so a truncated archive is never passed on as complete.
+    """
+
+    def __init__(self, builder, file_list):
+        read_fd, write_fd = os.pipe()
+        self.reader = os.fdopen(read_fd, 'rb')
+        self.writer = os.fdopen(write_fd, 'wb')
+        self.error = None
+        self.thread = threading.Thread(target=self.run, args=(builder, file_list), daemon=True)
+        self.thread.start()
+
+    def run(self, builder, file_list):
+        try:
+            builder.write(self.writer, file_list)
+        except BaseException as e:
+            self.error = e
+        finally:
+            try:
+                self.writer.close()
+            except OSError:
+                pass
+
+    def seekable(self):
+        return False
+
+    def read(self, size=-1):
+        data = self.reader.read(size)
+        if not data:
+            self.thread.join()
+            if self.error is not None:
+                raise IOError(f'Build failed while streaming the archive. {self.error}')
+        return data
+
+    def close(self):
+        self.reader.close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
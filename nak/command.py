@@ -1,13 +1,20 @@
 import logging
 import os
-import zipfile
+import tempfile
+import time
 
+from nak.compression import CompressionPolicy, get_deflate_backend
 from nak.config import Config
-from nak.gateway import Gateway
-from nak.settings import (CONFIG_FILE, ENV_FILE, LOG_COLOR,
-                          ZIP_DESTINATION_DIRECTORY, ZIP_DESTINATION_PATH)
-from nak.utils import (get_all_file, get_error_from_response, hide_variable, get_lastest_build_file,
-                       progress_bar)
+from nak.progress import Progress, format_size
+from nak.settings import (ANALYZE_DEPTH, ANALYZE_TOP, BUILD_COMPRESSION_LEVEL, BUILD_JOBS, COMPRESSION_LEVEL_AUTO,
+                          CONFIG_FILE, DEPLOY_SPOOL_MAX_SIZE, DISCOVERY_GIT, ENV_FILE, LOG_COLOR,
+                          MONOREPO_BUILD_PROCESSES, MONOREPO_PUSH_PROCESSES, REQUEST_POOL_SIZE, WATCH_DEBOUNCE,
+                          WATCH_POLL_INTERVAL, ZIP_DESTINATION_DIRECTORY, ZIP_DESTINATION_PATH, ZIP_FILE_FORMAT)
+from nak.store import BuildStore
+from nak.timings import timings
+from nak.tuning import Tuner
+from nak.utils import (filter_listed_files, get_all_file, get_build_digest, get_build_time, get_error_from_response,
+                       get_pushed_digest, hide_variable, get_lastest_build_file, set_pushed_digest)
 
 logging.basicConfig(
     format='%(asctime)s %(levelname)s %(message)s',
@@ -19,11 +26,150 @@ logging.basicConfig(
 class Command(object):
     def __init__(self):
         self.config = Config()
-        self.gateway = Gateway(
-            email=self.config.email,
-            password=self.config.password,
-            client_id=self.config.client_id
-        )
+        self._gateway = None
+        # set by "nak serve", keeps the walked files of the app between commands
+        self.file_index = None
+
+    @property
+    def gateway(self):
+        # requests is only imported by the commands talking to the server
+        if self._gateway is None:
+            from nak.gateway import Gateway
+            self._gateway = Gateway(
+                email=self.config.email,
+                password=self.config.password,
+                client_id=self.config.client_id,
+                timeout=self.config.timeout,
+                max_retries=self.config.retries
+            )
+        return self._gateway
+
+    def get_minifier(self, parser=None):
+        from nak.minify import Minifier
+
+        # --minify turns on every type, config.yml may list only some of them
+        minify = True if getattr(parser, 'minify', False) else self.config.minify
+        if not minify:
+            return None
+        return Minifier(extensions=None if minify is True else minify)
+
+    def get_policy(self, parser=None, file_list=None, jobs=BUILD_JOBS):
+        policy = CompressionPolicy(self.config.compression, backend=get_deflate_backend(self.config.deflate))
+        level = getattr(parser, 'level', None)
+        if level is None:
+            level = self.config.compression_level
+        if level == COMPRESSION_LEVEL_AUTO:
+            level = self.choose_level(policy, file_list or [], jobs)
+        if level is not None:
+            policy.set_level(level)
+        return policy
+
+    def choose_level(self, policy, file_list, jobs):
+        """
+        Return the deflate level with the shortest predicted compression plus upload of the files,
+        None to keep the levels of the policy until an upload was measured.
+        """
+        tuner = Tuner()
+        best, predictions = tuner.choose(file_list, policy, jobs)
+        if best is None:
+            logging.info(LOG_COLOR.INFO.format(
+                message=(f'Compression level {BUILD_COMPRESSION_LEVEL}, no upload measured yet to tune it, '
+                         'it is tuned after the first push.')))
+            return None
+        default = predictions.get(BUILD_COMPRESSION_LEVEL)
+        compared = f', level {default.level}: {default.seconds:.2f}s' if default and default is not best else ''
+        logging.info(LOG_COLOR.INFO.format(
+            message=(f'Compression level {best.level} for uploads at {format_size(tuner.get_upload_rate())}/s: '
+                     f'predicted {best.compress_seconds:.2f}s compressing and {best.upload_seconds:.2f}s uploading '
+                     f'({best.seconds:.2f}s{compared}).')))
+        return best.level
+
+    def record_upload(self, progress):
+        Tuner().record_upload(progress.done, time.monotonic() - progress.started)
+
+    def log_minified(self, builder):
+        for extension, (files, size, minified_size) in sorted(builder.minified.items()):
+            saved = size - minified_size
+            percent = 100 * saved / size if size else 0
+            logging.info(LOG_COLOR.INFO.format(
+                message=(f'Minified {files} {extension} files from {format_size(size)} to '
+                         f'{format_size(minified_size)}, saved {format_size(saved)} ({percent:.1f}%).')))
+
+    def get_file_list(self, path, parser=None):
+        """
+        Return the files of the app and the GitIndex to reuse unchanged files with, None when
+        the files are walked.
+        """
+        from nak.gitindex import GitIndex, list_git_files
+
+        discovery = getattr(parser, 'discovery', None) or self.config.discovery
+        if discovery == DISCOVERY_GIT:
+            names = list_git_files(path)
+            if names is not None:
+                return filter_listed_files(path, names), GitIndex(path)
+            logging.info(LOG_COLOR.INFO.format(
+                message='Unable to list files with git, the app is not in a git checkout. Walking the directory.'))
+        if self.file_index is not None:
+            return self.file_index.get_files(path), None
+        return get_all_file(path=path), None
+
+    def is_pushed(self, digest, parser=None):
+        """
+        Whether an archive with this digest was the last one pushed to the app, unless --force is given.
+        """
+        if getattr(parser, 'force', False) or get_pushed_digest(self.config.client_id) != digest:
+            return False
+        logging.info(LOG_COLOR.SUCCESS.format(
+            message=(f'App with client_id {self.config.client_id} is already up to date, nothing to upload. '
+                     'Use --force to upload anyway.')))
+        return True
+
+    def run_all(self, name, parser):
+        """
+        Run a command for every app under the current directory, each in its own process.
+        Returns False when it failed for some app.
+        """
+        from nak.monorepo import find_app_roots, format_summary, run_apps
+
+        roots = find_app_roots('.')
+        if not roots:
+            raise TypeError(LOG_COLOR.ERROR.format(
+                message='No app found, an app is a directory with a config.yml or .env file.'))
+
+        argv = [name]
+        if name == 'build':
+            workers = min(getattr(parser, 'processes', None) or MONOREPO_BUILD_PROCESSES, len(roots))
+            # the threads compressing files are shared by the apps built at the same time
+            argv += ['--jobs', str(getattr(parser, 'jobs', None) or max(BUILD_JOBS // workers, 1))]
+            if getattr(parser, 'minify', False):
+                argv.append('--minify')
+            if getattr(parser, 'discovery', None):
+                argv += ['--discovery', parser.discovery]
+            if getattr(parser, 'level', None) is not None:
+                argv += ['--level', str(parser.level)]
+        else:
+            workers = min(getattr(parser, 'processes', None) or MONOREPO_PUSH_PROCESSES, len(roots))
+            if getattr(parser, 'force', False):
+                argv.append('--force')
+            if getattr(parser, 'targets', None):
+                argv += ['--targets', ','.join(parser.targets)]
+
+        logging.info(LOG_COLOR.INFO.format(message=f'Running {name} for {len(roots)} apps, {workers} at a time.'))
+        results = run_apps(roots, argv, workers)
+        for result in results:
+            if not result.ok:
+                for line in result.lines:
+                    logging.info(LOG_COLOR.ERROR.format(message=f'{result.root}: {line}'))
+        for line in format_summary(results):
+            logging.info(LOG_COLOR.INFO.format(message=line))
+
+        failed = sum(not result.ok for result in results)
+        if failed:
+            logging.info(LOG_COLOR.ERROR.format(
+                message=f'{name.capitalize()} failed for {failed} of {len(results)} apps.'))
+            return False
+        logging.info(LOG_COLOR.SUCCESS.format(message=f'{name.capitalize()} {len(results)} apps successfully.'))
+        return True
 
     def setup(self, parser=None):
         self.config.client_id = input(
@@ -39,6 +185,11 @@ class Command(object):
         ))
 
     def build(self, parser=None):
+        from nak.builder import Builder
+
+        if getattr(parser, 'all', False):
+            return self.run_all('build', parser)
+
         if not (os.path.exists(ENV_FILE) or os.path.exists(CONFIG_FILE)):
             raise TypeError(LOG_COLOR.ERROR.format(
                 message=(
@@ -48,25 +199,45 @@ class Command(object):
         app_name = os.getcwd().split('/')[-1]
         current_path = "."
 
-        file_list = get_all_file(path=current_path)
+        with timings.phase('scan') as phase:
+            file_list, git_index = self.get_file_list(current_path, parser)
+            phase.add(files=len(file_list))
         for file in file_list:
             logging.info(LOG_COLOR.INFO.format(message=f'file: {file}'))
 
-        destination_file = ZIP_DESTINATION_PATH.format(app_name=app_name)
+        destination_file = ZIP_DESTINATION_PATH.format(app_name=app_name, build_time=get_build_time())
 
         # create directories
         if not os.path.exists(ZIP_DESTINATION_DIRECTORY):
             os.mkdir(ZIP_DESTINATION_DIRECTORY)
 
-        new_zip = zipfile.ZipFile(destination_file, 'w')
-        for file in progress_bar(file_list, prefix='Progress:', suffix='Complete', length=50):
-            new_zip.write(file)
-
-        new_zip.close()
+        jobs = getattr(parser, 'jobs', None) or BUILD_JOBS
+        policy = self.get_policy(parser, file_list, jobs)
+        minifier = self.get_minifier(parser)
+        builder = Builder(
+            destination_file, root=current_path, policy=policy, jobs=jobs, minifier=minifier, git_index=git_index)
+        with timings.phase('build', files=len(file_list)):
+            builder.build(file_list)
+        if minifier is not None:
+            self.log_minified(builder)
+        logging.info(LOG_COLOR.INFO.format(
+            message=f'Reused {builder.reused} unchanged files, compressed {builder.compressed} files.'))
         logging.info(LOG_COLOR.INFO.format(message=f'Created build file with {destination_file.split("/")[-1]}.'))
+
+        store = BuildStore()
+        store.add(destination_file, builder.digest)
+        keep, max_size = self.config.retention
+        removed = store.prune(keep, max_size)
+        if removed:
+            logging.info(LOG_COLOR.INFO.format(
+                message=(f'Removed {len(removed)} old build files, '
+                         f'{format_size(sum(build["size"] for build in removed))} freed.')))
         logging.info(LOG_COLOR.SUCCESS.format(message='Build successfully.'))
 
     def push(self, parser=None):
+        if getattr(parser, 'all', False):
+            return self.run_all('push', parser)
+
         if not (os.path.exists(ENV_FILE) or os.path.exists(CONFIG_FILE)):
             raise TypeError(LOG_COLOR.ERROR.format(
                 message=(
@@ -82,17 +253,289 @@ class Command(object):
             raise TypeError(LOG_COLOR.ERROR.format(message='Please run build before push command.'))
 
         file_name = latest_build_file.split("/")[-1]
+        digest = get_build_digest(latest_build_file)
+        targets = self.get_targets(parser)
+        if targets:
+            return self.push_targets(latest_build_file, digest, targets, parser)
+        if self.is_pushed(digest, parser):
+            return True
 
         logging.info(LOG_COLOR.INFO.format(message=f'Pushing to app with client_id {self.config.client_id}'))
         logging.info(LOG_COLOR.INFO.format(message=f'with filename {file_name}'))
         logging.info(LOG_COLOR.INFO.format(message=f'by username {self.config.email}'))
 
-        files = {'file': (latest_build_file, open(f'{latest_build_file}', 'rb'))}
-
-        response = self.gateway.update_app(files=files)
+        with open(latest_build_file, 'rb') as f, timings.phase('push', files=1), \
+                Progress(prefix='Uploading:') as progress:
+            response = self.gateway.update_app(files={'file': (latest_build_file, f)}, callback=progress.report)
         if not response.ok:
             error_msg = get_error_from_response(response)
             logging.info(LOG_COLOR.ERROR.format(message=f'Upload file to server failed. {error_msg}'))
-            return
+            return False
 
+        self.record_upload(progress)
+        set_pushed_digest(self.config.client_id, digest)
+        BuildStore().mark_pushed(latest_build_file)
         logging.info(LOG_COLOR.SUCCESS.format(message='Push update file to app successfully.'))
+        return True
+
+    def get_targets(self, parser=None):
+        """
+        Return {name: client_id} of the targets given with --targets, None without --targets.
+        """
+        names = getattr(parser, 'targets', None)
+        if not names:
+            return None
+
+        unknown = [name for name in names if name not in self.config.targets]
+        if unknown:
+            available = ', '.join(sorted(self.config.targets)) or 'none'
+            raise TypeError(LOG_COLOR.ERROR.format(
+                message=f'Unknown targets {", ".join(unknown)}, the targets in config.yml are: {available}.'))
+        return {name: self.config.targets[name] for name in names}
+
+    def get_gateway(self, client_id):
+        from nak.gateway import Gateway
+
+        # every target shares the session of the default gateway and so its pooled connections
+        return Gateway(
+            email=self.config.email,
+            password=self.config.password,
+            client_id=client_id,
+            timeout=self.config.timeout,
+            max_retries=self.config.retries,
+            session=self.gateway.session
+        )
+
+    def push_target(self, client_id, file_name, buffer, callback):
+        """
+        Upload the archive in buffer to one app, returns (ok, message). Safe to run in a worker thread.
+        """
+        from nak.multipart import BufferReader
+
+        try:
+            response = self.get_gateway(client_id).update_app(
+                files={'file': (file_name, BufferReader(buffer))}, callback=callback)
+        except (OSError, TypeError) as e:
+            # requests exceptions are OSErrors
+            return False, str(e)
+        if not response.ok:
+            return False, f'Upload file to server failed. {get_error_from_response(response)}'
+        return True, 'Pushed.'
+
+    def push_targets(self, build_file, digest, targets, parser=None):
+        """
+        Push one archive to many apps at the same time. The archive is mapped in memory once and
+        every upload reads it from there, over the connections pooled by a shared session.
+        """
+        import mmap
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        file_name = build_file.split("/")[-1]
+        force = getattr(parser, 'force', False)
+        results = {}
+        pending = {}
+        for name, client_id in targets.items():
+            if not force and get_pushed_digest(client_id) == digest:
+                results[name] = (True, 'Already up to date.', 0.0)
+            else:
+                pending[name] = client_id
+
+        logging.info(LOG_COLOR.INFO.format(
+            message=f'Pushing {file_name} to {len(pending)} targets by username {self.config.email}'))
+        if pending:
+            uploaded = {name: 0 for name in pending}
+            lock = threading.Lock()
+            size = os.path.getsize(build_file)
+
+            def upload(name, buffer, progress):
+                def callback(bytes_read, total):
+                    with lock:
+                        uploaded[name] = bytes_read
+                        progress.report(sum(uploaded.values()))
+
+                started = time.monotonic()
+                ok, message = self.push_target(pending[name], file_name, buffer, callback)
+                return ok, message, time.monotonic() - started
+
+            with open(build_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer, \
+                    timings.phase('push', files=len(pending)), \
+                    Progress(size * len(pending), prefix='Uploading:') as progress, \
+                    ThreadPoolExecutor(max_workers=min(len(pending), REQUEST_POOL_SIZE)) as executor:
+                futures = {name: executor.submit(upload, name, buffer, progress) for name in pending}
+                for name, future in futures.items():
+                    results[name] = future.result()
+
+        width = max([len(name) for name in targets] + [6])
+        id_width = max([len(client_id) for client_id in targets.values()] + [9])
+        logging.info(LOG_COLOR.INFO.format(
+            message=f'{"target":<{width}} {"client_id":<{id_width}} {"status":<7} {"time s":>7}  message'))
+        for name, client_id in targets.items():
+            ok, message, seconds = results[name]
+            if ok and name in pending:
+                set_pushed_digest(client_id, digest)
+            status = 'ok' if ok else 'failed'
+            log_color = LOG_COLOR.INFO if ok else LOG_COLOR.ERROR
+            logging.info(log_color.format(
+                message=f'{name:<{width}} {client_id:<{id_width}} {status:<7} {seconds:>7.1f}  {message}'))
+
+        failed = [name for name, (ok, _, _) in results.items() if not ok]
+        if failed:
+            logging.info(LOG_COLOR.ERROR.format(message=f'Push failed for {", ".join(failed)}.'))
+            return False
+        BuildStore().mark_pushed(build_file)
+        logging.info(LOG_COLOR.SUCCESS.format(message=f'Push update file to {len(targets)} apps successfully.'))
+        return True
+
+    def deploy(self, parser=None):
+        from nak.builder import ArchiveStream, Builder
+
+        if not (os.path.exists(ENV_FILE) or os.path.exists(CONFIG_FILE)):
+            raise TypeError(LOG_COLOR.ERROR.format(
+                message=(
+                    'Unable to locate config or env file. '
+                    'You can configure config or env file by running "nak setup".')))
+
+        app_name = os.getcwd().split('/')[-1]
+        current_path = "."
+
+        with timings.phase('scan') as phase:
+            file_list, git_index = self.get_file_list(current_path, parser)
+            phase.add(files=len(file_list))
+        file_name = f'{ZIP_FILE_FORMAT.format(app_name=app_name, build_time=get_build_time())}.zip'
+
+        jobs = getattr(parser, 'jobs', None) or BUILD_JOBS
+        policy = self.get_policy(parser, file_list, jobs)
+        minifier = self.get_minifier(parser)
+        builder = Builder(root=current_path, policy=policy, jobs=jobs, minifier=minifier, git_index=git_index)
+
+        logging.info(LOG_COLOR.INFO.format(message=f'Deploying to app with client_id {self.config.client_id}'))
+        logging.info(LOG_COLOR.INFO.format(message=f'with filename {file_name}'))
+        logging.info(LOG_COLOR.INFO.format(message=f'by username {self.config.email}'))
+
+        total_size = sum(os.path.getsize(file) for file in file_list)
+        if total_size <= DEPLOY_SPOOL_MAX_SIZE:
+            # small apps are built in memory, the upload then has a known length
+            with tempfile.SpooledTemporaryFile(max_size=DEPLOY_SPOOL_MAX_SIZE) as buffer:
+                builder.write(buffer, file_list)
+                if self.is_pushed(builder.digest, parser):
+                    return True
+                buffer.seek(0)
+                with Progress(prefix='Uploading:') as progress:
+                    response = self.gateway.update_app(files={'file': (file_name, buffer)}, callback=progress.report)
+                if response.ok:
+                    self.record_upload(progress)
+        else:
+            # bigger apps are uploaded while they are compressed, without a zip file on disk, the
+            # compression progress of the builder then also tracks the upload, whose rate is not
+            # recorded as it is bound by the compression
+            logging.info(LOG_COLOR.INFO.format(
+                message='Large apps are uploaded while they are built, the upload is never skipped.'))
+            with ArchiveStream(builder, file_list) as stream:
+                try:
+                    response = self.gateway.update_app(files={'file': (file_name, stream)})
+                except Exception:
+                    # a failed build ends the upload with whatever error the HTTP client wraps it in
+                    if stream.thread.is_alive() or stream.error is None:
+                        raise
+                    raise TypeError(LOG_COLOR.ERROR.format(
+                        message=f'Build failed while streaming the archive. {stream.error}'))
+
+        if not response.ok:
+            error_msg = get_error_from_response(response)
+            logging.info(LOG_COLOR.ERROR.format(message=f'Upload file to server failed. {error_msg}'))
+            return False
+
+        set_pushed_digest(self.config.client_id, builder.digest)
+        logging.info(LOG_COLOR.INFO.format(
+            message=f'Reused {builder.reused} unchanged files, compressed {builder.compressed} files.'))
+        if minifier is not None:
+            self.log_minified(builder)
+        logging.info(LOG_COLOR.SUCCESS.format(message='Deploy app successfully.'))
+        return True
+
+    def analyze(self, parser=None):
+        """
+        Report the sizes of the latest build, or of the files of the app with --scan, by directory
+        and extension. Returns False when the build is over --max-size.
+        """
+        import json
+
+        from nak.analyze import Report, read_archive, scan_files
+
+        build_file = getattr(parser, 'file', None)
+        if not build_file and not getattr(parser, 'scan', False):
+            build_file = get_lastest_build_file()
+            if not build_file:
+                logging.info(LOG_COLOR.INFO.format(message='No build file available, analyzing the files of the app.'))
+
+        if build_file:
+            if not os.path.isfile(build_file):
+                raise TypeError(LOG_COLOR.ERROR.format(message=f'Build file {build_file} does not exist.'))
+            with timings.phase('analyze.read'):
+                members = read_archive(build_file)
+            source = build_file
+        else:
+            with timings.phase('scan') as phase:
+                file_list, _ = self.get_file_list('.', parser)
+                phase.add(files=len(file_list))
+            with timings.phase('analyze.compress', files=len(file_list)):
+                members = scan_files(file_list, '.', self.get_policy(parser, file_list))
+            source = 'files of the app'
+
+        report = Report(
+            members, source, top=getattr(parser, 'top', None) or ANALYZE_TOP,
+            depth=getattr(parser, 'depth', None) or ANALYZE_DEPTH)
+        for line in report.format_summary():
+            logging.info(LOG_COLOR.INFO.format(message=line))
+
+        output = getattr(parser, 'json', None)
+        if output == '-':
+            # the log goes to stderr, so the report can be piped
+            print(json.dumps(report.to_dict(), indent=2))
+        elif output:
+            with open(output, 'w') as f:
+                json.dump(report.to_dict(), f, indent=2)
+            logging.info(LOG_COLOR.INFO.format(message=f'Report written to {output}.'))
+
+        max_size = self.config.get_size(getattr(parser, 'max_size', None))
+        if max_size is not None and report.archived_size > max_size:
+            logging.info(LOG_COLOR.ERROR.format(
+                message=(f'Build size {format_size(report.archived_size)} is over the budget of '
+                         f'{format_size(max_size)}.')))
+            return False
+        return True
+
+    def watch(self, parser=None):
+        from nak.watcher import get_watcher
+
+        if not (os.path.exists(ENV_FILE) or os.path.exists(CONFIG_FILE)):
+            raise TypeError(LOG_COLOR.ERROR.format(
+                message=(
+                    'Unable to locate config or env file. '
+                    'You can configure config or env file by running "nak setup".')))
+
+        auto_push = getattr(parser, 'push', False)
+        interval = getattr(parser, 'interval', None) or WATCH_POLL_INTERVAL
+        debounce = getattr(parser, 'debounce', None) or WATCH_DEBOUNCE
+
+        watcher = get_watcher(".", interval=interval)
+        logging.info(LOG_COLOR.INFO.format(
+            message=f'Watching for changes with {watcher.__class__.__name__}, press Ctrl+C to stop.'))
+        try:
+            self.rebuild(parser, auto_push)
+            while True:
+                changes = watcher.wait_for_changes(debounce)
+                logging.info(LOG_COLOR.INFO.format(message=f'Detected changes in {len(changes)} files.'))
+                self.rebuild(parser, auto_push)
+        finally:
+            watcher.close()
+
+    def rebuild(self, parser, auto_push):
+        # unchanged files are copied from the previous build, so only the changed ones are compressed
+        try:
+            self.build(parser)
+            if auto_push:
+                self.push(parser)
+        except (TypeError, OSError) as e:
+            logging.exception(e, exc_info=False)
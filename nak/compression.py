@@ -0,0 +1,164 @@
+import logging
+import os
+import zlib
+
+from nak.settings import (BUILD_COMPRESSION_LEVEL, COMPRESSION_AUTO, COMPRESSION_DEFAULT, COMPRESSION_DEFLATE,
+                          COMPRESSION_POLICY, COMPRESSION_SAMPLE_RATIO, COMPRESSION_SAMPLE_SIZE, COMPRESSION_STORE,
+                          DEFLATE_AUTO, DEFLATE_BACKENDS, LOG_COLOR)
+
+COMPRESSION_METHODS = (COMPRESSION_STORE, COMPRESSION_DEFLATE, COMPRESSION_AUTO)
+# isal only has levels 0 to 3, zlib levels are mapped to the closest one
+ISAL_LEVELS = (0, 0, 0, 1, 1, 2, 2, 3, 3, 3)
+BACKEND_CHECK_DATA = b'<html><body>' + b'nak deflate backend check ' * 64 + b'</body></html>'
+
+
+class DeflateBackend(object):
+    """
+    A deflate implementation with the compressobj and crc32 of zlib, writing raw deflate streams
+    any zip reader inflates. Levels are zlib levels, mapped for implementations with fewer levels.
+    """
+
+    def __init__(self, name, module, levels=None):
+        self.name = name
+        self.module = module
+        self.levels = levels
+
+    def compressobj(self, level=BUILD_COMPRESSION_LEVEL):
+        if self.levels is not None:
+            level = self.levels[level]
+        return self.module.compressobj(level, self.module.DEFLATED, -15)
+
+    def crc32(self, data, value=0):
+        return self.module.crc32(data, value)
+
+    def check(self):
+        """
+        Whether the backend writes what zlib reads back, a broken build of an extension is not used.
+        """
+        compressor = self.compressobj()
+        data = compressor.compress(BACKEND_CHECK_DATA) + compressor.flush()
+        return (zlib.decompress(data, -15) == BACKEND_CHECK_DATA
+                and self.crc32(BACKEND_CHECK_DATA) == zlib.crc32(BACKEND_CHECK_DATA))
+
+
+ZLIB_BACKEND = DeflateBackend('zlib', zlib)
+
+
+def load_backend(name):
+    if name == 'isal':
+        from isal import isal_zlib
+        return DeflateBackend(name, isal_zlib, ISAL_LEVELS)
+    if name == 'zlib-ng':
+        from zlib_ng import zlib_ng
+        return DeflateBackend(name, zlib_ng)
+    return ZLIB_BACKEND
+
+
+def get_deflate_backend(name=DEFLATE_AUTO):
+    """
+    Return the deflate backend named in config.yml, or the fastest one installed for "auto".
+    A backend that is not installed or does not work falls back to zlib.
+    """
+    if name not in [DEFLATE_AUTO] + DEFLATE_BACKENDS:
+        raise TypeError(LOG_COLOR.ERROR.format(
+            message=f'Invalid deflate backend {name}, use one of {", ".join([DEFLATE_AUTO] + DEFLATE_BACKENDS)}.'))
+
+    for backend_name in DEFLATE_BACKENDS if name == DEFLATE_AUTO else [name]:
+        try:
+            backend = load_backend(backend_name)
+            if backend.check():
+                return backend
+        except Exception:
+            # an extension missing, or built for another platform
+            pass
+        if name != DEFLATE_AUTO:
+            logging.info(LOG_COLOR.INFO.format(message=f'Deflate backend {name} is not available, using zlib.'))
+    return ZLIB_BACKEND
+
+
+def is_compressible(path, sample_size=COMPRESSION_SAMPLE_SIZE, ratio=COMPRESSION_SAMPLE_RATIO):
+    """
+    Deflate the head of a file at the fastest level and tell whether it is worth compressing.
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(sample_size)
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * ratio
+
+
+def parse_rule(extension, rule):
+    """
+    Parse a policy rule from config.yml, either "method" or {"method": ..., "level": ...}.
+    """
+    if isinstance(rule, str):
+        method, level = rule, BUILD_COMPRESSION_LEVEL
+    elif isinstance(rule, dict):
+        method, level = rule.get('method'), rule.get('level', BUILD_COMPRESSION_LEVEL)
+    else:
+        method, level = None, None
+
+    if method not in COMPRESSION_METHODS:
+        raise TypeError(LOG_COLOR.ERROR.format(
+            message=f'Invalid compression method for {extension}, use one of {", ".join(COMPRESSION_METHODS)}.'))
+
+    if method == COMPRESSION_STORE:
+        return method, None
+
+    if not isinstance(level, int) or not 0 <= level <= 9:
+        raise TypeError(LOG_COLOR.ERROR.format(
+            message=f'Invalid compression level for {extension}, level must be between 0 and 9.'))
+    return method, level
+
+
+class CompressionPolicy(object):
+    """
+    Map file extensions to a (method, level) rule.
+
+    Defaults come from COMPRESSION_POLICY and can be overridden by the "compression" section of
+    config.yml, the "default" key replaces the rule for extensions that are not listed.
+    Files are deflated by backend, zlib unless another DeflateBackend is given.
+    """
+
+    def __init__(self, overrides=None, backend=None):
+        self.backend = backend or ZLIB_BACKEND
+        self.default = COMPRESSION_DEFAULT
+        self.table = dict(COMPRESSION_POLICY)
+        # extensions, and "default", whose rule was set in config.yml
+        self.overridden = set()
+
+        for extension, rule in (overrides or {}).items():
+            if extension == 'default':
+                self.default = parse_rule(extension, rule)
+                self.overridden.add(extension)
+                continue
+            extension = extension.lower()
+            if not extension.startswith('.'):
+                extension = f'.{extension}'
+            self.table[extension] = parse_rule(extension, rule)
+            self.overridden.add(extension)
+
+    def set_level(self, level):
+        """
+        Deflate at level the files whose rule was not set in config.yml, stored files stay stored.
+        """
+        for extension, (method, _) in list(self.table.items()):
+            if method != COMPRESSION_STORE and extension not in self.overridden:
+                self.table[extension] = (method, level)
+        if self.default[0] != COMPRESSION_STORE and 'default' not in self.overridden:
+            self.default = (self.default[0], level)
+
+    def get_rule(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        return self.table.get(extension, self.default)
+
+    def resolve(self, path):
+        """
+        Return the (method, level) to compress a file with, sampling it when the rule is "auto".
+        """
+        method, level = self.get_rule(path)
+        if method == COMPRESSION_AUTO:
+            method = COMPRESSION_DEFLATE if is_compressible(path) else COMPRESSION_STORE
+        if method == COMPRESSION_STORE:
+            level = None
+        return method, level
@@ -1,35 +1,159 @@
 import logging
 import os
+import re
 
 import yaml
-from decouple import config as env_config
+from decouple import Config as EnvConfig
+from decouple import RepositoryEnv
 
-from nak.settings import CONFIG_FILE, ENV_FILE, LOG_COLOR
+from nak.settings import (BUILD_RETENTION_KEEP, BUILD_RETENTION_MAX_SIZE, COMPRESSION_LEVEL_AUTO, CONFIG_FILE,
+                          DEFLATE_AUTO, DISCOVERY_WALK, ENV_FILE, LOG_COLOR, REQUEST_CONNECT_TIMEOUT,
+                          REQUEST_MAX_RETRIES, REQUEST_READ_TIMEOUT)
+
+# libyaml is several times faster than the pure Python loader when PyYAML was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?B?)\s*$', re.I)
+SIZE_MULTIPLIERS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+# path -> ((st_mtime_ns, st_size), parsed value)
+_file_cache = {}
+
+
+def load_cached(path, parse):
+    """
+    Return parse(path), parsed again only when the mtime or size of the file changed, None when it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        _file_cache.pop(path, None)
+        return None
+
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _file_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    value = parse(path)
+    _file_cache[path] = (key, value)
+    return value
+
+
+def clear_cache(path=None):
+    if path is None:
+        _file_cache.clear()
+    else:
+        _file_cache.pop(path, None)
+
+
+def parse_yaml(path):
+    with open(path, 'r') as yamlfile:
+        return yaml.load(yamlfile, Loader=YAML_LOADER) or {}
+
+
+def parse_env(path):
+    # variables from os.environ still take precedence, they are looked up on every read
+    return EnvConfig(RepositoryEnv(path))
 
 
 class Config(object):
     email = None
     password = None
     client_id = None
+    compression = None
+    compression_level = None
+    minify = False
+    timeout = (REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT)
+    retries = REQUEST_MAX_RETRIES
+    retention = (BUILD_RETENTION_KEEP, BUILD_RETENTION_MAX_SIZE)
+    targets = {}
+    discovery = DISCOVERY_WALK
+    deflate = DEFLATE_AUTO
 
     def __init__(self):
         configs, env = self.read_config()
 
         self.client_id = configs.get('client_id')
+        self.compression = configs.get('compression') or {}
+        self.compression_level = self.get_compression_level(configs.get('compression_level'))
+        # true for every supported type or a list of extensions
+        self.minify = configs.get('minify', False)
+        self.timeout = self.get_timeout(configs.get('timeout'))
+        self.retries = configs.get('retries', REQUEST_MAX_RETRIES)
+        self.retention = self.get_retention(configs.get('retention'))
+        self.targets = self.get_targets(configs.get('targets'))
+        self.discovery = configs.get('discovery', DISCOVERY_WALK)
+        self.deflate = configs.get('deflate', DEFLATE_AUTO)
         self.email = env.get('email')
         self.password = env.get('password')
 
+    @staticmethod
+    def get_timeout(timeout):
+        """
+        Parse "timeout" from config.yml, either seconds for both or {"connect": ..., "read": ...}.
+        """
+        if isinstance(timeout, (int, float)):
+            return (timeout, timeout)
+        timeout = timeout or {}
+        return (timeout.get('connect', REQUEST_CONNECT_TIMEOUT), timeout.get('read', REQUEST_READ_TIMEOUT))
+
+    @staticmethod
+    def get_compression_level(level):
+        """
+        Parse "compression_level" from config.yml, a level between 0 and 9 for the deflated files or "auto".
+        """
+        if level is None or level == COMPRESSION_LEVEL_AUTO:
+            return level
+        if isinstance(level, bool) or not isinstance(level, int) or not 0 <= level <= 9:
+            raise TypeError(LOG_COLOR.ERROR.format(
+                message=f'Invalid compression_level {level}, use auto or a level between 0 and 9.'))
+        return level
+
+    @staticmethod
+    def get_size(size):
+        """
+        Parse a size in bytes, either a number or a string like "500MB" or "2 GB".
+        """
+        if size is None or isinstance(size, (int, float)):
+            return size
+        match = SIZE_PATTERN.match(str(size))
+        if not match:
+            raise TypeError(LOG_COLOR.ERROR.format(message=f'Invalid size {size}, use bytes or a size like 500MB.'))
+        number, unit = match.groups()
+        return int(float(number) * SIZE_MULTIPLIERS[unit.upper().rstrip('B')])
+
+    @classmethod
+    def get_retention(cls, retention):
+        """
+        Parse "retention" from config.yml, {"keep": builds, "max_size": bytes or "500MB"}.
+        """
+        retention = retention or {}
+        keep = retention.get('keep', BUILD_RETENTION_KEEP)
+        return (keep, cls.get_size(retention.get('max_size', BUILD_RETENTION_MAX_SIZE)))
+
+    @staticmethod
+    def get_targets(targets):
+        """
+        Parse "targets" from config.yml, {name: client_id} or {name: {"client_id": ...}}.
+        """
+        parsed = {}
+        for name, target in (targets or {}).items():
+            client_id = target.get('client_id') if isinstance(target, dict) else target
+            if not client_id:
+                raise TypeError(LOG_COLOR.ERROR.format(message=f'Target {name} has no client_id.'))
+            parsed[str(name)] = str(client_id)
+        return parsed
+
     def read_config(self):
-        configs = {}
+        """
+        Return (configs, env) from config.yml and .env, both files are only parsed again after they changed.
+        """
+        configs = dict(load_cached(CONFIG_FILE, parse_yaml) or {})
         env = {}
 
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r") as yamlfile:
-                configs = yaml.load(yamlfile, Loader=yaml.FullLoader) or {}
-                yamlfile.close()
-
-        if os.path.exists(ENV_FILE):
-            env_config.search_path = os.getcwd()
+        env_config = load_cached(ENV_FILE, parse_env)
+        if env_config is not None:
             env['email'] = env_config('email', None)
             env['password'] = env_config('password', None)
 
@@ -55,15 +179,13 @@ class Config(object):
 
     def write_config(self):
         configs, env = self.read_config()
-        new_configs = {
-            'client_id': self.client_id
-        }
+        # keep the optional sections such as "compression" written by hand
+        new_configs = dict(configs, client_id=self.client_id)
         if not configs or configs != new_configs:
             with open(CONFIG_FILE, 'w') as yamlfile:
-                yaml.dump({
-                    'client_id': self.client_id
-                }, yamlfile)
+                yaml.dump(new_configs, yamlfile)
                 yamlfile.close()
+            clear_cache(CONFIG_FILE)
 
             logging.info(LOG_COLOR.INFO.format(message='Configuration was updated.'))
 
@@ -78,6 +200,7 @@ class Config(object):
                     f'password={self.password}'
                 ])
                 envfile.writelines(environments)
+            clear_cache(ENV_FILE)
             logging.info(LOG_COLOR.INFO.format(message='Environment was updated.'))
 
     def save(self):
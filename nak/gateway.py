@@ -1,18 +1,121 @@
+import logging
+import random
+import time
+
 import requests
+from urllib3.exceptions import MaxRetryError
+
+from nak.multipart import MultipartEncoder
+from nak.settings import (API_URL, LOG_COLOR, REQUEST_BACKOFF_FACTOR, REQUEST_BACKOFF_MAX, REQUEST_CONNECT_TIMEOUT,
+                          REQUEST_MAX_RETRIES, REQUEST_POOL_SIZE, REQUEST_READ_TIMEOUT, REQUEST_RETRY_METHODS,
+                          REQUEST_RETRY_STATUS_CODES, REQUEST_UNSENT_RETRY_METHODS, REQUEST_UNSENT_STATUS_CODES)
+from nak.timings import timings
+
+
+def is_replayable(payload, files):
+    """
+    Tell whether a request body can be sent again after a failed attempt.
+    """
+    if files:
+        return False
+    if payload is None or isinstance(payload, (dict, str, bytes)):
+        return True
+    return getattr(payload, 'rewindable', False)
+
 
-from nak.settings import API_URL
+def is_unsent(error):
+    """
+    Tell whether a request failed while connecting, before the server could receive it.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # requests only wraps connection failures in a MaxRetryError, errors once sent are raised as they are
+    reason = error.args[0] if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, MaxRetryError)
 
 
 class Gateway:
-    def __init__(self, email, password, client_id):
+    def __init__(self, email, password, client_id, timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT),
+                 max_retries=REQUEST_MAX_RETRIES, backoff_factor=REQUEST_BACKOFF_FACTOR, session=None):
         self.client_id = client_id
         self.email = email
         self.password = password
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        # gateways of apps pushed together may share the session, and so its connection pool
+        self._session = session
+
+    @property
+    def session(self):
+        """
+        Keep-alive session shared by every request, so uploads reuse pooled connections.
+        """
+        if self._session is None:
+            session = requests.Session()
+            session.auth = requests.auth.HTTPBasicAuth(self.email, self.password)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=REQUEST_POOL_SIZE, pool_maxsize=REQUEST_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def get_retry_delay(self, attempt, response=None):
+        delay = random.uniform(0, min(REQUEST_BACKOFF_MAX, self.backoff_factor * 2 ** attempt))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(REQUEST_BACKOFF_MAX, int(retry_after)))
+        return delay
+
+    def _request(self, request_type, url, payload={}, files=None, headers=None):
+        # requests that are not idempotent are only retried when the server did not process them
+        idempotent = request_type in REQUEST_RETRY_METHODS
+        retryable = (idempotent or request_type in REQUEST_UNSENT_RETRY_METHODS) and is_replayable(payload, files)
+        retry_status_codes = REQUEST_RETRY_STATUS_CODES if idempotent else REQUEST_UNSENT_STATUS_CODES
+        attempt = 0
+        while True:
+            response = None
+            try:
+                with timings.phase('request') as phase:
+                    response = self.session.request(
+                        request_type, url, data=payload, files=files, headers=headers, timeout=self.timeout)
+                    if timings.enabled:
+                        phase.add(bytes_in=len(response.content))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if not retryable or attempt >= self.max_retries or not (idempotent or is_unsent(e)):
+                    raise
+                reason = e.__class__.__name__
+            else:
+                if not retryable or attempt >= self.max_retries or \
+                        response.status_code not in retry_status_codes:
+                    return response
+                reason = f'status {response.status_code}'
+                response.close()
 
-    def _request(self, request_type, url, payload={}, files=None):
-        authenticate = requests.auth.HTTPBasicAuth(self.email, self.password)
-        return requests.request(request_type, url, data=payload, files=files, auth=authenticate)
+            delay = self.get_retry_delay(attempt, response)
+            attempt += 1
+            logging.info(LOG_COLOR.INFO.format(
+                message=f'Request failed with {reason}, retrying in {delay:.1f}s ({attempt}/{self.max_retries}).'))
+            with timings.phase('request.retry_wait'):
+                time.sleep(delay)
+            if hasattr(payload, 'rewind'):
+                payload.rewind()
 
-    def update_app(self, files):
+    def update_app(self, files, callback=None):
+        """
+        Upload the app files as a multipart body streamed from disk, so memory does not grow with
+        the bundle size. Files of unknown size (a pipe) are sent with chunked transfer encoding.
+        callback(bytes_sent, total) reports the upload progress in bytes of the files, part headers left out.
+        """
         url = f"{API_URL}/api/apps/{self.client_id}/"
-        return self._request("PATCH", url, files=files)
+        body = MultipartEncoder(files=files, callback=callback)
+        payload = body if body.rewindable else iter(body)
+        with timings.phase('upload') as phase:
+            response = self._request("PATCH", url, payload=payload, headers={'Content-Type': body.content_type})
+            phase.add(bytes_out=body.bytes_read)
+        return response
@@ -0,0 +1,170 @@
+import os
+import shutil
+import struct
+import subprocess
+
+INDEX_HEADER = struct.Struct('>4sLL')
+# ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size, sha1, flags
+INDEX_ENTRY = struct.Struct('>10L20sH')
+INDEX_EXTENDED_FLAG = 0x4000
+INDEX_NAME_MASK = 0xFFF
+INDEX_STAGE_MASK = 0x3000
+INDEX_CHECKSUM_SIZE = 20
+REGULAR_FILE_MODE = 0o100000
+FILE_TYPE_MASK = 0o170000
+UINT32_MASK = 0xFFFFFFFF
+
+
+def find_git_dir(path):
+    """
+    Return (worktree root, git directory) of the checkout containing path, None outside of one.
+    """
+    directory = os.path.abspath(path)
+    while True:
+        git_path = os.path.join(directory, '.git')
+        if os.path.isdir(git_path):
+            return directory, git_path
+        if os.path.isfile(git_path):
+            # worktrees and submodules have a .git file pointing to their git directory
+            with open(git_path, 'r') as f:
+                content = f.read().strip()
+            if content.startswith('gitdir:'):
+                return directory, os.path.normpath(os.path.join(directory, content[len('gitdir:'):].strip()))
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def read_varint(data, offset):
+    # offset encoding of index v4, every continuation adds one before shifting
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, offset
+
+
+def read_index(index_file):
+    """
+    Parse a git index (versions 2 to 4) into {path: (ctime_ns, mtime_ns, ino, size, sha1)} for the
+    regular files of stage 0. Returns None for an index that can't be used on its own (split index).
+    """
+    with open(index_file, 'rb') as f:
+        data = f.read()
+
+    signature, version, count = INDEX_HEADER.unpack_from(data, 0)
+    if signature != b'DIRC' or version not in (2, 3, 4):
+        raise ValueError(f'Unsupported git index {index_file}.')
+
+    entries = {}
+    offset = INDEX_HEADER.size
+    previous_path = b''
+    for _ in range(count):
+        entry_start = offset
+        (ctime, ctime_ns, mtime, mtime_ns, _, ino, mode, _, _, size, sha1,
+         flags) = INDEX_ENTRY.unpack_from(data, offset)
+        offset += INDEX_ENTRY.size
+        if flags & INDEX_EXTENDED_FLAG:
+            offset += 2
+
+        if version == 4:
+            strip, offset = read_varint(data, offset)
+            end = data.index(b'\0', offset)
+            path = previous_path[:len(previous_path) - strip] + data[offset:end]
+            offset = end + 1
+        else:
+            name_length = flags & INDEX_NAME_MASK
+            end = offset + name_length if name_length < INDEX_NAME_MASK else data.index(b'\0', offset)
+            path = data[offset:end]
+            # entries are padded with 1 to 8 NUL bytes to a multiple of 8
+            offset = entry_start + ((end - entry_start + 8) & ~7)
+        previous_path = path
+
+        if flags & INDEX_STAGE_MASK or mode & FILE_TYPE_MASK != REGULAR_FILE_MODE:
+            continue
+        entries[os.fsdecode(path)] = (
+            ctime * 10 ** 9 + ctime_ns, mtime * 10 ** 9 + mtime_ns, ino, size, sha1.hex())
+
+    while offset + 8 <= len(data) - INDEX_CHECKSUM_SIZE:
+        extension, extension_size = struct.unpack_from('>4sL', data, offset)
+        if extension == b'link':
+            return None
+        offset += 8 + extension_size
+    return entries
+
+
+def list_git_files(path):
+    """
+    Return the tracked and the untracked but not ignored files under path, relative to it, from
+    "git ls-files". None when git is not installed or path is not in a checkout.
+    """
+    git = shutil.which('git')
+    if git is None:
+        return None
+    try:
+        result = subprocess.run(
+            [git, 'ls-files', '-z', '--cached', '--others', '--exclude-standard', '--', '.'],
+            cwd=path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    # a file deleted from the working tree but not from the index is still listed once
+    names = dict.fromkeys(os.fsdecode(name) for name in result.stdout.split(b'\0') if name)
+    return [name for name in names if os.path.isfile(os.path.join(path, name))]
+
+
+class GitIndex(object):
+    """
+    The stat cache of the git index of the checkout an app lives in.
+
+    A file whose stat still matches its index entry has the content git recorded, so the blob
+    sha1 of the entry identifies the content without reading the file. Entries written in the
+    same second as the index (racily clean in git terms) are never trusted.
+    Paths are relative to the app root, like the archive members.
+    """
+
+    def __init__(self, root='.'):
+        self.root = root
+        self.entries = {}
+        self.index_mtime_ns = 0
+
+        found = find_git_dir(root)
+        if found is None:
+            return
+        worktree, git_dir = found
+        index_file = os.path.join(git_dir, 'index')
+        try:
+            index_mtime_ns = os.stat(index_file).st_mtime_ns
+            entries = read_index(index_file)
+        except (OSError, ValueError, struct.error):
+            return
+        if entries is None:
+            return
+
+        prefix = os.path.relpath(os.path.abspath(root), worktree).replace(os.sep, '/')
+        prefix = '' if prefix == '.' else prefix + '/'
+        self.index_mtime_ns = index_mtime_ns
+        self.entries = {path[len(prefix):]: entry for path, entry in entries.items() if path.startswith(prefix)}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_blob(self, arcname, stat):
+        """
+        Return the blob sha1 of a file when its stat matches the index, None when it may have changed.
+        """
+        entry = self.entries.get(arcname)
+        if entry is None:
+            return None
+        ctime_ns, mtime_ns, ino, size, sha1 = entry
+        if mtime_ns >= self.index_mtime_ns - 10 ** 9:
+            return None
+        if stat.st_mtime_ns != mtime_ns or stat.st_ctime_ns != ctime_ns or stat.st_size & UINT32_MASK != size:
+            return None
+        if ino and stat.st_ino & UINT32_MASK != ino:
+            return None
+        return sha1
@@ -0,0 +1,125 @@
+import os
+import re
+
+from nak.settings import NAKIGNORE_FILE, ZIP_EXCLUDE_FILES
+
+
+def translate_glob(glob):
+    """
+    Translate a gitignore glob without its leading and trailing slashes to a regex.
+    """
+    regex = ''
+    index = 0
+    while index < len(glob):
+        char = glob[index]
+        if glob.startswith('**/', index) and (index == 0 or glob[index - 1] == '/'):
+            regex += '(?:.*/)?'
+            index += 3
+            continue
+        if glob.startswith('**', index) and index + 2 == len(glob) and (index == 0 or glob[index - 1] == '/'):
+            regex += '.*'
+            index += 2
+            continue
+
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '\\' and index + 1 < len(glob):
+            index += 1
+            regex += re.escape(glob[index])
+        elif char == '[':
+            end = glob.find(']', index + 2)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                characters = glob[index + 1:end].replace('\\', '\\\\')
+                if characters.startswith('!'):
+                    characters = '^' + characters[1:]
+                regex += f'[{characters}]'
+                index = end
+        else:
+            regex += re.escape(char)
+        index += 1
+    return regex
+
+
+def parse_pattern(line):
+    """
+    Parse a .nakignore line into (regex, negated, directory_only), None for blanks and comments.
+    """
+    line = line.rstrip('\n')
+    if not line.endswith('\\ '):
+        line = line.rstrip()
+    if not line or line.startswith('#'):
+        return None
+
+    negated = line.startswith('!')
+    if negated or line.startswith('\\!') or line.startswith('\\#'):
+        line = line[1:]
+
+    directory_only = line.endswith('/')
+    line = line.rstrip('/')
+    # patterns with a slash other than a trailing one are relative to the app root
+    anchored = '/' in line
+    line = line.lstrip('/')
+    if not line:
+        return None
+
+    regex = translate_glob(line)
+    if not anchored:
+        regex = f'(?:.*/)?{regex}'
+    return regex, negated, directory_only
+
+
+class IgnoreMatcher(object):
+    """
+    Match app relative paths against gitignore-style patterns.
+
+    All patterns are compiled into one regex per entry type, in reverse order so the first
+    alternative that matches is the last pattern of the file, which decides like in git.
+    Directories are matched as well so the file walker can skip them without entering.
+    Paths matched by the excluded matcher are ignored whatever the patterns, no negation
+    can include them again.
+    """
+
+    def __init__(self, lines=(), excluded=None):
+        self.excluded = excluded
+        patterns = [pattern for pattern in (parse_pattern(line) for line in lines) if pattern]
+        self.negated = {}
+        file_groups = []
+        dir_groups = []
+        for index in reversed(range(len(patterns))):
+            regex, negated, directory_only = patterns[index]
+            self.negated[f'p{index}'] = negated
+            group = f'(?P<p{index}>{regex})'
+            dir_groups.append(group)
+            if not directory_only:
+                file_groups.append(group)
+
+        self.file_regex = re.compile('|'.join(file_groups)) if file_groups else None
+        self.dir_regex = re.compile('|'.join(dir_groups)) if dir_groups else None
+
+    def match(self, path, is_dir=False):
+        if self.excluded is not None and self.excluded.match(path, is_dir):
+            return True
+        regex = self.dir_regex if is_dir else self.file_regex
+        if regex is None:
+            return False
+        match = regex.fullmatch(path)
+        if match is None:
+            return False
+        return not self.negated[match.lastgroup]
+
+
+def get_ignore_matcher(root):
+    """
+    Build the matcher of an app from the .nakignore file at its root, ZIP_EXCLUDE_FILES are
+    matched on their own first so the credentials in .env and config.yml are never zipped.
+    """
+    lines = []
+    ignore_file = os.path.join(root, NAKIGNORE_FILE)
+    if os.path.exists(ignore_file):
+        with open(ignore_file, 'r') as f:
+            lines.extend(f.readlines())
+    return IgnoreMatcher(lines, excluded=IgnoreMatcher(ZIP_EXCLUDE_FILES))
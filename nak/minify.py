@@ -0,0 +1,283 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from nak.settings import LOG_COLOR, MINIFY_CACHE_DIRECTORY
+
+# bump when a minifier changes its output, cached results of older versions are then ignored
+MINIFY_VERSION = 3
+
+JSON_TOKEN = re.compile(r'("(?:\\.|[^"\\])*")|\s+')
+
+CSS_TOKEN = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)|([^"'/]+|/)''', re.S)
+CSS_PUNCTUATION = re.compile(r' ?([{};,>]) ?')
+
+JS_TOKEN = re.compile(r'''
+    (?P<space>\s+)
+    |(?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    |(?P<template>`)
+    |(?P<comment>/\*.*?\*/)
+    |(?P<line_comment>//[^\n]*)
+    |(?P<slash>/)
+    |(?P<word>[\w$]+)
+    |(?P<other>.)
+''', re.S | re.X)
+JS_REGEX_LITERAL = re.compile(r'/(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n\[])+/[A-Za-z]*')
+# after these words a slash starts a regex literal, after other words it is a division
+JS_REGEX_KEYWORDS = frozenset([
+    'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw', 'case', 'do', 'else',
+    'yield', 'await',
+])
+
+HTML_TOKEN = re.compile(
+    r'(<(pre|textarea|script|style)\b.*?</\2\s*>)|(<!--(?!\[if|>).*?-->)'
+    r'|(<[A-Za-z](?:"[^"]*"|\'[^\']*\'|[^"\'>])*>)|(\s+)', re.S | re.I)
+HTML_ATTRIBUTE_TOKEN = re.compile(r'("[^"]*"|\'[^\']*\')|(\s+)')
+SVG_TOKEN = re.compile(r'(<(text|style|script)\b.*?</\2\s*>)|(<!--.*?-->\s*)|(>\s+(?=<))|(\s+)', re.S | re.I)
+
+
+def squeeze_whitespace(space):
+    # a line break is kept where there was one, so no statement or template tag gets joined
+    return '\n' if '\n' in space else ' '
+
+
+def scan_template(text, position):
+    """
+    Return the end of the template literal starting at position, following its ${} substitutions
+    with the strings, comments and template literals nested in them. An unterminated template
+    runs to the end of the text.
+    """
+    position += 1
+    while position < len(text):
+        if text[position] == '\\':
+            position += 2
+        elif text[position] == '`':
+            return position + 1
+        elif text.startswith('${', position):
+            position = scan_substitution(text, position + 2)
+        else:
+            position += 1
+    return len(text)
+
+
+def scan_substitution(text, position):
+    # end of the ${ expression starting at position, after its closing brace
+    depth = 1
+    while position < len(text):
+        match = JS_TOKEN.match(text, position)
+        token = match.group()
+        if match.lastgroup == 'template':
+            position = scan_template(text, position)
+            continue
+        position = match.end()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if not depth:
+                break
+    return position
+
+
+def minify_json(text):
+    """
+    Drop the whitespace between tokens, strings and numbers are kept as written.
+    """
+    json.loads(text)
+    return JSON_TOKEN.sub(lambda match: match.group(1) or '', text)
+
+
+def minify_css(text):
+    """
+    Drop comments (except /*! ones) and whitespace around braces, semicolons, commas and child
+    combinators. Strings are kept as written.
+    """
+    pieces = []
+    code = []
+
+    def flush():
+        if code:
+            squeezed = CSS_PUNCTUATION.sub(r'\1', re.sub(r'\s+', ' ', ''.join(code))).replace(';}', '}')
+            if pieces and pieces[-1].startswith('/*'):
+                squeezed = squeezed.lstrip()
+            pieces.append(squeezed)
+            code.clear()
+
+    for string, comment, other in CSS_TOKEN.findall(text):
+        if string or (comment and comment.startswith('/*!')):
+            flush()
+            pieces.append(string or comment)
+        elif comment:
+            code.append(' ')
+        else:
+            code.append(other)
+    flush()
+    return ''.join(pieces).strip()
+
+
+def minify_js(text):
+    """
+    Drop comments (except /*! ones) and indentation and collapse runs of spaces. Line breaks are
+    kept, so automatic semicolon insertion is unaffected, and strings, template literals and
+    regex literals are copied as written. A slash after ) or ] followed by what reads as a regex
+    literal could be either, it raises ValueError so the file is kept as it is.
+    """
+    output = []
+    pending_space = None
+    previous = None
+    position = 0
+    while position < len(text):
+        match = JS_TOKEN.match(text, position)
+        kind = match.lastgroup
+        token = match.group()
+        position = match.end()
+
+        if kind == 'space':
+            pending_space = '\n' if '\n' in token or pending_space == '\n' else ' '
+            continue
+        if kind == 'line_comment' or (kind == 'comment' and not token.startswith('/*!')):
+            space = '\n' if '\n' in token else ' '
+            pending_space = '\n' if pending_space == '\n' else space
+            continue
+
+        if kind == 'template':
+            position = scan_template(text, match.start())
+            token = text[match.start():position]
+        elif kind == 'slash':
+            is_division = previous is not None and (
+                previous[0].isalnum() or previous[0] in '_$') and previous not in JS_REGEX_KEYWORDS
+            literal = None if is_division else JS_REGEX_LITERAL.match(text, match.start())
+            if literal is not None and previous in (')', ']'):
+                # if (x) /a  b/.test(y) or (a) / b / c, only a parser can tell
+                raise ValueError(f'Ambiguous slash at {match.start()}')
+            if literal is not None:
+                token = literal.group()
+                position = literal.end()
+
+        if pending_space is not None and output:
+            output.append(pending_space)
+        pending_space = None
+        output.append(token)
+        previous = token
+    return ''.join(output)
+
+
+def minify_html(text):
+    """
+    Drop HTML comments (except conditional ones) and collapse whitespace, leaving pre, textarea,
+    script and style elements and quoted attribute values untouched. Template tags only have
+    their whitespace collapsed.
+    """
+    def replace_in_tag(match):
+        value, space = match.groups()
+        return value or squeeze_whitespace(space)
+
+    def replace(match):
+        preserved, _, comment, tag, space = match.groups()
+        if preserved:
+            return preserved
+        if comment:
+            return ''
+        if tag:
+            return HTML_ATTRIBUTE_TOKEN.sub(replace_in_tag, tag)
+        return squeeze_whitespace(space)
+
+    return HTML_TOKEN.sub(replace, text).strip()
+
+
+def minify_svg(text):
+    """
+    Drop comments and the whitespace between tags, text, style and script elements are kept.
+    """
+    def replace(match):
+        preserved, _, comment, between_tags, space = match.groups()
+        if preserved:
+            return preserved
+        if comment:
+            return ''
+        if between_tags:
+            return '>'
+        return ' '
+
+    return SVG_TOKEN.sub(replace, text).strip()
+
+
+MINIFIERS = {
+    '.html': minify_html,
+    '.css': minify_css,
+    '.js': minify_js,
+    '.json': minify_json,
+    '.svg': minify_svg,
+}
+
+
+class Minifier(object):
+    """
+    Minify text assets before they are compressed.
+
+    Results are cached on disk under the sha256 of the minifier version, extension and content,
+    so unchanged files are never minified again, even after the build manifest was lost.
+    A file that can't be decoded or parsed is kept as it is.
+    """
+
+    def __init__(self, extensions=None, cache_directory=MINIFY_CACHE_DIRECTORY):
+        extensions = sorted(MINIFIERS) if extensions is None else extensions
+        self.extensions = set()
+        for extension in extensions:
+            extension = extension.lower()
+            if not extension.startswith('.'):
+                extension = f'.{extension}'
+            if extension not in MINIFIERS:
+                raise TypeError(LOG_COLOR.ERROR.format(
+                    message=f'Can not minify {extension} files, use some of {", ".join(sorted(MINIFIERS))}.'))
+            self.extensions.add(extension)
+        self.cache_directory = cache_directory
+
+    def can_minify(self, path):
+        return os.path.splitext(path)[1].lower() in self.extensions
+
+    def get_cache_file(self, extension, data):
+        key = hashlib.sha256(f'{MINIFY_VERSION}:{extension}:'.encode('utf-8') + data).hexdigest()
+        return os.path.join(self.cache_directory, key[:2], key)
+
+    def read_cache(self, cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write_cache(self, cache_file, data):
+        # written next to its final name then renamed, so a concurrent reader never sees half of it
+        directory = os.path.dirname(cache_file)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary_file = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary_file, cache_file)
+        except OSError:
+            if os.path.exists(temporary_file):
+                os.remove(temporary_file)
+
+    def minify(self, path, data):
+        """
+        Return the minified content of a file read as data, or data when it is not smaller.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        cache_file = self.get_cache_file(extension, data)
+        cached = self.read_cache(cache_file)
+        if cached is not None:
+            return cached
+
+        try:
+            minified = MINIFIERS[extension](data.decode('utf-8')).encode('utf-8')
+        except (UnicodeDecodeError, ValueError):
+            minified = data
+        if len(minified) >= len(data):
+            minified = data
+
+        self.write_cache(cache_file, minified)
+        return minified
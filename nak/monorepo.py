@@ -0,0 +1,98 @@
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from nak.settings import CONFIG_FILE_NAME, ENV_FILE_NAME, LOG_COLOR, MONOREPO_EXCLUDE_DIRECTORIES
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+# "2020-01-01 01:01:01 INFO " in front of every log line
+LOG_PREFIX = re.compile(r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d \w+ ')
+APP_MARKERS = [os.path.basename(CONFIG_FILE_NAME), os.path.basename(ENV_FILE_NAME)]
+
+
+def is_app_root(path):
+    return any(os.path.isfile(os.path.join(path, marker)) for marker in APP_MARKERS)
+
+
+def find_app_roots(path='.'):
+    """
+    Return the directories under path with a config.yml or .env file, sorted.
+    Apps don't nest, an app directory is not searched further.
+    """
+    if is_app_root(path):
+        return [path]
+
+    roots = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_dir() or entry.name.startswith('.') or entry.name in MONOREPO_EXCLUDE_DIRECTORIES:
+                continue
+            roots.extend(find_app_roots(entry.path))
+    return sorted(roots)
+
+
+class AppResult(object):
+    def __init__(self, root, returncode, seconds, output):
+        self.root = root
+        self.returncode = returncode
+        self.seconds = seconds
+        self.output = output
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    @property
+    def lines(self):
+        lines = (LOG_PREFIX.sub('', ANSI_ESCAPE.sub('', line)).strip() for line in self.output.splitlines())
+        return [line for line in lines if line]
+
+    @property
+    def message(self):
+        lines = self.lines
+        return lines[-1] if lines else ''
+
+
+def run_app(root, argv):
+    """
+    Run "nak <argv>" in its own interpreter with root as working directory, the way a single app
+    is built or pushed, so the apps don't share the config, caches or logs of the process.
+    """
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+
+    started = time.monotonic()
+    process = subprocess.run(
+        [sys.executable, '-m', 'nak.nak'] + argv, cwd=root, env=env, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, universal_newlines=True)
+    return AppResult(root, process.returncode, time.monotonic() - started, process.stdout)
+
+
+def run_apps(roots, argv, workers):
+    """
+    Run argv for every app, at most workers at a time, and return the results in roots order.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_app, root, argv) for root in roots]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.root] = result
+            status = 'done' if result.ok else 'failed'
+            log_color = LOG_COLOR.INFO if result.ok else LOG_COLOR.ERROR
+            logging.info(log_color.format(message=f'{argv[0]} {result.root} {status} in {result.seconds:.1f}s.'))
+    return [results[root] for root in roots]
+
+
+def format_summary(results):
+    width = max([len(result.root) for result in results] + [3])
+    lines = [f'{"app":<{width}} {"status":<7} {"time s":>8}  message']
+    for result in results:
+        status = 'ok' if result.ok else 'failed'
+        lines.append(f'{result.root:<{width}} {status:<7} {result.seconds:>8.1f}  {result.message}')
+    return lines
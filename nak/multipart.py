@@ -0,0 +1,176 @@
+import binascii
+import os
+import sys
+
+from nak.settings import UPLOAD_CHUNK_SIZE
+
+
+def format_header_param(name, value):
+    value = value.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+    return f'{name}="{value}"'
+
+
+def get_file_size(fileobj):
+    """
+    Return the number of bytes left to read in a file object, None when it is not seekable.
+    """
+    seekable = getattr(fileobj, 'seekable', None)
+    if seekable is not None and not seekable():
+        return None
+
+    position = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell() - position
+    fileobj.seek(position)
+    return size
+
+
+class BufferReader(object):
+    """
+    Read-only file object over a buffer (bytes, mmap) with a position of its own.
+    Several readers can share one archive mapped in memory, each upload reading it at its pace.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.size = len(buffer)
+        self.position = 0
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        # slicing copies only the chunk read, the mmap has no shared position to move
+        data = self.buffer[self.position:end]
+        self.position += len(data)
+        return data
+
+
+class MultipartEncoder(object):
+    """
+    File-like multipart/form-data body streamed from disk in fixed-size chunks.
+
+    Accepts the same fields and files arguments as requests, but only the small part headers are
+    kept in memory, so the body can be passed to requests as data with a known Content-Length.
+    When a file is not seekable (a pipe) its size is unknown, len is None and the body has to be
+    sent with chunked transfer encoding by iterating over the encoder.
+    callback(bytes_read, total) is called after every chunk read with the bytes of the files only,
+    so a progress bar matches their size whatever the size of the part headers.
+    """
+
+    def __init__(self, fields=None, files=None, boundary=None, chunk_size=UPLOAD_CHUNK_SIZE, callback=None):
+        self.boundary = boundary or binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.chunk_size = chunk_size
+        self.callback = callback
+
+        # each part is (data, size, is_file), the size of a file part is None when it is unknown
+        self.parts = []
+        for name, value in (fields or {}).items():
+            if not isinstance(value, bytes):
+                value = str(value).encode('utf-8')
+            self.add_bytes(self.get_part_header(name))
+            self.add_bytes(value + b'\r\n')
+
+        for name, value in (files or {}).items():
+            content_type = None
+            if len(value) == 3:
+                filename, fileobj, content_type = value
+            else:
+                filename, fileobj = value
+            self.add_bytes(self.get_part_header(name, filename, content_type))
+            self.parts.append((fileobj, get_file_size(fileobj), True))
+            self.add_bytes(b'\r\n')
+
+        self.add_bytes(f'--{self.boundary}--\r\n'.encode('ascii'))
+
+        sizes = [size for part, size, is_file in self.parts]
+        self.len = None if None in sizes else sum(sizes)
+        file_sizes = [size for part, size, is_file in self.parts if is_file]
+        self.payload_len = None if None in file_sizes else sum(file_sizes)
+        self.file_positions = {
+            id(part): part.tell() for part, size, is_file in self.parts if is_file and size is not None}
+        self.rewind()
+
+    def __len__(self):
+        if self.len is None:
+            raise TypeError('Length of a streamed multipart body is unknown.')
+        return self.len
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), b'')
+
+    @property
+    def rewindable(self):
+        return self.len is not None
+
+    def add_bytes(self, data):
+        self.parts.append((data, len(data), False))
+
+    def get_part_header(self, name, filename=None, content_type=None):
+        disposition = f'form-data; {format_header_param("name", name)}'
+        if filename is not None:
+            disposition += f'; {format_header_param("filename", filename)}'
+        lines = [f'--{self.boundary}', f'Content-Disposition: {disposition}']
+        if content_type:
+            lines.append(f'Content-Type: {content_type}')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+    def rewind(self):
+        """
+        Start reading the body again from the beginning, used when a request is retried.
+        """
+        self.part_index = 0
+        self.part_offset = 0
+        self.bytes_read = 0
+        self.payload_read = 0
+        for part, size, is_file in self.parts:
+            if id(part) in self.file_positions:
+                part.seek(self.file_positions[id(part)])
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = sys.maxsize if self.len is None else self.len - self.bytes_read
+
+        chunks = []
+        wanted = size
+        while wanted > 0 and self.part_index < len(self.parts):
+            part, part_size, is_file = self.parts[self.part_index]
+            if not is_file:
+                chunk = part[self.part_offset:self.part_offset + wanted]
+                finished = self.part_offset + len(chunk) >= part_size
+            elif part_size is None:
+                chunk = part.read(min(wanted, self.chunk_size))
+                finished = not chunk
+            else:
+                chunk = part.read(min(wanted, part_size - self.part_offset))
+                if not chunk and self.part_offset < part_size:
+                    raise IOError('File changed size while it was being uploaded.')
+                finished = self.part_offset + len(chunk) >= part_size
+
+            if is_file:
+                self.payload_read += len(chunk)
+            self.part_offset += len(chunk)
+            wanted -= len(chunk)
+            chunks.append(chunk)
+            if finished:
+                self.part_index += 1
+                self.part_offset = 0
+
+        data = b''.join(chunks)
+        self.bytes_read += len(data)
+        if data and self.callback:
+            self.callback(self.payload_read, self.payload_len)
+        return data
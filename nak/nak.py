@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 import logging
-
-from requests.exceptions import HTTPError
+import os
+import sys
 
 from nak.parser import Parser
+from nak.settings import SERVE_COMMANDS, SERVE_DISABLE_ENV, SERVE_SOCKET_PATH
 
 logging.basicConfig(
     format='%(asctime)s %(levelname)s %(message)s',
@@ -12,20 +13,57 @@ logging.basicConfig(
 )
 
 
-def main():
-    parser = Parser().create_parser()
-    args = parser.parse_args()
-    try:
-        args.func(args)
-    except AttributeError:
+def run(args):
+    """
+    Run a parsed command line, the exit status is 1 when the command failed.
+    """
+    if not hasattr(args, 'func'):
+        # no command given
         print('Use nak -h or --help to see available commands')
-    except (TypeError, HTTPError) as e:
+        return 0
+
+    try:
+        if getattr(args, 'timings', None) or getattr(args, 'profile', None):
+            from nak.timings import instrument
+            with instrument(args.timings, args.profile):
+                result = args.func(args)
+        else:
+            result = args.func(args)
+    except TypeError as e:
         # print new line for support error on process progress bar
         print()
         logging.exception(e, exc_info=False)
+        return 1
     except KeyboardInterrupt:
         pass
+    except Exception as e:
+        # requests is only imported by the commands using it, a failure before can't be an HTTPError
+        from requests.exceptions import HTTPError
+        if not isinstance(e, HTTPError):
+            raise
+        print()
+        logging.exception(e, exc_info=False)
+        return 1
+    else:
+        # commands return False when they failed without raising, like a rejected upload
+        return 1 if result is False else 0
+
+
+def main():
+    """
+    Run the command line, in the "nak serve" of the app when one is running.
+    """
+    argv = sys.argv[1:]
+    is_served = argv and argv[0] in SERVE_COMMANDS and not os.environ.get(SERVE_DISABLE_ENV)
+    if is_served and os.path.exists(SERVE_SOCKET_PATH):
+        from nak.server import forward
+        status = forward(argv)
+        if status is not None:
+            return status
+
+    parser = Parser().create_parser()
+    return run(parser.parse_args(argv))
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
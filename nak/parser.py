@@ -1,12 +1,66 @@
 import argparse
 
-from .command import Command
+from nak.settings import COMPRESSION_LEVEL_AUTO, DISCOVERY_GIT, DISCOVERY_WALK
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive number')
+    return number
+
+
+def compression_level(value):
+    if value == COMPRESSION_LEVEL_AUTO:
+        return value
+    if not value.isdigit() or not 0 <= int(value) <= 9:
+        raise argparse.ArgumentTypeError(f'{value} is not auto or a level between 0 and 9')
+    return int(value)
 
 
 class Parser:
     def __init__(self):
-        self.command = Command()
-        pass
+        self._command = None
+
+    @property
+    def command(self):
+        # config, requests and zipfile are only loaded once a command really runs, not for --help
+        if self._command is None:
+            from .command import Command
+            self._command = Command()
+        return self._command
+
+    def reset_command(self):
+        # "nak serve" reloads the config when config.yml or .env changed
+        self._command = None
+
+    def get_handler(self, name):
+        def handler(args):
+            return getattr(self.command, name)(args)
+        return handler
+
+    def create_instrument_parser(self):
+        # options shared by the commands that build, upload or analyze
+        parser = argparse.ArgumentParser(add_help=False)
+        parser.add_argument(
+            '--timings', nargs='?', const='-', default=None, metavar='FILE',
+            help='print the time, CPU time and bytes of every phase, or write them as JSON to FILE')
+        parser.add_argument(
+            '--profile', nargs='?', const='nak.prof', default=None, metavar='FILE',
+            help='run the command under cProfile and dump the stats to FILE (default: nak.prof)')
+        return parser
+
+    def serve(self, args):
+        from nak.server import Daemon
+        return Daemon(self).serve()
+
+    def add_all_arguments(self, parser, name):
+        parser.add_argument(
+            '--all', action='store_true',
+            help=f'{name} every app below the current directory, an app is a directory with a config.yml or .env file')
+        parser.add_argument(
+            '--processes', type=positive_int, default=None,
+            help='number of apps to run at the same time with --all')
 
     def create_parser(self):
         # create the top-level parser
@@ -19,6 +73,10 @@ available commands:
     setup         Initialize a new app, will create config at config.yml and environment at .env file
     build         Compress file as zip
     push          Upload file to app server
+    deploy        Compress and upload files in one step, without a zip file on disk
+    watch         Rebuild, and optionally push, whenever a file changes
+    analyze       Report the size of the build by directory, extension and file
+    serve         Keep nak running for the app, build, push, deploy and analyze then run in it
 ''',
             usage=argparse.SUPPRESS,
             epilog='Use "nak [command] --help" for more information about a command.',
@@ -26,6 +84,7 @@ available commands:
             add_help=argparse.SUPPRESS
         )
         subparsers = parser.add_subparsers(title='Available Commands', help=argparse.SUPPRESS)
+        instrument_parser = self.create_instrument_parser()
 
         # create the parser for the "setup" command
         parser_setup = subparsers.add_parser(
@@ -38,29 +97,150 @@ Usage:
         ''',
             formatter_class=argparse.RawTextHelpFormatter
         )
-        parser_setup.set_defaults(func=self.command.setup)
+        parser_setup.set_defaults(func=self.get_handler('setup'))
         # create the parser for the "build" command
         parser_build = subparsers.add_parser(
             'build',
             help='build',
+            parents=[instrument_parser],
             usage=argparse.SUPPRESS,
             description='''
 Usage:
-    nak build
+    nak build [--jobs N] [--minify] [--discovery walk|git] [--level auto|0-9] [--all [--processes N]]
+              [--timings [FILE]] [--profile [FILE]]
         ''',
             formatter_class=argparse.RawTextHelpFormatter
         )
-        parser_build.set_defaults(func=self.command.build)
+        parser_build.add_argument(
+            '-j', '--jobs', type=positive_int, default=None,
+            help='number of threads compressing files, 1 builds serially (default: number of CPUs)')
+        parser_build.add_argument(
+            '--minify', action='store_true', help='minify html, css, js, json and svg files before compressing them')
+        parser_build.add_argument(
+            '--discovery', choices=[DISCOVERY_WALK, DISCOVERY_GIT], default=None,
+            help='find files by walking the directory or with git, reusing its index (default: walk)')
+        parser_build.add_argument(
+            '--level', type=compression_level, default=None, metavar='auto|0-9',
+            help='deflate level of the files without a level in config.yml, auto to fit the upload rate')
+        self.add_all_arguments(parser_build, 'build')
+        parser_build.set_defaults(func=self.get_handler('build'))
         # create the parser for the "push" command
         parser_push = subparsers.add_parser(
             'push',
             help='push',
+            parents=[instrument_parser],
+            usage=argparse.SUPPRESS,
+            description='''
+Usage:
+    nak push [--force] [--targets NAME,...] [--all [--processes N]] [--timings [FILE]] [--profile [FILE]]
+        ''',
+            formatter_class=argparse.RawTextHelpFormatter
+        )
+        parser_push.add_argument(
+            '--force', action='store_true', help='upload even when this build was the last one pushed to the app')
+        parser_push.add_argument(
+            '--targets', type=lambda value: [name for name in value.split(',') if name], default=None,
+            metavar='NAME,...', help='push to the apps of these targets of config.yml at the same time')
+        self.add_all_arguments(parser_push, 'push')
+        parser_push.set_defaults(func=self.get_handler('push'))
+        # create the parser for the "deploy" command
+        parser_deploy = subparsers.add_parser(
+            'deploy',
+            help='deploy',
+            parents=[instrument_parser],
+            usage=argparse.SUPPRESS,
+            description='''
+Usage:
+    nak deploy [--jobs N] [--minify] [--discovery walk|git] [--level auto|0-9] [--force]
+               [--timings [FILE]] [--profile [FILE]]
+        ''',
+            formatter_class=argparse.RawTextHelpFormatter
+        )
+        parser_deploy.add_argument(
+            '-j', '--jobs', type=positive_int, default=None,
+            help='number of threads compressing files, 1 builds serially (default: number of CPUs)')
+        parser_deploy.add_argument(
+            '--minify', action='store_true', help='minify html, css, js, json and svg files before compressing them')
+        parser_deploy.add_argument(
+            '--force', action='store_true', help='upload even when this build was the last one pushed to the app')
+        parser_deploy.add_argument(
+            '--discovery', choices=[DISCOVERY_WALK, DISCOVERY_GIT], default=None,
+            help='find files by walking the directory or with git, reusing its index (default: walk)')
+        parser_deploy.add_argument(
+            '--level', type=compression_level, default=None, metavar='auto|0-9',
+            help='deflate level of the files without a level in config.yml, auto to fit the upload rate')
+        parser_deploy.set_defaults(func=self.get_handler('deploy'))
+        # create the parser for the "watch" command
+        parser_watch = subparsers.add_parser(
+            'watch',
+            help='watch',
+            usage=argparse.SUPPRESS,
+            description='''
+Usage:
+    nak watch [--push] [--jobs N] [--minify] [--discovery walk|git] [--level auto|0-9]
+              [--interval SECONDS] [--debounce SECONDS]
+        ''',
+            formatter_class=argparse.RawTextHelpFormatter
+        )
+        parser_watch.add_argument('--push', action='store_true', help='push after every successful build')
+        parser_watch.add_argument(
+            '-j', '--jobs', type=positive_int, default=None,
+            help='number of threads compressing files, 1 builds serially (default: number of CPUs)')
+        parser_watch.add_argument(
+            '--interval', type=float, default=None,
+            help='seconds between scans when inotify is not available (default: 1)')
+        parser_watch.add_argument(
+            '--debounce', type=float, default=None,
+            help='seconds without changes before rebuilding (default: 0.3)')
+        parser_watch.add_argument(
+            '--minify', action='store_true', help='minify html, css, js, json and svg files before compressing them')
+        parser_watch.add_argument(
+            '--discovery', choices=[DISCOVERY_WALK, DISCOVERY_GIT], default=None,
+            help='find files by walking the directory or with git, reusing its index (default: walk)')
+        parser_watch.add_argument(
+            '--level', type=compression_level, default=None, metavar='auto|0-9',
+            help='deflate level of the files without a level in config.yml, auto to fit the upload rate')
+        parser_watch.set_defaults(func=self.get_handler('watch'))
+        # create the parser for the "analyze" command
+        parser_analyze = subparsers.add_parser(
+            'analyze',
+            help='analyze',
+            parents=[instrument_parser],
+            usage=argparse.SUPPRESS,
+            description='''
+Usage:
+    nak analyze [--file ZIP | --scan] [--top N] [--depth N] [--json [FILE]] [--max-size SIZE]
+                [--timings [FILE]] [--profile [FILE]]
+        ''',
+            formatter_class=argparse.RawTextHelpFormatter
+        )
+        parser_analyze.add_argument(
+            '--file', default=None, metavar='ZIP', help='zip to analyze (default: the latest build in .tmp)')
+        parser_analyze.add_argument(
+            '--scan', action='store_true',
+            help='compress the files of the app to measure them instead of reading a zip')
+        parser_analyze.add_argument(
+            '--top', type=positive_int, default=None, help='number of heaviest files listed (default: 10)')
+        parser_analyze.add_argument(
+            '--depth', type=positive_int, default=None,
+            help='number of leading directories files are grouped by (default: 1)')
+        parser_analyze.add_argument(
+            '--json', nargs='?', const='-', default=None, metavar='FILE',
+            help='print the report as JSON, or write it to FILE')
+        parser_analyze.add_argument(
+            '--max-size', default=None, metavar='SIZE',
+            help='fail when the zip is bigger than SIZE, in bytes or like 500MB')
+        parser_analyze.set_defaults(func=self.get_handler('analyze'))
+        # create the parser for the "serve" command
+        parser_serve = subparsers.add_parser(
+            'serve',
+            help='serve',
             usage=argparse.SUPPRESS,
             description='''
 Usage:
-    nak push
+    nak serve
         ''',
             formatter_class=argparse.RawTextHelpFormatter
         )
-        parser_push.set_defaults(func=self.command.push)
+        parser_serve.set_defaults(func=self.serve)
         return parser
@@ -0,0 +1,98 @@
+import logging
+import sys
+import time
+
+from nak.settings import LOG_COLOR, PROGRESS_LOG_INTERVAL, PROGRESS_REDRAW_INTERVAL
+
+SIZE_UNITS = ['B', 'KB', 'MB', 'GB', 'TB']
+
+
+def format_size(size):
+    for unit in SIZE_UNITS[:-1]:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = SIZE_UNITS[-1]
+    return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+
+
+class Progress(object):
+    """
+    Progress of a task counted in bytes, so one big video weighs more than many small templates.
+
+    On a terminal the bar is redrawn in place at most every PROGRESS_REDRAW_INTERVAL seconds,
+    otherwise (CI logs) a line is logged at most every PROGRESS_LOG_INTERVAL seconds plus a
+    final one. total may be None, or set later by report(), when the size is not known yet.
+    """
+
+    def __init__(self, total=None, prefix='Progress:', stream=None, is_tty=None, enabled=True, length=50,
+                 redraw_interval=PROGRESS_REDRAW_INTERVAL, log_interval=PROGRESS_LOG_INTERVAL):
+        self.total = total
+        self.prefix = prefix
+        self.stream = stream or sys.stdout
+        self.is_tty = self.stream.isatty() if is_tty is None else is_tty
+        self.enabled = enabled
+        self.length = length
+        self.interval = redraw_interval if self.is_tty else log_interval
+        self.done = 0
+        self.started = time.monotonic()
+        self.next_draw = self.started if self.is_tty else self.started + log_interval
+        self.drawn = False
+
+    def advance(self, amount):
+        self.report(self.done + amount)
+
+    def report(self, done, total=None):
+        """
+        Set the bytes done so far, usable as the callback(bytes_read, total) of an upload.
+        """
+        self.done = done
+        if total is not None:
+            self.total = total
+        if not self.enabled:
+            return
+
+        now = time.monotonic()
+        if now >= self.next_draw:
+            self.next_draw = now + self.interval
+            self.draw(now)
+
+    def get_status(self, now):
+        elapsed = now - self.started
+        rate = f'{format_size(self.done / elapsed)}/s' if elapsed > 0 else ''
+        if not self.total:
+            return f'{format_size(self.done)} {rate}'
+        percent = 100 * min(self.done / self.total, 1)
+        return f'{percent:.1f}% {format_size(self.done)}/{format_size(self.total)} {rate}'
+
+    def draw(self, now):
+        self.drawn = True
+        status = self.get_status(now)
+        if not self.is_tty:
+            logging.info(LOG_COLOR.INFO.format(message=f'{self.prefix} {status}'))
+            return
+
+        filled_length = int(self.length * min(self.done / self.total, 1)) if self.total else 0
+        bar = '█' * filled_length + '-' * (self.length - filled_length)
+        current_time = time.strftime('%Y-%m-%d %H:%M:%S')
+        # \033[K clears what is left of a longer previous line
+        self.stream.write(f'\r{current_time} INFO {self.prefix} | \033[1;32m{bar}\033[1;0m| {status}\033[K')
+        self.stream.flush()
+
+    def finish(self):
+        """
+        Draw the final state, nothing is shown for a task that did not report any progress.
+        """
+        if not self.enabled or not (self.done or self.drawn):
+            return
+        self.draw(time.monotonic())
+        if self.is_tty:
+            self.stream.write('\n')
+            self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.finish()
@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import time
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+
+from nak.settings import CONFIG_FILE, ENV_FILE, LOG_COLOR, NAKIGNORE_FILE, SERVE_SOCKET_PATH
+
+# a change of these files changes what a command does, the daemon then starts over
+CONTROL_FILES = [CONFIG_FILE, ENV_FILE, NAKIGNORE_FILE, '.gitignore']
+# same format as the nak command line
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def send(wfile, **message):
+    wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+    wfile.flush()
+
+
+def forward(argv, socket_path=SERVE_SOCKET_PATH, stdout=None, stderr=None):
+    """
+    Run argv in the "nak serve" of the app, showing its output as if it ran here.
+    Returns the exit status of the command, None when no daemon is listening on socket_path.
+    """
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        # a socket left behind by a daemon that was killed
+        client.close()
+        return None
+
+    with client, client.makefile('rwb') as f:
+        send(f, argv=argv)
+        for line in f:
+            message = json.loads(line)
+            if 'exit' in message:
+                return message['exit']
+            stream = stdout if message['stream'] == 'stdout' else stderr
+            stream.write(message['data'])
+            stream.flush()
+
+    logging.info(LOG_COLOR.ERROR.format(message='nak serve stopped before the command finished.'))
+    return 1
+
+
+def is_running(socket_path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client:
+        try:
+            client.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+class StreamWriter(object):
+    """
+    File object sending what is written to it to the client, as the stdout or stderr of the command.
+    A client that went away (Ctrl+C) does not stop the command, its output is dropped.
+    """
+
+    def __init__(self, wfile, stream):
+        self.wfile = wfile
+        self.stream = stream
+        self.closed = False
+
+    def write(self, data):
+        if data and not self.closed:
+            try:
+                send(self.wfile, stream=self.stream, data=data)
+            except OSError:
+                self.closed = True
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class FileIndex(object):
+    """
+    The walked files of the app kept between commands, walked again only after the watcher saw a change.
+    """
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self.path = None
+        self.files = None
+
+    def clear(self):
+        self.files = None
+
+    def refresh(self):
+        """
+        Take the changes seen by the watcher since the last call, return whether there were any.
+        A single poll, the polling watcher scans the whole app on every call.
+        """
+        changed = bool(self.watcher.poll(0))
+        if changed:
+            self.clear()
+        return changed
+
+    def get_files(self, path):
+        from nak.utils import get_all_file
+
+        if self.files is None or self.path != path:
+            self.path = path
+            self.files = get_all_file(path=path)
+        return list(self.files)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            argv = json.loads(self.rfile.readline())['argv']
+        except (ValueError, KeyError, TypeError):
+            return
+        status = self.server.daemon.run(argv, self.wfile)
+        try:
+            send(self.wfile, exit=status)
+        except OSError:
+            pass
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path, daemon):
+        self.daemon = daemon
+        super().__init__(socket_path, RequestHandler)
+
+
+class Daemon(object):
+    """
+    A nak process kept running for an app, running the commands forwarded by the nak command line.
+
+    Between commands it keeps the modules imported, the config, the pooled HTTP session of the
+    gateway and the walked files of the app, kept up to date by a file watcher. Content hashes and
+    compressed members are reused from the manifest and the previous build as in any build, and a
+    build with the same arguments as the last one is skipped while no file changed.
+    Commands run one at a time, in the order they arrive.
+    """
+
+    def __init__(self, parser, socket_path=SERVE_SOCKET_PATH):
+        self.parser = parser
+        self.argument_parser = parser.create_parser()
+        self.socket_path = socket_path
+        self.file_index = None
+        self.control_mtimes = None
+        self.last_build = None
+
+    def get_control_mtimes(self):
+        mtimes = {}
+        for path in CONTROL_FILES:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def refresh(self):
+        changed = self.file_index.refresh()
+        control_mtimes = self.get_control_mtimes()
+        if control_mtimes != self.control_mtimes:
+            self.control_mtimes = control_mtimes
+            self.parser.reset_command()
+            self.file_index.clear()
+            changed = True
+        if changed:
+            self.last_build = None
+        self.parser.command.file_index = self.file_index
+
+    def is_built(self, argv):
+        """
+        Whether argv is the build that ran last and none of the files it built changed since.
+        """
+        from nak.utils import get_lastest_build_file
+
+        if argv[0] != 'build' or self.last_build is None:
+            return False
+        last_argv, build_file = self.last_build
+        return last_argv == argv and get_lastest_build_file() == build_file
+
+    def execute(self, argv):
+        from nak.nak import run
+        from nak.utils import get_lastest_build_file
+
+        self.refresh()
+        if self.is_built(argv):
+            logging.info(LOG_COLOR.SUCCESS.format(
+                message=f'No file changed since the last build, {self.last_build[1]} is up to date.'))
+            return 0
+
+        try:
+            args = self.argument_parser.parse_args(argv)
+        except SystemExit as e:
+            # invalid arguments or --help
+            return e.code if isinstance(e.code, int) else 0
+
+        status = run(args)
+        if argv[0] == 'build' and status == 0:
+            self.last_build = (argv, get_lastest_build_file())
+        return status
+
+    def run(self, argv, wfile):
+        """
+        Run a command line with its output sent to wfile, return its exit status.
+        """
+        stdout = StreamWriter(wfile, 'stdout')
+        stderr = StreamWriter(wfile, 'stderr')
+        handler = logging.StreamHandler(stderr)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+        root_logger = logging.getLogger()
+        root_logger.addHandler(handler)
+
+        started = time.monotonic()
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    status = self.execute(argv)
+                except Exception:
+                    # a bug in a command must not stop the daemon
+                    stderr.write(traceback.format_exc())
+                    status = 1
+        finally:
+            root_logger.removeHandler(handler)
+
+        logging.info(LOG_COLOR.INFO.format(
+            message=f'nak {" ".join(argv)} exited with {status} in {time.monotonic() - started:.3f}s.'))
+        return status
+
+    def stop(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def serve(self):
+        from nak.watcher import get_watcher
+
+        if not hasattr(socket, 'AF_UNIX'):
+            raise TypeError(LOG_COLOR.ERROR.format(message='nak serve needs Unix domain sockets.'))
+        if not (os.path.exists(ENV_FILE) or os.path.exists(CONFIG_FILE)):
+            raise TypeError(LOG_COLOR.ERROR.format(
+                message=(
+                    'Unable to locate config or env file. '
+                    'You can configure config or env file by running "nak setup".')))
+        if is_running(self.socket_path):
+            raise TypeError(LOG_COLOR.ERROR.format(message='nak serve is already running for this app.'))
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path) or '.', exist_ok=True)
+
+        watcher = get_watcher('.')
+        self.file_index = FileIndex(watcher)
+        # only the user running the daemon can run commands with their credentials, the socket is
+        # created without access for others rather than restricted once anyone could connect
+        umask = os.umask(0o177)
+        try:
+            server = DaemonServer(self.socket_path, self)
+        finally:
+            os.umask(umask)
+        signal.signal(signal.SIGTERM, self.stop)
+        logging.info(LOG_COLOR.INFO.format(
+            message=(f'Serving on {self.socket_path} with {watcher.__class__.__name__}, nak build, push, deploy '
+                     'and analyze now run here. Press Ctrl+C to stop.')))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            watcher.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        logging.info(LOG_COLOR.INFO.format(message='nak serve stopped.'))
+        return True
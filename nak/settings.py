@@ -1,5 +1,4 @@
 import os
-import time
 
 ENV_FILE_NAME = './.env'
 ENV_FILE = os.path.abspath(ENV_FILE_NAME)
@@ -8,11 +7,134 @@ CONFIG_FILE_NAME = './config.yml'
 CONFIG_FILE = os.path.abspath(CONFIG_FILE_NAME)
 
 API_URL = 'https://accounts.29next.com'
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
-ZIP_FILE_FORMAT = "{app_name}-" + time.strftime("%Y%m%d%H%M%S")
+# seconds, overridable with "timeout" in config.yml
+REQUEST_CONNECT_TIMEOUT = 10
+REQUEST_READ_TIMEOUT = 300
+REQUEST_POOL_SIZE = 10
+REQUEST_MAX_RETRIES = 3
+# retry delays grow as factor * 2 ** attempt, with full jitter and capped at REQUEST_BACKOFF_MAX
+REQUEST_BACKOFF_FACTOR = 0.5
+REQUEST_BACKOFF_MAX = 30
+REQUEST_RETRY_STATUS_CODES = [429, 502, 503, 504]
+REQUEST_RETRY_METHODS = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+# an upload that timed out may have been applied already, so PATCH is only sent again when it never
+# reached the API: the connection failed or a proxy in front of the API answered instead
+REQUEST_UNSENT_RETRY_METHODS = ['PATCH']
+REQUEST_UNSENT_STATUS_CODES = [502, 503, 504]
+
+# build_time is the time of every build, not of the start of a long-running "nak watch" or "nak serve"
+ZIP_FILE_FORMAT = "{app_name}-{build_time}"
+ZIP_TIME_FORMAT = '%Y%m%d%H%M%S'
 ZIP_DESTINATION_DIRECTORY = '.tmp'
 ZIP_DESTINATION_PATH = f'./{ZIP_DESTINATION_DIRECTORY}/{ZIP_FILE_FORMAT}.zip'
-ZIP_EXCLUDE_FILES = ['.env', 'config.yml', ZIP_DESTINATION_DIRECTORY]
+# every member gets the same timestamp and mode, so the same sources always give the same archive bytes
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_FILE_MODE = 0o644
+NAKIGNORE_FILE = '.nakignore'
+# how the files of an app are found, "git" lists them with git and uses the stat cache of the git
+# index to skip hashing unchanged files, falling back to "walk" outside of a checkout
+DISCOVERY_WALK = 'walk'
+DISCOVERY_GIT = 'git'
+# gitignore-style patterns always excluded, extended by the .nakignore file of the app
+ZIP_EXCLUDE_FILES = ['.env', 'config.yml', f'{ZIP_DESTINATION_DIRECTORY}/', '.git/', NAKIGNORE_FILE]
+
+# seconds between scans of the polling watcher and quiet time before "nak watch" rebuilds
+WATCH_POLL_INTERVAL = 1.0
+WATCH_DEBOUNCE = 0.3
+
+# "nak serve" listens on this socket, these commands are forwarded to it unless NAK_NO_SERVE is set
+SERVE_SOCKET_PATH = f'./{ZIP_DESTINATION_DIRECTORY}/nak.sock'
+SERVE_COMMANDS = ['build', 'push', 'deploy', 'analyze']
+SERVE_DISABLE_ENV = 'NAK_NO_SERVE'
+
+# seconds between redraws of a progress bar on a terminal, and between progress lines in logs
+PROGRESS_REDRAW_INTERVAL = 0.1
+PROGRESS_LOG_INTERVAL = 10
+
+# apps run at the same time by "nak build --all" and "nak push --all", each in its own process
+MONOREPO_BUILD_PROCESSES = os.cpu_count() or 1
+MONOREPO_PUSH_PROCESSES = 4
+# directories never searched for apps, besides hidden ones
+MONOREPO_EXCLUDE_DIRECTORIES = ['node_modules', '__pycache__']
+
+# "nak deploy" builds apps up to this size in memory, bigger apps are streamed through a pipe
+DEPLOY_SPOOL_MAX_SIZE = 32 * 1024 * 1024
+
+# "nak analyze" lists this many heaviest files and groups files by this many leading directories
+ANALYZE_TOP = 10
+ANALYZE_DEPTH = 1
+
+BUILD_MANIFEST_PATH = f'./{ZIP_DESTINATION_DIRECTORY}/manifest.json'
+# name, sha256, size, creation and push time of the archives in .tmp
+BUILD_INDEX_PATH = f'./{ZIP_DESTINATION_DIRECTORY}/index.json'
+# builds kept in .tmp after every build, overridable with "retention" in config.yml, the latest build is always kept
+BUILD_RETENTION_KEEP = 5
+# bytes, None for no limit
+BUILD_RETENTION_MAX_SIZE = None
+# sha256 of the last archive pushed per client_id, an unchanged archive is not uploaded again
+PUSH_STATE_PATH = f'./{ZIP_DESTINATION_DIRECTORY}/pushed.json'
+BUILD_COMPRESSION_LEVEL = 6
+# minified html, css, js, json and svg files keyed by the sha256 of their content
+MINIFY_CACHE_DIRECTORY = f'./{ZIP_DESTINATION_DIRECTORY}/minify'
+BUILD_CHUNK_SIZE = 1024 * 1024
+# files from this size on (videos) are stored and streamed into the archive through one reused
+# buffer instead of being held in memory, ZIP64 is used for members over 4 GB
+BUILD_LARGE_FILE_SIZE = 64 * 1024 * 1024
+BUILD_LARGE_BUFFER_SIZE = 8 * 1024 * 1024
+BUILD_JOBS = os.cpu_count() or 1
+
+# (method, level) per file extension, extensions not listed use COMPRESSION_DEFAULT
+COMPRESSION_STORE = 'store'
+COMPRESSION_DEFLATE = 'deflate'
+# deflate unless a sample of the file shows it is incompressible
+COMPRESSION_AUTO = 'auto'
+COMPRESSION_DEFAULT = (COMPRESSION_AUTO, BUILD_COMPRESSION_LEVEL)
+COMPRESSION_POLICY = {
+    # CONTENT_FILE_EXTENSIONS
+    '.html': (COMPRESSION_DEFLATE, BUILD_COMPRESSION_LEVEL),
+    '.json': (COMPRESSION_DEFLATE, BUILD_COMPRESSION_LEVEL),
+    '.css': (COMPRESSION_DEFLATE, BUILD_COMPRESSION_LEVEL),
+    '.scss': (COMPRESSION_DEFLATE, BUILD_COMPRESSION_LEVEL),
+    '.js': (COMPRESSION_DEFLATE, BUILD_COMPRESSION_LEVEL),
+    '.svg': (COMPRESSION_DEFLATE, BUILD_COMPRESSION_LEVEL),
+
+    # MEDIA_FILE_EXTENSIONS already compressed by their own format
+    '.woff2': (COMPRESSION_STORE, None),
+    '.woff': (COMPRESSION_STORE, None),
+    '.gif': (COMPRESSION_STORE, None),
+    '.png': (COMPRESSION_STORE, None),
+    '.jpg': (COMPRESSION_STORE, None),
+    '.jpeg': (COMPRESSION_STORE, None),
+    '.webp': (COMPRESSION_STORE, None),
+    '.mp4': (COMPRESSION_STORE, None),
+    '.webm': (COMPRESSION_STORE, None),
+    '.mp3': (COMPRESSION_STORE, None),
+}
+# deflate implementations, "auto" uses the first one installed of this list, isal and zlib-ng are
+# optional packages several times faster than zlib
+DEFLATE_AUTO = 'auto'
+DEFLATE_BACKENDS = ['isal', 'zlib-ng', 'zlib']
+# "compression_level: auto" in config.yml or --level auto deflates at the level with the shortest
+# predicted compression plus upload time, from the rate of the last uploads and the speed and ratio of
+# every level measured on a sample of the app, both kept in TUNING_STATE_PATH
+COMPRESSION_LEVEL_AUTO = 'auto'
+TUNING_STATE_PATH = f'./{ZIP_DESTINATION_DIRECTORY}/tuning.json'
+TUNING_UPLOAD_SAMPLES = 5
+# smaller uploads mostly measure the latency of the server, not the bandwidth
+TUNING_MIN_UPLOAD_SIZE = 256 * 1024
+# bytes of the app compressed at every level, taken from the head of the files
+TUNING_SAMPLE_SIZE = 1024 * 1024
+TUNING_SAMPLE_FILE_SIZE = 64 * 1024
+# seconds before the levels are measured again
+TUNING_SAMPLE_MAX_AGE = 24 * 60 * 60
+# changing the level compresses every file again, the level of the last build is kept unless
+# another one is predicted this much faster
+TUNING_MIN_GAIN = 0.1
+COMPRESSION_SAMPLE_SIZE = 64 * 1024
+# files whose sample does not deflate below this ratio are stored
+COMPRESSION_SAMPLE_RATIO = 0.9
 
 ALLOW_FILE_EXTENSIONS = [
     # CONTENT_FILE_EXTENSIONS
@@ -0,0 +1,144 @@
+import json
+import os
+import tempfile
+import time
+
+from nak.settings import BUILD_INDEX_PATH, BUILD_RETENTION_KEEP, BUILD_RETENTION_MAX_SIZE, ZIP_DESTINATION_DIRECTORY
+
+
+class BuildStore(object):
+    """
+    Index of the archives built into ZIP_DESTINATION_DIRECTORY, kept next to them.
+
+    Builds are listed oldest first with their name, sha256, size, creation time and push time,
+    so the latest build is found without listing and stat'ing the directory. An index that is
+    missing or unreadable (a .tmp written by an older nak) is rebuilt from the zip files once.
+    """
+
+    def __init__(self, directory=ZIP_DESTINATION_DIRECTORY, index_file=BUILD_INDEX_PATH):
+        self.directory = directory
+        self.index_file = index_file
+        self._builds = None
+
+    @property
+    def builds(self):
+        if self._builds is None:
+            self._builds = self.load()
+        return self._builds
+
+    def load(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                builds = json.load(f)['builds']
+            if isinstance(builds, list):
+                return builds
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        builds = self.scan()
+        if builds:
+            self._builds = builds
+            self.save()
+        return builds
+
+    def scan(self):
+        try:
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.is_file() and entry.name.endswith('.zip')]
+        except OSError:
+            return []
+
+        builds = []
+        # names end with the build time, they order builds created within the same clock tick
+        for entry in sorted(entries, key=lambda entry: (entry.stat().st_ctime, entry.name)):
+            stat = entry.stat()
+            builds.append({'name': entry.name, 'digest': None, 'size': stat.st_size, 'created': stat.st_ctime,
+                           'pushed': None})
+        return builds
+
+    def save(self):
+        # written next to the index then renamed, a build interrupted here leaves the previous index
+        os.makedirs(os.path.dirname(self.index_file) or '.', exist_ok=True)
+        fd, temporary_file = tempfile.mkstemp(dir=os.path.dirname(self.index_file) or '.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'builds': self.builds}, f, indent=1)
+            os.replace(temporary_file, self.index_file)
+        except BaseException:
+            if os.path.exists(temporary_file):
+                os.remove(temporary_file)
+            raise
+
+    def get_path(self, build):
+        return os.path.join(self.directory, build['name'])
+
+    def get(self, name):
+        for build in self.builds:
+            if build['name'] == name:
+                return build
+        return None
+
+    def get_latest(self):
+        """
+        Return the index entry of the latest build, or None when there is none.
+        """
+        if self.builds and os.path.exists(self.get_path(self.builds[-1])):
+            return self.builds[-1]
+
+        # archives were removed by hand, forget them
+        builds = [build for build in self.builds if os.path.exists(self.get_path(build))]
+        if len(builds) != len(self.builds):
+            self._builds = builds
+            self.save()
+        return self.builds[-1] if self.builds else None
+
+    def get_latest_file(self):
+        build = self.get_latest()
+        return self.get_path(build) if build else None
+
+    def add(self, path, digest):
+        """
+        Record a new archive as the latest build, replacing an entry of the same name.
+        """
+        name = os.path.basename(path)
+        self._builds = [build for build in self.builds if build['name'] != name]
+        build = {'name': name, 'digest': digest, 'size': os.path.getsize(path), 'created': time.time(),
+                 'pushed': None}
+        self.builds.append(build)
+        self.save()
+        return build
+
+    def mark_pushed(self, path):
+        build = self.get(os.path.basename(path))
+        if build is None:
+            return
+        build['pushed'] = time.time()
+        self.save()
+
+    def prune(self, keep=BUILD_RETENTION_KEEP, max_size=BUILD_RETENTION_MAX_SIZE):
+        """
+        Delete all but the newest keep builds, and the oldest ones beyond max_size bytes in total.
+        The latest build is always kept, the next build reuses its members. Returns the removed entries.
+        """
+        kept = []
+        removed = []
+        total_size = 0
+        for build in reversed(self.builds):
+            total_size += build['size']
+            is_over_limit = len(kept) >= max(keep, 1) or (max_size is not None and total_size > max_size)
+            if kept and is_over_limit:
+                removed.append(build)
+            else:
+                kept.append(build)
+
+        if not removed:
+            return []
+
+        for build in removed:
+            try:
+                os.remove(self.get_path(build))
+            except FileNotFoundError:
+                pass
+        self._builds = kept[::-1]
+        self.save()
+        return removed
@@ -0,0 +1,150 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from nak.settings import LOG_COLOR
+
+TIMINGS_COUNTERS = ['files', 'bytes_in', 'bytes_out']
+
+
+class Phase(object):
+    """
+    Accumulated wall time, CPU time and counters of every run of a named phase.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.counters = {}
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def to_dict(self):
+        return dict(self.counters, name=self.name, calls=self.calls, wall_seconds=self.wall, cpu_seconds=self.cpu)
+
+
+class NullPhase(Phase):
+    def add(self, **counters):
+        pass
+
+
+NULL_PHASE = NullPhase('')
+
+
+class Timings(object):
+    """
+    Per-phase timings recorded by the commands, the builder and the gateway.
+
+    Phases are named with dots for nesting ("archive.write" runs inside "archive") and may run
+    many times or in several threads, their runs are summed. CPU time is the time of the thread
+    running the phase, so the compression threads report theirs in "archive.compress".
+    Nothing is measured until enable() is called.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        self.enabled = False
+        self.phases = {}
+
+    def get_phase(self, name):
+        with self.lock:
+            # phases are reported in the order they first started
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = Phase(name)
+            return phase
+
+    @contextmanager
+    def phase(self, name, **counters):
+        if not self.enabled:
+            yield NULL_PHASE
+            return
+
+        record = Phase(name)
+        record.add(**counters)
+        self.get_phase(name)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - wall
+            record.cpu = time.thread_time() - cpu
+            with self.lock:
+                phase = self.phases[name]
+                phase.calls += 1
+                phase.wall += record.wall
+                phase.cpu += record.cpu
+                phase.add(**record.counters)
+
+    def to_dict(self):
+        return {'phases': [phase.to_dict() for phase in self.phases.values()]}
+
+    def format_summary(self):
+        lines = [f'{"phase":<24} {"calls":>6} {"wall s":>9} {"cpu s":>9} {"files":>7} {"bytes in":>13} '
+                 f'{"bytes out":>13}']
+        for phase in self.phases.values():
+            name = '  ' * phase.name.count('.') + phase.name.split('.')[-1]
+            files, bytes_in, bytes_out = (phase.counters.get(key, '') for key in TIMINGS_COUNTERS)
+            lines.append(f'{name:<24} {phase.calls:>6} {phase.wall:>9.3f} {phase.cpu:>9.3f} {files:>7} '
+                         f'{bytes_in:>13} {bytes_out:>13}')
+        return lines
+
+    def report(self, output='-'):
+        """
+        Log the summary table, or write the phases as JSON when output is a file name.
+        """
+        if output == '-':
+            for line in self.format_summary():
+                logging.info(LOG_COLOR.INFO.format(message=line))
+            return
+
+        with open(output, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        logging.info(LOG_COLOR.INFO.format(message=f'Timings written to {output}.'))
+
+
+timings = Timings()
+
+
+@contextmanager
+def instrument(timings_output=None, profile_output=None):
+    """
+    Run a command with timings enabled and/or under cProfile, reporting even when it fails.
+    """
+    profiler = None
+    if profile_output:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    if timings_output:
+        timings.enable()
+    try:
+        with timings.phase('total'):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    finally:
+        if profiler is not None:
+            profiler.dump_stats(profile_output)
+            logging.info(LOG_COLOR.INFO.format(
+                message=f'Profile written to {profile_output}, read it with "python -m pstats {profile_output}".'))
+        if timings_output:
+            timings.report(timings_output)
+            timings.reset()
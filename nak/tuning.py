@@ -0,0 +1,135 @@
+import json
+import os
+import statistics
+import time
+
+from nak.settings import (BUILD_JOBS, BUILD_LARGE_FILE_SIZE, COMPRESSION_STORE, TUNING_MIN_GAIN,
+                          TUNING_MIN_UPLOAD_SIZE, TUNING_SAMPLE_FILE_SIZE, TUNING_SAMPLE_MAX_AGE, TUNING_SAMPLE_SIZE,
+                          TUNING_STATE_PATH, TUNING_UPLOAD_SAMPLES)
+from nak.utils import read_json
+
+TUNING_LEVELS = range(1, 10)
+
+
+class Prediction(object):
+    """
+    Predicted seconds to compress the deflated files of an app at a level and to upload the result.
+    """
+
+    def __init__(self, level, compress_seconds, upload_seconds):
+        self.level = level
+        self.compress_seconds = compress_seconds
+        self.upload_seconds = upload_seconds
+
+    @property
+    def seconds(self):
+        return self.compress_seconds + self.upload_seconds
+
+
+class Tuner(object):
+    """
+    Choose the deflate level with the shortest predicted time to compress and upload an app.
+
+    The upload rate is the median of the last TUNING_UPLOAD_SAMPLES uploads and the speed and
+    ratio of every level are measured on the head of the deflated files of the app with the
+    deflate backend of the build, both kept in TUNING_STATE_PATH. Stored files upload the same
+    whatever the level and are left out of the prediction.
+    """
+
+    def __init__(self, state_file=TUNING_STATE_PATH):
+        self.state_file = state_file
+        self.state = read_json(state_file, {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        with open(self.state_file, 'w') as f:
+            json.dump(self.state, f)
+
+    def record_upload(self, size, seconds):
+        if size < TUNING_MIN_UPLOAD_SIZE or seconds <= 0:
+            return
+        uploads = self.state.get('uploads', []) + [[size, seconds]]
+        self.state['uploads'] = uploads[-TUNING_UPLOAD_SAMPLES:]
+        self.save()
+
+    def get_upload_rate(self):
+        """
+        Bytes per second of the recent uploads, None before the first one.
+        """
+        uploads = self.state.get('uploads')
+        if not uploads:
+            return None
+        return statistics.median(size / seconds for size, seconds in uploads)
+
+    def read_sample(self, file_list):
+        # heads of files spread over the whole app rather than all of its first files
+        step = max(len(file_list) * TUNING_SAMPLE_FILE_SIZE // TUNING_SAMPLE_SIZE, 1)
+        chunks = []
+        size = 0
+        for path in file_list[::step]:
+            with open(path, 'rb') as f:
+                chunk = f.read(min(TUNING_SAMPLE_FILE_SIZE, TUNING_SAMPLE_SIZE - size))
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= TUNING_SAMPLE_SIZE:
+                break
+        return b''.join(chunks)
+
+    def sample_levels(self, file_list, backend):
+        """
+        Return {level: (bytes per second, compressed size / size)} of the backend on the files.
+        """
+        sample = self.read_sample(file_list)
+        if not sample:
+            return {}
+        levels = {}
+        for level in TUNING_LEVELS:
+            compressor = backend.compressobj(level)
+            started = time.perf_counter()
+            compressed_size = len(compressor.compress(sample)) + len(compressor.flush())
+            seconds = max(time.perf_counter() - started, 1e-6)
+            levels[level] = (len(sample) / seconds, min(compressed_size / len(sample), 1.0))
+        return levels
+
+    def get_levels(self, file_list, backend):
+        # measured again with another backend or once the measure is old, the content of an app changes slowly
+        sampled = self.state.get('levels', {})
+        if sampled.get('backend') != backend.name or time.time() - sampled.get('time', 0) > TUNING_SAMPLE_MAX_AGE:
+            levels = self.sample_levels(file_list, backend)
+            if not levels:
+                return {}
+            sampled = {'backend': backend.name, 'time': time.time(),
+                       'levels': {str(level): list(values) for level, values in levels.items()}}
+            self.state['levels'] = sampled
+        return {int(level): tuple(values) for level, values in sampled['levels'].items()}
+
+    def predict(self, levels, size, rate, jobs=BUILD_JOBS):
+        return {level: Prediction(level, size / (speed * jobs), size * ratio / rate)
+                for level, (speed, ratio) in levels.items()}
+
+    def choose(self, file_list, policy, jobs=BUILD_JOBS):
+        """
+        Return the Prediction of the fastest level for the files and the predictions of every level,
+        (None, {}) before the first upload or when no file is deflated.
+        """
+        rate = self.get_upload_rate()
+        if rate is None:
+            return None, {}
+        sizes = {path: os.path.getsize(path) for path in file_list
+                 if policy.get_rule(path)[0] != COMPRESSION_STORE}
+        # large files are always stored
+        deflated = sorted(path for path, size in sizes.items() if size < BUILD_LARGE_FILE_SIZE)
+        size = sum(sizes[path] for path in deflated)
+        levels = self.get_levels(deflated, policy.backend) if size else {}
+        if not levels:
+            return None, {}
+
+        predictions = self.predict(levels, size, rate, jobs)
+        best = min(predictions.values(), key=lambda prediction: prediction.seconds)
+        # every file is compressed again at a new level, while the files of the last build are reused
+        last = predictions.get(self.state.get('level'))
+        if last is not None and last.seconds <= best.seconds * (1 + TUNING_MIN_GAIN):
+            best = last
+        self.state['level'] = best.level
+        self.save()
+        return best, predictions
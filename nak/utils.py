@@ -1,72 +1,123 @@
+import hashlib
+import json
 import os
 import time
-from pathlib import Path
 
-from nak.settings import ALLOW_FILE_EXTENSIONS, ZIP_DESTINATION_DIRECTORY, ZIP_EXCLUDE_FILES
+from nak.ignore import get_ignore_matcher
+from nak.settings import ALLOW_FILE_EXTENSIONS, BUILD_CHUNK_SIZE, BUILD_MANIFEST_PATH, PUSH_STATE_PATH, ZIP_TIME_FORMAT
+from nak.store import BuildStore
 
 
 def get_lastest_build_file():
-    path = Path(f"./{ZIP_DESTINATION_DIRECTORY}")
+    return BuildStore().get_latest_file()
 
-    zip_files = [f for f in path.iterdir() if f.is_file() and f.suffix == ".zip"]
-    if not zip_files:
-        return None
 
-    latest_zip = max(zip_files, key=lambda f: f.stat().st_ctime)
-    return latest_zip.as_posix()
+def get_build_time():
+    return time.strftime(ZIP_TIME_FORMAT)
 
 
-def progress_bar(iterable, prefix='', suffix='', decimals=1, length=100, fill='█', printEnd="\r"):
+def read_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def get_build_digest(build_file, manifest_file=BUILD_MANIFEST_PATH):
     """
-    Call in a loop to create terminal progress bar
-    @params:
-        iteration   - Required  : current iteration (Int)
-        total       - Required  : total iterations (Int)
-        prefix      - Optional  : prefix string (Str)
-        suffix      - Optional  : suffix string (Str)
-        decimals    - Optional  : positive number of decimals in percent complete (Int)
-        length      - Optional  : character length of bar (Int)
-        fill        - Optional  : bar fill character (Str)
-        printEnd    - Optional  : end character (e.g. "\r", "\r\n") (Str)
+    sha256 of a build file, taken from the manifest when the builder recorded it while writing.
     """
-    total = len(iterable)
+    manifest = read_json(manifest_file, {})
+    archive = manifest.get('archive')
+    if archive and manifest.get('digest') and os.path.normpath(archive) == os.path.normpath(build_file):
+        return manifest['digest']
 
-    if total == 0:
-        return
+    digest = hashlib.sha256()
+    with open(build_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(BUILD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_pushed_digest(client_id, state_file=PUSH_STATE_PATH):
+    return read_json(state_file, {}).get(client_id)
+
+
+def set_pushed_digest(client_id, digest, state_file=PUSH_STATE_PATH):
+    state = read_json(state_file, {})
+    state[client_id] = digest
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file, 'w') as f:
+        json.dump(state, f)
+
+
+ALLOW_FILE_EXTENSION_SET = frozenset(ALLOW_FILE_EXTENSIONS)
+
+
+def iter_files(path, required_extension=None, matcher=None):
+    """
+    Lazily yield the files to build under path.
+    Directory type info comes from the scandir entries and directories matched by the ignore
+    patterns (.nakignore) are never entered.
+    """
+    if matcher is None:
+        matcher = get_ignore_matcher(path)
+
+    allowed_extensions = ALLOW_FILE_EXTENSION_SET
+    if required_extension is not None:
+        allowed_extensions = allowed_extensions | {required_extension}
 
-    # Progress Bar Printing Function
-    def print_progress_bar(iteration):
-        percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
-        filledLength = int(length * iteration // total)
-        bar = fill * filledLength + '-' * (length - filledLength)
-        current_time = time.strftime('%Y-%m-%d %H:%M:%S')
-        print(f'\r{current_time} INFO {prefix} | \033[1;32m{bar}\033[1;0m| {percent}% {suffix}', end=printEnd)
+    def walk(directory, prefix):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                relative_path = prefix + entry.name
+                is_dir = entry.is_dir()
+                if matcher.match(relative_path, is_dir):
+                    continue
 
-    # Initial Call
-    print_progress_bar(0)
-    # Update Progress Bar
-    for i, item in enumerate(iterable):
-        yield item
-        print_progress_bar(i + 1)
-    # Print New Line on Complete
-    print()
+                if is_dir:
+                    yield from walk(entry.path, relative_path + '/')
+                elif os.path.splitext(entry.name)[1] in allowed_extensions:
+                    yield entry.path
+
+    yield from walk(path, '')
 
 
 def get_all_file(path, required_extension=None):
-    list_file = os.listdir(path)
-    all_files = []
-    for entry in list_file:
-        extension = os.path.splitext(entry)[1]
-        if any([exclude_file in entry for exclude_file in ZIP_EXCLUDE_FILES]) or \
-                (extension != required_extension and not (os.path.isdir(entry) or extension in ALLOW_FILE_EXTENSIONS)):
-            continue
+    return list(iter_files(path, required_extension))
 
-        fullPath = os.path.join(path, entry)
-        if os.path.isdir(fullPath):
-            all_files = all_files + get_all_file(fullPath)
-        else:
-            all_files.append(fullPath)
-    return all_files
+
+def filter_listed_files(path, names, required_extension=None, matcher=None):
+    """
+    Keep the files to build out of names relative to path, listed by git instead of walked.
+    The ignore patterns are applied to every parent directory as the walker would.
+    """
+    if matcher is None:
+        matcher = get_ignore_matcher(path)
+
+    allowed_extensions = ALLOW_FILE_EXTENSION_SET
+    if required_extension is not None:
+        allowed_extensions = allowed_extensions | {required_extension}
+
+    ignored_directories = {}
+
+    def is_ignored_directory(directory):
+        if not directory:
+            return False
+        if directory not in ignored_directories:
+            parent = directory.rpartition('/')[0]
+            ignored_directories[directory] = is_ignored_directory(parent) or matcher.match(directory, True)
+        return ignored_directories[directory]
+
+    files = []
+    for name in names:
+        if os.path.splitext(name)[1] not in allowed_extensions:
+            continue
+        if is_ignored_directory(name.rpartition('/')[0]) or matcher.match(name):
+            continue
+        files.append(os.path.join(path, name))
+    return files
 
 
 def hide_variable(value, all=False):
@@ -0,0 +1,193 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from nak.ignore import get_ignore_matcher
+from nak.settings import WATCH_DEBOUNCE, WATCH_POLL_INTERVAL
+from nak.utils import ALLOW_FILE_EXTENSION_SET, iter_files
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                 IN_DELETE | IN_DELETE_SELF)
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class Watcher(object):
+    """
+    Base of the file watchers, poll(timeout) returns the set of changed paths or an empty set.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.matcher = get_ignore_matcher(root)
+
+    def is_tracked(self, path, is_dir=False):
+        relative_path = os.path.relpath(path, self.root).replace(os.sep, '/')
+        if relative_path.startswith('../') or self.matcher.match(relative_path, is_dir):
+            return False
+        return is_dir or os.path.splitext(path)[1] in ALLOW_FILE_EXTENSION_SET
+
+    def poll(self, timeout=None):
+        raise NotImplementedError
+
+    def wait_for_changes(self, debounce=WATCH_DEBOUNCE):
+        """
+        Block until something changes, then keep collecting until nothing changed for debounce seconds.
+        """
+        changes = set()
+        while not changes:
+            changes = self.poll()
+        while True:
+            more_changes = self.poll(debounce)
+            if not more_changes:
+                return changes
+            changes |= more_changes
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(Watcher):
+    """
+    Portable watcher comparing mtime and size snapshots of the app files.
+    """
+
+    def __init__(self, root, interval=WATCH_POLL_INTERVAL):
+        super().__init__(root)
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for path in iter_files(self.root, matcher=self.matcher):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def poll(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if remaining > 0:
+                time.sleep(remaining)
+
+            snapshot = self.scan()
+            changes = {
+                path for path in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+
+class InotifyWatcher(Watcher):
+    """
+    Linux watcher receiving kernel inotify events, one watch per directory of the app.
+    """
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+        try:
+            self.add_directory(root)
+        except OSError:
+            self.close()
+            raise
+
+    def add_directory(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), IN_WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {path}')
+        self.directories[wd] = path
+
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and self.is_tracked(entry.path, is_dir=True):
+                    self.add_directory(entry.path)
+
+    def read_events(self):
+        # every queued event is read, so a single poll(0) sees all the changes made so far
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def poll(self, timeout=None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changes = set()
+        for wd, mask, name in self.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, report the whole app as changed
+                changes.add(self.root)
+                continue
+            directory = self.directories.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.directories[wd]
+                continue
+
+            path = os.path.join(directory, name) if name else directory
+            is_dir = bool(mask & IN_ISDIR)
+            if not self.is_tracked(path, is_dir):
+                continue
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.add_directory(path)
+                except OSError:
+                    pass
+            changes.add(path)
+        return changes
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def get_watcher(root, interval=WATCH_POLL_INTERVAL):
+    """
+    Use inotify where the platform has it and fall back to polling elsewhere, or when the
+    inotify watch limit is reached.
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(root, interval=interval)
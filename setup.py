@@ -24,11 +24,16 @@ setup(
         "requests>=2.25",
         "python-decouple>=3.6"
     ],
+    extras_require={
+        # faster deflate, picked up automatically when installed
+        'isal': ['isal>=1.0'],
+        'zlib-ng': ['zlib-ng>=0.4'],
+    },
     entry_points={
         'console_scripts': [
             'nak = nak.nak:main',
         ],
     },
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     python_requires='>=3.6'
 )
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import zipfile
+from unittest import TestCase
+
+from nak.analyze import Member, Report, get_overhead, measure_file, read_archive, scan_files
+from nak.builder import Builder
+from nak.compression import CompressionPolicy
+
+
+class TestAnalyze(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.files = []
+        for name, content in [
+            ('templates/index.html', b'<div>hello</div>\n' * 1000),
+            ('assets/img/logo.png', os.urandom(4096)),
+            ('assets/app.js', b'var a = 1;\n' * 100),
+            ('robots', b'User-agent: *'),
+        ]:
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.files.append(path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build(self):
+        archive_file = os.path.join(self.root, 'build.zip')
+        Builder(archive_file, root=self.root, manifest_file=os.path.join(self.root, 'manifest.json'),
+                jobs=1, show_progress=False).build(self.files)
+        return archive_file
+
+    ####
+    # read_archive / scan_files
+    ####
+    def test_read_archive_should_return_sizes_of_members(self):
+        archive_file = self.build()
+
+        members = {member.name: member for member in read_archive(archive_file)}
+
+        with zipfile.ZipFile(archive_file) as zip_file:
+            for zinfo in zip_file.infolist():
+                member = members[zinfo.filename]
+                assert (member.size, member.compressed_size) == (zinfo.file_size, zinfo.compress_size)
+                assert member.overhead == get_overhead(zinfo)
+                assert member.deflated == (zinfo.compress_type == zipfile.ZIP_DEFLATED)
+        assert sum(member.archived_size for member in members.values()) < os.path.getsize(archive_file)
+
+    def test_scan_files_should_measure_files_as_builder_compresses_them(self):
+        archive_file = self.build()
+
+        scanned = scan_files(self.files, self.root, CompressionPolicy(), jobs=2)
+
+        def key(member):
+            return (member.name, member.size, member.compressed_size, member.deflated)
+
+        assert sorted(map(key, scanned)) == sorted(map(key, read_archive(archive_file)))
+
+    def test_measure_file_with_incompressible_file_should_not_grow(self):
+        size, compressed_size = measure_file(self.files[1], 'deflate', 9)
+
+        assert size == compressed_size == 4096
+
+    ####
+    # Report
+    ####
+    def test_report_should_group_members_by_directory_and_extension(self):
+        report = Report([
+            Member('templates/index.html', 1000, 100),
+            Member('templates/shop/cart.html', 500, 50),
+            Member('assets/img/logo.png', 800, 800),
+            Member('robots', 10, 10),
+        ], 'build.zip')
+
+        assert [(row['name'], row['files'], row['size'], row['compressed_size'])
+                for row in report.get_directories()] == [
+            ('assets/', 1, 800, 800), ('templates/', 2, 1500, 150), ('./', 1, 10, 10)]
+        assert [(row['name'], row['ratio']) for row in report.get_extensions()] == [
+            ('.png', 1.0), ('.html', 0.1), ('(none)', 1.0)]
+
+    def test_report_with_depth_should_group_by_leading_directories(self):
+        report = Report([Member('templates/shop/cart.html', 500, 50), Member('templates/index.html', 10, 5)],
+                        'build.zip', depth=2)
+
+        assert [row['name'] for row in report.get_directories()] == ['templates/shop/', 'templates/']
+
+    def test_report_should_list_heaviest_and_grown_members(self):
+        report = Report([
+            Member('video.mp4', 5000, 5000, overhead=100),
+            Member('index.html', 1000, 100, overhead=100, deflated=True),
+            Member('a.json', 2, 4, overhead=90, deflated=True),
+            Member('b.json', 10, 10, overhead=90, deflated=True),
+        ], 'build.zip', top=2)
+
+        assert [member.name for member in report.get_heaviest()] == ['video.mp4', 'index.html']
+        # stored files are not grown, whatever the size of their headers
+        assert [member.name for member in report.get_grown()] == ['a.json', 'b.json']
+        data = report.to_dict()
+        assert (data['files'], data['size'], data['compressed_size'], data['overhead'], data['archived_size']) == (
+            4, 6012, 5114, 380, 5494)
+        assert data['grown'][0] == {'name': 'a.json', 'size': 2, 'compressed_size': 4, 'archived_size': 94,
+                                    'ratio': 2.0}
+
+    def test_format_summary_should_show_totals_and_tables(self):
+        report = Report([Member('templates/index.html', 2048, 1024)], 'build.zip')
+
+        lines = report.format_summary()
+
+        assert lines[0] == 'build.zip: 1 files, 2.0 KB compressed to 1.0 KB (50.0%), 1.0 KB with 0 B of zip headers.'
+        assert lines[3] == 'templates/       1     2.0 KB     1.0 KB  50.0% 100.0%'
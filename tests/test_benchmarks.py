@@ -0,0 +1,66 @@
+import hashlib
+import os
+import tempfile
+from unittest import TestCase
+
+from benchmarks.compare import compare
+from benchmarks.run import get_over_budget, get_parser
+from benchmarks.tree import generate_tree
+
+
+class TestBenchmarks(TestCase):
+    def get_tree_digest(self, seed):
+        with tempfile.TemporaryDirectory() as root:
+            files, size = generate_tree(root, small_files=30, media_files=1, media_size=4096, depth=3, seed=seed)
+            digest = hashlib.sha256()
+            for directory, _, names in sorted(os.walk(root)):
+                for name in sorted(names):
+                    path = os.path.join(directory, name)
+                    digest.update(os.path.relpath(path, root).encode())
+                    with open(path, 'rb') as f:
+                        digest.update(f.read())
+        return files, size, digest.hexdigest()
+
+    ####
+    # generate_tree
+    ####
+    def test_generate_tree_with_same_seed_should_write_same_tree(self):
+        files, size, digest = self.get_tree_digest(seed=1)
+
+        assert files == 31
+        assert size > 4096
+        assert self.get_tree_digest(seed=1) == (files, size, digest)
+        assert self.get_tree_digest(seed=2)[2] != digest
+
+    ####
+    # compare
+    ####
+    def test_compare_should_report_slower_wall_time_as_regression(self):
+        baseline = {'results': {'build_cold': {'wall_seconds': 1.0, 'cpu_seconds': 1.0}}}
+        current = {'results': {'build_cold': {'wall_seconds': 1.2, 'cpu_seconds': 0.9}, 'push': {'wall_seconds': 1}}}
+
+        rows, regressed = compare(baseline, current, threshold=0.1)
+
+        assert regressed
+        assert [row[:2] for row in rows] == [('build_cold', 'wall_seconds'), ('build_cold', 'cpu_seconds')]
+        assert compare(baseline, current, threshold=0.5)[1] is False
+
+    ####
+    # run
+    ####
+    def test_parser_should_accept_extra_cases(self):
+        args = get_parser().parse_args(['--cases', 'build_cold,build_large', '--large-size', '128'])
+
+        assert args.cases == ['build_cold', 'build_large']
+        assert args.large_size == 128
+        assert 'build_large' not in get_parser().parse_args([]).cases
+
+    def test_get_over_budget_should_return_cases_over_their_peak_rss_budget(self):
+        report = {'results': {
+            'build_cold': {'peak_rss_bytes': 500},
+            'build_large': {'peak_rss_bytes': 300, 'peak_rss_budget_bytes': 200},
+        }}
+
+        assert get_over_budget(report) == ['build_large']
+        report['results']['build_large']['peak_rss_budget_bytes'] = 300
+        assert get_over_budget(report) == []
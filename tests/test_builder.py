@@ -0,0 +1,454 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from nak import builder
+from nak.builder import ArchiveStream, Builder
+from nak.compression import CompressionPolicy, load_backend
+from nak.minify import Minifier
+from nak.settings import DEFLATE_BACKENDS
+
+
+class TestBuilder(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.manifest_file = os.path.join(self.root, 'manifest.json')
+        self.files = []
+        for name, content in [('index.html', b'<html>' * 100), ('assets/app.js', b'var a = 1;' * 100)]:
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.files.append(path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build(self, name, jobs=1, git_index=None):
+        destination_file = os.path.join(self.root, name)
+        new_builder = Builder(
+            destination_file, root=self.root, manifest_file=self.manifest_file, jobs=jobs, git_index=git_index)
+        new_builder.build(self.files)
+        return new_builder
+
+    def read_zip(self, name):
+        with zipfile.ZipFile(os.path.join(self.root, name)) as zip_file:
+            assert zip_file.testzip() is None
+            return {info.filename: zip_file.read(info) for info in zip_file.infolist()}
+
+    ####
+    # build
+    ####
+    def test_build_without_manifest_should_compress_all_files(self):
+        new_builder = self.build('first.zip')
+
+        assert (new_builder.reused, new_builder.compressed) == (0, 2)
+        assert self.read_zip('first.zip') == {
+            'index.html': b'<html>' * 100,
+            'assets/app.js': b'var a = 1;' * 100,
+        }
+        with open(self.manifest_file) as f:
+            manifest = json.load(f)
+        assert manifest['archive'] == os.path.join(self.root, 'first.zip')
+        assert sorted(manifest['entries']) == ['assets/app.js', 'index.html']
+
+    def test_build_with_unchanged_files_should_reuse_previous_members(self):
+        for path in self.files:
+            os.utime(path, (946684800, 946684800))
+        self.build('first.zip')
+
+        with patch('nak.builder.compress_file', wraps=builder.compress_file) as mock_compress, \
+                patch('nak.builder.get_file_digest', wraps=builder.get_file_digest) as mock_get_file_digest:
+            new_builder = self.build('second.zip')
+
+        mock_compress.assert_not_called()
+        mock_get_file_digest.assert_not_called()
+        assert (new_builder.reused, new_builder.compressed) == (2, 0)
+        assert self.read_zip('second.zip') == self.read_zip('first.zip')
+
+    def test_build_with_file_changed_in_same_tick_as_manifest_should_hash_file(self):
+        self.build('first.zip')
+        mtime_ns = os.stat(self.files[1]).st_mtime_ns
+        # same size, same mtime: an edit right after the previous build on a coarse clock
+        with open(self.files[1], 'wb') as f:
+            f.write(b'var b = 2;' * 100)
+        os.utime(self.files[1], ns=(mtime_ns, mtime_ns))
+        os.utime(self.manifest_file, ns=(mtime_ns, mtime_ns))
+
+        new_builder = self.build('second.zip')
+
+        assert (new_builder.reused, new_builder.compressed) == (1, 1)
+        assert self.read_zip('second.zip')['assets/app.js'] == b'var b = 2;' * 100
+
+    def test_build_with_changed_file_should_only_compress_changed_file(self):
+        self.build('first.zip')
+        with open(self.files[1], 'wb') as f:
+            f.write(b'var b = 2;')
+
+        new_builder = self.build('second.zip')
+
+        assert (new_builder.reused, new_builder.compressed) == (1, 1)
+        assert self.read_zip('second.zip')['assets/app.js'] == b'var b = 2;'
+
+    def test_build_with_touched_file_should_reuse_when_content_is_same(self):
+        self.build('first.zip')
+        os.utime(self.files[0], (946684800, 946684800))
+
+        new_builder = self.build('second.zip')
+
+        assert (new_builder.reused, new_builder.compressed) == (2, 0)
+
+    def test_build_with_touched_file_unchanged_in_git_should_reuse_without_hashing(self):
+        git_index = MagicMock()
+        git_index.get_blob.side_effect = lambda arcname, stat: f'blob of {arcname}'
+        self.build('first.zip', git_index=git_index)
+        os.utime(self.files[0], (946684800, 946684800))
+
+        with patch('nak.builder.get_file_digest', wraps=builder.get_file_digest) as mock_get_file_digest:
+            new_builder = self.build('second.zip', git_index=git_index)
+
+        mock_get_file_digest.assert_not_called()
+        assert (new_builder.reused, new_builder.compressed) == (2, 0)
+        with open(self.manifest_file) as f:
+            assert json.load(f)['entries']['index.html']['git'] == 'blob of index.html'
+
+    def test_build_with_touched_file_changed_in_git_should_hash_file(self):
+        git_index = MagicMock()
+        git_index.get_blob.return_value = None
+        self.build('first.zip', git_index=git_index)
+        os.utime(self.files[0], (946684800, 946684800))
+
+        with patch('nak.builder.get_file_digest', wraps=builder.get_file_digest) as mock_get_file_digest:
+            new_builder = self.build('second.zip', git_index=git_index)
+
+        assert mock_get_file_digest.call_count == 1
+        assert (new_builder.reused, new_builder.compressed) == (2, 0)
+
+    def test_build_with_missing_previous_archive_should_compress_all_files(self):
+        self.build('first.zip')
+        os.remove(os.path.join(self.root, 'first.zip'))
+
+        new_builder = self.build('second.zip')
+
+        assert (new_builder.reused, new_builder.compressed) == (0, 2)
+
+    def test_build_with_same_destination_should_replace_previous_archive(self):
+        self.build('first.zip')
+
+        new_builder = self.build('first.zip')
+
+        assert new_builder.reused == 2
+        assert sorted(self.read_zip('first.zip')) == ['assets/app.js', 'index.html']
+        assert not os.path.exists(os.path.join(self.root, 'first.zip.part'))
+
+    def test_build_with_many_jobs_should_write_same_archive_as_serial_build(self):
+        for index in range(20):
+            path = os.path.join(self.root, f'page{index}.html')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(index * 100) + b'<p>text</p>' * index)
+            self.files.append(path)
+
+        self.build('serial.zip', jobs=1)
+        os.remove(self.manifest_file)
+        new_builder = self.build('parallel.zip', jobs=4)
+
+        assert new_builder.compressed == len(self.files)
+        with open(os.path.join(self.root, 'serial.zip'), 'rb') as serial, \
+                open(os.path.join(self.root, 'parallel.zip'), 'rb') as parallel:
+            assert serial.read() == parallel.read()
+
+    def test_build_with_every_deflate_backend_should_extract_same_files(self):
+        for name in DEFLATE_BACKENDS:
+            with self.subTest(backend=name):
+                try:
+                    backend = load_backend(name)
+                except ImportError:
+                    self.skipTest(f'{name} is not installed')
+                destination_file = os.path.join(self.root, f'{name}.zip')
+                manifest_file = os.path.join(self.root, f'{name}.json')
+                Builder(destination_file, root=self.root, manifest_file=manifest_file, jobs=1,
+                        policy=CompressionPolicy(backend=backend)).build(self.files)
+
+                with zipfile.ZipFile(destination_file) as zip_file:
+                    assert [info.compress_type for info in zip_file.infolist()] == [zipfile.ZIP_DEFLATED] * 2
+                assert self.read_zip(f'{name}.zip') == {
+                    'index.html': b'<html>' * 100,
+                    'assets/app.js': b'var a = 1;' * 100,
+                }
+
+    def test_build_after_deflate_backend_changed_should_compress_deflated_files_again(self):
+        import zlib
+
+        from nak.compression import ZLIB_BACKEND, DeflateBackend
+
+        self.add_large_file('logo.png', 4096)
+        other_backend = DeflateBackend('other', zlib)
+        results = []
+        for name, backend in [('first.zip', other_backend), ('second.zip', ZLIB_BACKEND), ('third.zip', ZLIB_BACKEND)]:
+            new_builder = Builder(os.path.join(self.root, name), root=self.root, manifest_file=self.manifest_file,
+                                  jobs=1, policy=CompressionPolicy(backend=backend))
+            new_builder.build(self.files)
+            results.append((new_builder.reused, new_builder.compressed))
+
+        # the stored png does not depend on the backend
+        assert results == [(0, 3), (1, 2), (3, 0)]
+        with open(self.manifest_file) as f:
+            entries = json.load(f)['entries']
+        assert (entries['index.html']['deflate'], entries['logo.png']['deflate']) == ('zlib', None)
+
+    def test_build_of_same_sources_should_be_reproducible(self):
+        first_builder = self.build('first.zip')
+        os.remove(self.manifest_file)
+        for path in self.files:
+            os.utime(path, (0, 1234567890))
+            os.chmod(path, 0o600)
+        self.files.reverse()
+        second_builder = self.build('second.zip')
+
+        with open(os.path.join(self.root, 'first.zip'), 'rb') as first, \
+                open(os.path.join(self.root, 'second.zip'), 'rb') as second:
+            first_data = first.read()
+            assert first_data == second.read()
+        assert first_builder.digest == second_builder.digest == hashlib.sha256(first_data).hexdigest()
+        with zipfile.ZipFile(os.path.join(self.root, 'second.zip')) as zip_file:
+            assert zip_file.namelist() == ['assets/app.js', 'index.html']
+            assert {info.date_time for info in zip_file.infolist()} == {(1980, 1, 1, 0, 0, 0)}
+            assert {info.external_attr >> 16 for info in zip_file.infolist()} == {0o100644}
+        with open(self.manifest_file) as f:
+            assert json.load(f)['digest'] == second_builder.digest
+
+    def test_build_with_many_jobs_should_reuse_previous_members(self):
+        self.build('first.zip', jobs=4)
+
+        new_builder = self.build('second.zip', jobs=4)
+
+        assert (new_builder.reused, new_builder.compressed) == (2, 0)
+        assert self.read_zip('second.zip') == self.read_zip('first.zip')
+
+    def test_build_should_store_media_and_deflate_text(self):
+        path = os.path.join(self.root, 'image.png')
+        with open(path, 'wb') as f:
+            f.write(b'\x89PNG' * 1000)
+        self.files.append(path)
+
+        self.build('first.zip')
+
+        with zipfile.ZipFile(os.path.join(self.root, 'first.zip')) as zip_file:
+            assert zip_file.getinfo('image.png').compress_type == zipfile.ZIP_STORED
+            assert zip_file.getinfo('index.html').compress_type == zipfile.ZIP_DEFLATED
+
+    def test_build_with_changed_policy_should_recompress_file(self):
+        self.build('first.zip')
+
+        destination_file = os.path.join(self.root, 'second.zip')
+        policy = CompressionPolicy({'.html': 'store'})
+        new_builder = Builder(destination_file, root=self.root, manifest_file=self.manifest_file, policy=policy)
+        new_builder.build(self.files)
+
+        assert (new_builder.reused, new_builder.compressed) == (1, 1)
+        with zipfile.ZipFile(destination_file) as zip_file:
+            assert zip_file.getinfo('index.html').compress_type == zipfile.ZIP_STORED
+
+    def test_build_with_minifier_should_minify_and_reuse_minified_members(self):
+        path = os.path.join(self.root, 'settings.json')
+        with open(path, 'wb') as f:
+            f.write(b'{\n    "name": "app",\n    "pages": [1, 2]\n}\n')
+        self.files.append(path)
+        minifier = Minifier(extensions=['.json'], cache_directory=os.path.join(self.root, 'cache'))
+
+        destination_file = os.path.join(self.root, 'first.zip')
+        new_builder = Builder(destination_file, root=self.root, manifest_file=self.manifest_file, minifier=minifier)
+        new_builder.build(self.files)
+
+        assert self.read_zip('first.zip')['settings.json'] == b'{"name":"app","pages":[1,2]}'
+        assert self.read_zip('first.zip')['index.html'] == b'<html>' * 100
+        assert new_builder.minified == {'.json': [1, 43, 28]}
+
+        destination_file = os.path.join(self.root, 'second.zip')
+        new_builder = Builder(destination_file, root=self.root, manifest_file=self.manifest_file, minifier=minifier)
+        with patch('nak.minify.Minifier.minify', autospec=True) as mock_minify:
+            new_builder.build(self.files)
+
+        mock_minify.assert_not_called()
+        assert (new_builder.reused, new_builder.minified) == (3, {'.json': [1, 43, 28]})
+
+        # turning minification off recompresses the minified file from its source
+        new_builder = self.build('third.zip')
+        assert (new_builder.reused, new_builder.compressed) == (2, 1)
+        assert self.read_zip('third.zip')['settings.json'].startswith(b'{\n    "name"')
+
+    ####
+    # large files
+    ####
+    def add_large_file(self, name, size):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            for _ in range(size // 4096):
+                f.write(os.urandom(4096))
+        self.files.append(path)
+        return path
+
+    def test_build_with_large_file_should_stream_and_store_it(self):
+        path = self.add_large_file('promo.mp4', 256 * 1024)
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        with patch('nak.builder.BUILD_LARGE_FILE_SIZE', 64 * 1024), patch('nak.builder.BUILD_LARGE_BUFFER_SIZE', 4096):
+            new_builder = self.build('first.zip', jobs=2)
+            assert (new_builder.reused, new_builder.compressed) == (0, 3)
+
+            with open(path, 'ab') as f:
+                f.write(b'more')
+            new_builder = self.build('second.zip', jobs=2)
+            assert (new_builder.reused, new_builder.compressed) == (2, 1)
+
+        assert self.read_zip('second.zip')['promo.mp4'] == content + b'more'
+        with zipfile.ZipFile(os.path.join(self.root, 'second.zip')) as zip_file:
+            assert zip_file.getinfo('promo.mp4').compress_type == zipfile.ZIP_STORED
+            assert zip_file.getinfo('index.html').compress_type == zipfile.ZIP_DEFLATED
+
+    def test_build_with_large_file_should_keep_memory_bounded(self):
+        import tracemalloc
+
+        self.add_large_file('promo.mp4', 8 * 1024 * 1024)
+        with patch('nak.builder.BUILD_LARGE_FILE_SIZE', 1024 * 1024), \
+                patch('nak.builder.BUILD_LARGE_BUFFER_SIZE', 256 * 1024):
+            tracemalloc.start()
+            try:
+                self.build('first.zip')
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        assert peak < 2 * 1024 * 1024
+        assert len(self.read_zip('first.zip')['promo.mp4']) == 8 * 1024 * 1024
+
+    def test_build_with_members_over_zip64_limit_should_write_zip64_records(self):
+        path = self.add_large_file('promo.mp4', 64 * 1024)
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        with patch('nak.builder.BUILD_LARGE_FILE_SIZE', 16 * 1024), patch('zipfile.ZIP64_LIMIT', 8 * 1024):
+            self.build('first.zip')
+            self.build('second.zip')
+
+            with open(os.path.join(self.root, 'second.zip'), 'rb') as f:
+                data = f.read()
+        # zip64 end of central directory record and the zip64 extra field of the members
+        assert b'PK\x06\x06' in data
+        assert data.count(b'\x01\x00\x10\x00') + data.count(b'\x01\x00\x18\x00') >= 2
+        assert self.read_zip('second.zip')['promo.mp4'] == content
+
+    def test_build_with_large_file_should_read_it_once(self):
+        path = self.add_large_file('promo.mp4', 64 * 1024)
+
+        with patch('nak.builder.BUILD_LARGE_FILE_SIZE', 16 * 1024), \
+                patch('nak.builder.BUILD_LARGE_BUFFER_SIZE', 4096), \
+                patch('nak.builder.iter_large_file', wraps=builder.iter_large_file) as mock_iter_large_file:
+            new_builder = self.build('first.zip')
+            assert mock_iter_large_file.call_count == 1
+
+            # an unseekable stream needs the CRC before the content, the file is scanned first
+            stream_builder = Builder(root=self.root, manifest_file=os.path.join(self.root, 'none.json'))
+            with ArchiveStream(stream_builder, self.files) as stream:
+                data = b''.join(iter(lambda: stream.read(1000), b''))
+            assert mock_iter_large_file.call_count == 3
+
+        archive_file = os.path.join(self.root, 'first.zip')
+        with open(archive_file, 'rb') as f:
+            assert f.read() == data
+        assert new_builder.digest == stream_builder.digest == hashlib.sha256(data).hexdigest()
+        with open(self.manifest_file) as f:
+            assert json.load(f)['entries']['promo.mp4']['sha256'] == builder.get_file_digest(path)
+        assert zipfile.ZipFile(archive_file).testzip() is None
+
+    def test_write_large_member_with_changed_file_should_raise_error(self):
+        path = self.add_large_file('promo.mp4', 8192)
+        zinfo = builder.make_zinfo('promo.mp4')
+        zinfo.file_size = zinfo.compress_size = 4096
+        zinfo.CRC = 0
+        writer = builder.HashingWriter(io.BytesIO())
+
+        with zipfile.ZipFile(writer, 'w') as zip_file, self.assertRaises(IOError):
+            builder.write_large_member(zip_file, writer, zinfo, path, buffer_size=4096)
+
+    def test_stream_large_file_with_changed_file_should_raise_error(self):
+        path = self.add_large_file('promo.mp4', 8192)
+        zinfo = zipfile.ZipInfo('promo.mp4')
+        builder.scan_large_file(path, zinfo, buffer_size=4096)
+        with open(path, 'r+b') as f:
+            f.write(b'changed')
+
+        with self.assertRaises(IOError):
+            list(builder.stream_large_file(path, zinfo, buffer_size=4096))
+
+    ####
+    # compress_file
+    ####
+    def test_compress_file_with_incompressible_content_should_store_file(self):
+        path = os.path.join(self.root, 'random.js')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(4096))
+
+        zinfo = zipfile.ZipInfo('random.js')
+        chunks, _ = builder.compress_file(path, zinfo, 'deflate', 9)
+
+        assert zinfo.compress_type == zipfile.ZIP_STORED
+        assert zinfo.compress_size == zinfo.file_size == 4096
+        assert len(b''.join(chunks)) == 4096
+
+    ####
+    # write
+    ####
+    def test_write_to_unseekable_stream_should_create_valid_zip(self):
+        class Stream(io.RawIOBase):
+            def __init__(self):
+                self.data = bytearray()
+
+            def writable(self):
+                return True
+
+            def write(self, data):
+                self.data += data
+                return len(data)
+
+        stream = Stream()
+        new_builder = Builder(root=self.root, manifest_file=self.manifest_file)
+
+        entries = new_builder.write(stream, self.files)
+
+        assert sorted(entries) == ['assets/app.js', 'index.html']
+        assert not os.path.exists(self.manifest_file)
+        with zipfile.ZipFile(io.BytesIO(bytes(stream.data))) as zip_file:
+            assert zip_file.testzip() is None
+            assert zip_file.read('index.html') == b'<html>' * 100
+
+    ####
+    # ArchiveStream
+    ####
+    def test_archive_stream_should_read_archive_written_in_background(self):
+        self.build('first.zip')
+        new_builder = Builder(root=self.root, manifest_file=self.manifest_file)
+
+        with ArchiveStream(new_builder, self.files) as stream:
+            assert not stream.seekable()
+            data = b''.join(iter(lambda: stream.read(1000), b''))
+
+        assert new_builder.reused == 2
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            assert zip_file.testzip() is None
+            assert zip_file.read('assets/app.js') == b'var a = 1;' * 100
+
+    def test_archive_stream_with_failed_build_should_raise_error_on_read(self):
+        new_builder = Builder(root=self.root, manifest_file=self.manifest_file)
+
+        with ArchiveStream(new_builder, self.files + [os.path.join(self.root, 'missing.html')]) as stream:
+            with self.assertRaises(IOError):
+                while stream.read(1000):
+                    pass
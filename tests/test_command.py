@@ -1,21 +1,46 @@
+import json
+import os
+import tempfile
 import unittest
-from unittest.mock import MagicMock, call, mock_open, patch
+import zipfile
+from unittest.mock import ANY, MagicMock, call, mock_open, patch
+
+import requests
 
 from nak.command import Command
-from nak.settings import LOG_COLOR, ZIP_DESTINATION_PATH
+from nak.settings import BUILD_JOBS, DEPLOY_SPOOL_MAX_SIZE, LOG_COLOR, ZIP_DESTINATION_PATH
+
+BUILD_TIME = '20200101000000'
 
 
 class TestCommand(unittest.TestCase):
     @patch("yaml.load", autospec=True)
-    @patch('nak.command.Gateway', autospec=True)
-    def setUp(self, mock_gateway, mock_load_yaml):
+    def setUp(self, mock_load_yaml):
         mock_load_yaml.return_value = {}
+        # the gateway is created on first use, so it stays patched for the whole test
+        gateway_patcher = patch('nak.gateway.Gateway', autospec=True)
+        self.mock_gateway = gateway_patcher.start()
+        self.addCleanup(gateway_patcher.stop)
+
+        # the pushed digests live in .tmp of the working directory
+        self.mock_get_build_digest = self.start_patch('nak.command.get_build_digest', return_value='digest')
+        self.mock_get_pushed_digest = self.start_patch('nak.command.get_pushed_digest', return_value=None)
+        self.mock_set_pushed_digest = self.start_patch('nak.command.set_pushed_digest')
+        self.mock_store = self.start_patch('nak.command.BuildStore')
+        # so is the measured upload rate
+        self.mock_tuner = self.start_patch('nak.command.Tuner')
+        self.start_patch('nak.command.get_build_time', return_value=BUILD_TIME)
+        self.mock_store.return_value.prune.return_value = []
 
         with patch('builtins.open', mock_open(read_data='yaml data')):
             self.command = Command()
 
             self.mock_file = mock_open(read_data='test data')
-            self.mock_gateway = mock_gateway
+
+    def start_patch(self, target, **kwargs):
+        patcher = patch(target, autospec=True, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
 
     #####
     # setup
@@ -65,11 +90,11 @@ class TestCommand(unittest.TestCase):
     # build
     #####
     @patch("os.path.exists", autospec=True)
-    @patch("nak.command.zipfile", autospec=True)
+    @patch("nak.builder.Builder", autospec=True)
     @patch("nak.command.get_all_file", autospec=True)
     @patch("nak.command.Config.write_config", autospec=True)
     def test_build_with_wrong_directory_should_raise_error_correctly(
-        self, mock_write_config, mock_get_file, mock_zipfile, mock_path_exists
+        self, mock_write_config, mock_get_file, mock_builder, mock_path_exists
     ):
         mock_get_file.return_value = ["test1.file", "test2.file"]
         mock_path_exists.side_effect = [False, False]
@@ -81,14 +106,15 @@ class TestCommand(unittest.TestCase):
             message=(
                 'Unable to locate config or env file. '
                 'You can configure config or env file by running "nak setup".'))
-        assert mock_zipfile.mock_calls == []
+        assert mock_builder.mock_calls == []
 
     @patch("os.path.exists")
-    @patch("nak.command.zipfile", autospec=True)
+    @patch("nak.command.CompressionPolicy", autospec=True)
+    @patch("nak.builder.Builder", autospec=True)
     @patch("nak.command.get_all_file", autospec=True)
     @patch("nak.command.Config.write_config", autospec=True)
     def test_build_with_correct_directory_should_create_zip_file_correctly(
-        self, mock_write_config, mock_get_file, mock_zipfile, mock_path_exists
+        self, mock_write_config, mock_get_file, mock_builder, mock_policy, mock_path_exists
     ):
 
         mock_get_file.return_value = ["test1.file", "test2.file"]
@@ -98,22 +124,184 @@ class TestCommand(unittest.TestCase):
             # check env file at build command
             True
         ]
+        mock_builder.return_value.reused = 1
+        mock_builder.return_value.compressed = 1
+        mock_builder.return_value.digest = 'zip digest'
         with self.assertLogs(level='INFO') as log:
             self.command.build()
 
-        assert mock_zipfile.ZipFile.return_value.mock_calls == [
-            call.write('test1.file'),
-            call.write('test2.file'),
-            call.close(),
-        ]
+        file_name = ZIP_DESTINATION_PATH.format(app_name="app-kit", build_time=BUILD_TIME).split('/')[-1]
+        mock_policy.assert_called_once_with(self.command.config.compression, backend=ANY)
+        mock_builder.assert_called_once_with(
+            ZIP_DESTINATION_PATH.format(app_name="app-kit", build_time=BUILD_TIME), root='.',
+            policy=mock_policy.return_value, jobs=BUILD_JOBS, minifier=None, git_index=None)
+        assert mock_builder.return_value.build.mock_calls == [call(["test1.file", "test2.file"])]
 
-        file_name = ZIP_DESTINATION_PATH.format(app_name="app-kit").split('/')[-1]
         assert log.output == [
             f"INFO:root:{LOG_COLOR.INFO.format(message='file: test1.file')}",
             f"INFO:root:{LOG_COLOR.INFO.format(message='file: test2.file')}",
+            f"INFO:root:{LOG_COLOR.INFO.format(message='Reused 1 unchanged files, compressed 1 files.')}",
             f"INFO:root:{LOG_COLOR.INFO.format(message=f'Created build file with {file_name}.')}",
             f"INFO:root:{LOG_COLOR.SUCCESS.format(message='Build successfully.')}"
         ]
+        self.mock_store.return_value.add.assert_called_once_with(
+            ZIP_DESTINATION_PATH.format(app_name="app-kit", build_time=BUILD_TIME), 'zip digest')
+        self.mock_store.return_value.prune.assert_called_once_with(5, None)
+
+    @patch("os.path.exists")
+    @patch("nak.builder.Builder", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    def test_build_with_old_builds_should_log_removed_builds(self, mock_get_file, mock_builder, mock_path_exists):
+        mock_get_file.return_value = ["test1.file"]
+        mock_path_exists.return_value = True
+        mock_builder.return_value.reused = 0
+        mock_builder.return_value.compressed = 1
+        mock_builder.return_value.digest = 'zip digest'
+        self.command.config.retention = (2, 1024)
+        self.mock_store.return_value.prune.return_value = [{'size': 1024}, {'size': 2048}]
+
+        with self.assertLogs(level='INFO') as log:
+            self.command.build()
+
+        self.mock_store.return_value.prune.assert_called_once_with(2, 1024)
+        assert log.output[-2] == (
+            f"INFO:root:{LOG_COLOR.INFO.format(message='Removed 2 old build files, 3.0 KB freed.')}")
+
+    @patch("os.path.exists")
+    @patch("nak.builder.Builder", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    @patch("nak.command.Config.write_config", autospec=True)
+    def test_build_with_jobs_argument_should_pass_jobs_to_builder(
+        self, mock_write_config, mock_get_file, mock_builder, mock_path_exists
+    ):
+        mock_get_file.return_value = ["test1.file"]
+        mock_path_exists.side_effect = [True, True]
+        mock_builder.return_value.reused = 0
+        mock_builder.return_value.compressed = 1
+        mock_builder.return_value.digest = 'zip digest'
+
+        with self.assertLogs(level='INFO'):
+            self.command.build(MagicMock(jobs=3, minify=False, all=False))
+
+        assert mock_builder.call_args[1]['jobs'] == 3
+
+    @patch("nak.command.CompressionPolicy", autospec=True)
+    def test_get_policy_with_level_should_override_config(self, mock_policy):
+        self.command.config.compression_level = 9
+
+        self.command.get_policy(MagicMock(level=1))
+        mock_policy.return_value.set_level.assert_called_once_with(1)
+
+        mock_policy.reset_mock()
+        self.command.get_policy(MagicMock(level=None))
+        mock_policy.return_value.set_level.assert_called_once_with(9)
+
+        mock_policy.reset_mock()
+        self.command.config.compression_level = None
+        self.command.get_policy()
+        mock_policy.return_value.set_level.assert_not_called()
+
+    @patch("nak.command.CompressionPolicy", autospec=True)
+    def test_get_policy_with_auto_level_should_log_chosen_level_and_prediction(self, mock_policy):
+        from nak.tuning import Prediction
+
+        best = Prediction(3, 0.5, 2.0)
+        self.mock_tuner.return_value.choose.return_value = (best, {3: best, 6: Prediction(6, 1.5, 1.8)})
+        self.mock_tuner.return_value.get_upload_rate.return_value = 2 * 1024 * 1024
+
+        with self.assertLogs(level='INFO') as log:
+            self.command.get_policy(MagicMock(level='auto', jobs=4), ['./index.html'], jobs=4)
+
+        self.mock_tuner.return_value.choose.assert_called_once_with(['./index.html'], mock_policy.return_value, 4)
+        mock_policy.return_value.set_level.assert_called_once_with(3)
+        assert log.output == [f"INFO:root:{LOG_COLOR.INFO.format(message=message)}" for message in [
+            'Compression level 3 for uploads at 2.0 MB/s: predicted 0.50s compressing and 2.00s uploading '
+            '(2.50s, level 6: 3.30s).']]
+
+    @patch("nak.command.CompressionPolicy", autospec=True)
+    def test_get_policy_with_auto_level_before_first_upload_should_keep_policy_levels(self, mock_policy):
+        self.mock_tuner.return_value.choose.return_value = (None, {})
+        self.command.config.compression_level = 'auto'
+
+        with self.assertLogs(level='INFO') as log:
+            self.command.get_policy(None, ['./index.html'])
+
+        mock_policy.return_value.set_level.assert_not_called()
+        assert log.output == [f"INFO:root:{LOG_COLOR.INFO.format(message=message)}" for message in [
+            'Compression level 6, no upload measured yet to tune it, it is tuned after the first push.']]
+
+    @patch("nak.gitindex.GitIndex", autospec=True)
+    @patch("nak.gitindex.list_git_files", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    def test_get_file_list_with_git_discovery_should_list_files_with_git(
+        self, mock_get_file, mock_list_git_files, mock_git_index
+    ):
+        mock_list_git_files.return_value = ['templates/index.html', 'assets/app.exe', 'README.md']
+
+        file_list, git_index = self.command.get_file_list('.', MagicMock(discovery='git'))
+
+        assert file_list == ['./templates/index.html']
+        assert git_index is mock_git_index.return_value
+        mock_git_index.assert_called_once_with('.')
+        mock_get_file.assert_not_called()
+
+    @patch("nak.gitindex.list_git_files", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    def test_get_file_list_outside_of_git_checkout_should_walk_directory(self, mock_get_file, mock_list_git_files):
+        mock_list_git_files.return_value = None
+        mock_get_file.return_value = ['./templates/index.html']
+        self.command.config.discovery = 'git'
+
+        with self.assertLogs(level='INFO') as log:
+            file_list, git_index = self.command.get_file_list('.', MagicMock(discovery=None))
+
+        assert file_list == ['./templates/index.html']
+        assert git_index is None
+        assert log.output == [f"INFO:root:{LOG_COLOR.INFO.format(message=message)}" for message in [
+            'Unable to list files with git, the app is not in a git checkout. Walking the directory.']]
+
+    @patch("nak.gitindex.list_git_files", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    def test_get_file_list_by_default_should_walk_directory(self, mock_get_file, mock_list_git_files):
+        mock_get_file.return_value = ['./templates/index.html']
+
+        assert self.command.get_file_list('.') == (['./templates/index.html'], None)
+        mock_list_git_files.assert_not_called()
+
+    @patch("os.path.exists")
+    @patch("nak.builder.Builder", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    def test_build_with_minify_should_log_bytes_saved_per_type(self, mock_get_file, mock_builder, mock_path_exists):
+        mock_get_file.return_value = ["index.html", "app.js"]
+        mock_path_exists.side_effect = [True, True]
+        mock_builder.return_value.reused = 0
+        mock_builder.return_value.compressed = 2
+        mock_builder.return_value.digest = 'zip digest'
+        mock_builder.return_value.minified = {'.js': [1, 4096, 1024], '.html': [1, 2048, 2048]}
+
+        with self.assertLogs(level='INFO') as log:
+            self.command.build(MagicMock(jobs=1, minify=True, all=False))
+
+        minifier = mock_builder.call_args[1]['minifier']
+        assert sorted(minifier.extensions) == ['.css', '.html', '.js', '.json', '.svg']
+        assert log.output[-5:-3] == [
+            f"INFO:root:{LOG_COLOR.INFO.format(message=message)}" for message in [
+                'Minified 1 .html files from 2.0 KB to 2.0 KB, saved 0 B (0.0%).',
+                'Minified 1 .js files from 4.0 KB to 1.0 KB, saved 3.0 KB (75.0%).',
+            ]
+        ]
+
+    def test_get_minifier_should_use_extensions_from_config(self):
+        self.command.config.minify = ['css', '.JS']
+        assert sorted(self.command.get_minifier().extensions) == ['.css', '.js']
+
+        self.command.config.minify = False
+        assert self.command.get_minifier() is None
+        assert self.command.get_minifier(MagicMock(minify=True)) is not None
+
+        self.command.config.minify = ['.png']
+        with self.assertRaises(TypeError):
+            self.command.get_minifier()
 
     #####
     # push
@@ -167,9 +355,11 @@ class TestCommand(unittest.TestCase):
         self.mock_gateway.return_value.update_app.assert_called_once_with(
             files={
                 # send with latest file
-                'file': ('test1-20200101010101.zip', file)
-            }
+                'file': ('test1-20200101010101.zip', file.__enter__.return_value)
+            },
+            callback=ANY
         )
+        file.__exit__.assert_called_once()
         assert log.output == [
             f'INFO:root:{LOG_COLOR.INFO.format(message="Pushing to app with client_id 123456")}',
             f'INFO:root:{LOG_COLOR.INFO.format(message="with filename test1-20200101010101.zip")}',
@@ -204,15 +394,55 @@ class TestCommand(unittest.TestCase):
         self.mock_gateway.return_value.update_app.assert_called_once_with(
             files={
                 # send with latest file
-                'file': ('test2-20200101010102.zip', file)
-            }
+                'file': ('test2-20200101010102.zip', file.__enter__.return_value)
+            },
+            callback=ANY
         )
+        file.__exit__.assert_called_once()
         assert log.output == [
             f'INFO:root:{LOG_COLOR.INFO.format(message="Pushing to app with client_id 123456")}',
             f'INFO:root:{LOG_COLOR.INFO.format(message="with filename test2-20200101010102.zip")}',
             f'INFO:root:{LOG_COLOR.INFO.format(message="by username test@29next.com")}',
             f"INFO:root:{LOG_COLOR.SUCCESS.format(message='Push update file to app successfully.')}"
         ]
+        self.mock_get_build_digest.assert_called_once_with("test2-20200101010102.zip")
+        self.mock_set_pushed_digest.assert_called_once_with('123456', 'digest')
+        self.mock_store.return_value.mark_pushed.assert_called_once_with("test2-20200101010102.zip")
+        # the mocked gateway reads no bytes of the file
+        self.mock_tuner.return_value.record_upload.assert_called_once_with(0, ANY)
+
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.command.get_lastest_build_file", autospec=True)
+    def test_push_with_already_pushed_build_should_skip_upload(self, mock_get_file, mock_path_exists):
+        mock_get_file.return_value = "test2-20200101010102.zip"
+        mock_path_exists.return_value = True
+        self.command.config.client_id = '123456'
+        self.mock_get_pushed_digest.return_value = 'digest'
+
+        with self.assertLogs(level='INFO') as log:
+            self.command.push()
+
+        self.mock_get_pushed_digest.assert_called_once_with('123456')
+        self.mock_gateway.return_value.update_app.assert_not_called()
+        self.mock_set_pushed_digest.assert_not_called()
+        message = 'App with client_id 123456 is already up to date, nothing to upload. Use --force to upload anyway.'
+        assert log.output == [f"INFO:root:{LOG_COLOR.SUCCESS.format(message=message)}"]
+
+    @patch("builtins.open", autospec=True)
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.command.get_lastest_build_file", autospec=True)
+    def test_push_with_force_should_upload_already_pushed_build(self, mock_get_file, mock_path_exists, mock_open_file):
+        mock_get_file.return_value = "test2-20200101010102.zip"
+        mock_path_exists.return_value = True
+        self.command.config.client_id = '123456'
+        self.mock_get_pushed_digest.return_value = 'digest'
+        self.mock_gateway.return_value.update_app.return_value.ok = True
+
+        with self.assertLogs(level='INFO'):
+            self.command.push(MagicMock(force=True, all=False, targets=None))
+
+        self.mock_gateway.return_value.update_app.assert_called_once()
+        self.mock_set_pushed_digest.assert_called_once_with('123456', 'digest')
 
     @patch("os.path.exists", autospec=True)
     @patch("nak.command.get_all_file", autospec=True)
@@ -253,3 +483,409 @@ class TestCommand(unittest.TestCase):
 
         assert str(error.exception) == LOG_COLOR.ERROR.format(
             message=('Please run build before push command.'))
+
+    #####
+    # push --targets
+    #####
+    def create_build_file(self, data):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, 'app-20200101010101.zip')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.command.get_lastest_build_file", autospec=True)
+    def test_push_with_targets_should_report_progress_of_archive_bytes(self, mock_get_file, mock_path_exists):
+        from nak.multipart import MultipartEncoder
+        from nak.progress import Progress
+
+        mock_get_file.return_value = self.create_build_file(b'zip data' * 1000)
+        mock_path_exists.return_value = True
+        self.command.config.targets = {'qa': 'id-qa', 'production': 'id-production'}
+        progresses = []
+
+        def create_progress(*args, **kwargs):
+            progresses.append(Progress(*args, enabled=False, **kwargs))
+            return progresses[-1]
+
+        def update_app(files, callback):
+            encoder = MultipartEncoder(files=files, callback=callback)
+            while encoder.read(1000):
+                pass
+            return MagicMock(ok=True)
+
+        self.mock_gateway.return_value.update_app.side_effect = update_app
+
+        with patch('nak.command.Progress', side_effect=create_progress), self.assertLogs(level='INFO'):
+            self.command.push(MagicMock(targets=['qa', 'production'], force=False, all=False))
+
+        assert progresses[0].done == progresses[0].total == 2 * 8000
+
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.command.get_lastest_build_file", autospec=True)
+    def test_push_with_targets_should_upload_archive_to_every_target(self, mock_get_file, mock_path_exists):
+        mock_get_file.return_value = self.create_build_file(b'zip data' * 1000)
+        mock_path_exists.return_value = True
+        self.command.config.targets = {'qa': 'id-qa', 'production': 'id-production', 'staging': 'id-staging'}
+
+        uploaded = []
+
+        def update_app(files, callback):
+            file_name, fileobj = files['file']
+            uploaded.append((file_name, fileobj.read()))
+            return MagicMock(ok=True)
+
+        self.mock_gateway.return_value.update_app.side_effect = update_app
+
+        with self.assertLogs(level='INFO') as log:
+            result = self.command.push(MagicMock(targets=['qa', 'production'], force=False, all=False))
+
+        assert result is True
+        assert uploaded == [('app-20200101010101.zip', b'zip data' * 1000)] * 2
+        client_ids = sorted(kwargs['client_id'] for _, kwargs in self.mock_gateway.call_args_list[1:])
+        assert client_ids == ['id-production', 'id-qa']
+        assert all(kwargs['session'] is self.mock_gateway.return_value.session
+                   for _, kwargs in self.mock_gateway.call_args_list[1:])
+        self.mock_set_pushed_digest.assert_has_calls([call('id-qa', 'digest'), call('id-production', 'digest')])
+        self.mock_store.return_value.mark_pushed.assert_called_once_with(mock_get_file.return_value)
+        assert log.output[-1] == (
+            f"INFO:root:{LOG_COLOR.SUCCESS.format(message='Push update file to 2 apps successfully.')}")
+
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.command.get_lastest_build_file", autospec=True)
+    def test_push_with_targets_should_report_status_per_target(self, mock_get_file, mock_path_exists):
+        mock_get_file.return_value = self.create_build_file(b'zip data')
+        mock_path_exists.return_value = True
+        self.command.config.targets = {'qa': 'id-qa', 'production': 'id-production'}
+        self.mock_get_pushed_digest.side_effect = lambda client_id: 'digest' if client_id == 'id-qa' else None
+        mock_response = self.mock_gateway.return_value.update_app.return_value
+        mock_response.ok = False
+        mock_response.json.return_value = {"error": "file size limit"}
+
+        with self.assertLogs(level='INFO') as log:
+            result = self.command.push(MagicMock(targets=['qa', 'production'], force=False, all=False))
+
+        assert result is False
+        self.mock_gateway.return_value.update_app.assert_called_once()
+        self.mock_set_pushed_digest.assert_not_called()
+        header = 'target     client_id     status   time s  message'
+        up_to_date = 'qa         id-qa         ok          0.0  Already up to date.'
+        assert log.output[-4:-1] == [
+            f"INFO:root:{LOG_COLOR.INFO.format(message=header)}",
+            f"INFO:root:{LOG_COLOR.INFO.format(message=up_to_date)}",
+            ANY,
+        ]
+        assert 'production id-production failed' in log.output[-2]
+        assert 'Upload file to server failed. file size limit' in log.output[-2]
+        assert log.output[-1] == f"INFO:root:{LOG_COLOR.ERROR.format(message='Push failed for production.')}"
+
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.command.get_lastest_build_file", autospec=True)
+    def test_push_with_unknown_target_should_raise_error(self, mock_get_file, mock_path_exists):
+        mock_get_file.return_value = 'app-20200101010101.zip'
+        mock_path_exists.return_value = True
+        self.command.config.targets = {'qa': 'id-qa'}
+
+        with self.assertRaises(TypeError) as error:
+            self.command.push(MagicMock(targets=['qa', 'prod'], force=False, all=False))
+
+        assert str(error.exception) == LOG_COLOR.ERROR.format(
+            message='Unknown targets prod, the targets in config.yml are: qa.')
+
+    #####
+    # deploy
+    #####
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.builder.Builder", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    def test_deploy_with_wrong_directory_should_raise_error_correctly(
+        self, mock_get_file, mock_builder, mock_path_exists
+    ):
+        mock_path_exists.side_effect = [False, False]
+
+        with self.assertRaises(TypeError) as error:
+            self.command.deploy()
+
+        assert str(error.exception) == LOG_COLOR.ERROR.format(
+            message=(
+                'Unable to locate config or env file. '
+                'You can configure config or env file by running "nak setup".'))
+        assert mock_builder.mock_calls == []
+
+    @patch("os.path.getsize", autospec=True)
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.builder.ArchiveStream", autospec=True)
+    @patch("nak.builder.Builder", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    def test_deploy_with_small_app_should_upload_spooled_buffer(
+        self, mock_get_file, mock_builder, mock_stream, mock_path_exists, mock_getsize
+    ):
+        mock_get_file.return_value = ["test1.file", "test2.file"]
+        mock_path_exists.return_value = True
+        mock_getsize.return_value = 100
+        mock_builder.return_value.write.side_effect = lambda fileobj, file_list: fileobj.write(b'zip data')
+        mock_builder.return_value.reused = 1
+        mock_builder.return_value.compressed = 1
+        mock_builder.return_value.digest = 'zip digest'
+        self.command.config.client_id = '123456'
+        self.command.config.email = 'test@29next.com'
+
+        uploaded = {}
+
+        def update_app(files, callback):
+            file_name, fileobj = files['file']
+            uploaded[file_name] = fileobj.read()
+            return MagicMock(ok=True)
+
+        self.mock_gateway.return_value.update_app.side_effect = update_app
+
+        with self.assertLogs(level='INFO') as log:
+            self.command.deploy()
+
+        file_name = ZIP_DESTINATION_PATH.format(app_name="app-kit", build_time=BUILD_TIME).split('/')[-1]
+        assert uploaded == {file_name: b'zip data'}
+        mock_stream.assert_not_called()
+        assert log.output == [
+            f'INFO:root:{LOG_COLOR.INFO.format(message="Deploying to app with client_id 123456")}',
+            f'INFO:root:{LOG_COLOR.INFO.format(message=f"with filename {file_name}")}',
+            f'INFO:root:{LOG_COLOR.INFO.format(message="by username test@29next.com")}',
+            f"INFO:root:{LOG_COLOR.INFO.format(message='Reused 1 unchanged files, compressed 1 files.')}",
+            f"INFO:root:{LOG_COLOR.SUCCESS.format(message='Deploy app successfully.')}"
+        ]
+        self.mock_set_pushed_digest.assert_called_once_with('123456', 'zip digest')
+
+    @patch("os.path.getsize", autospec=True)
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.builder.Builder", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    def test_deploy_with_already_pushed_small_app_should_skip_upload(
+        self, mock_get_file, mock_builder, mock_path_exists, mock_getsize
+    ):
+        mock_get_file.return_value = ["test1.file"]
+        mock_path_exists.return_value = True
+        mock_getsize.return_value = 100
+        mock_builder.return_value.digest = 'zip digest'
+        self.mock_get_pushed_digest.return_value = 'zip digest'
+
+        with self.assertLogs(level='INFO') as log:
+            self.command.deploy(MagicMock(jobs=None, minify=False, force=False))
+
+        mock_builder.return_value.write.assert_called_once()
+        self.mock_gateway.return_value.update_app.assert_not_called()
+        self.mock_set_pushed_digest.assert_not_called()
+        assert 'already up to date' in log.output[-1]
+
+    @patch("os.path.getsize", autospec=True)
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.builder.ArchiveStream", autospec=True)
+    @patch("nak.builder.Builder", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    def test_deploy_with_large_app_should_upload_archive_stream(
+        self, mock_get_file, mock_builder, mock_stream, mock_path_exists, mock_getsize
+    ):
+        mock_get_file.return_value = ["video.mp4"]
+        mock_path_exists.return_value = True
+        mock_getsize.return_value = DEPLOY_SPOOL_MAX_SIZE + 1
+        mock_response = self.mock_gateway.return_value.update_app.return_value
+        mock_response.ok = False
+        mock_response.json.return_value = {"error": "file size limit"}
+
+        with self.assertLogs(level='INFO') as log:
+            self.command.deploy()
+
+        mock_stream.assert_called_once_with(mock_builder.return_value, ["video.mp4"])
+        mock_builder.return_value.write.assert_not_called()
+        file_name = ZIP_DESTINATION_PATH.format(app_name="app-kit", build_time=BUILD_TIME).split('/')[-1]
+        self.mock_gateway.return_value.update_app.assert_called_once_with(
+            files={'file': (file_name, mock_stream.return_value.__enter__.return_value)})
+        assert log.output[-1] == (
+            f"INFO:root:{LOG_COLOR.ERROR.format(message='Upload file to server failed. file size limit')}")
+
+    @patch("os.path.getsize", autospec=True)
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.builder.Builder", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    def test_deploy_with_large_app_and_failed_build_should_raise_error_correctly(
+        self, mock_get_file, mock_builder, mock_path_exists, mock_getsize
+    ):
+        mock_get_file.return_value = ["video.mp4"]
+        mock_path_exists.return_value = True
+        mock_getsize.return_value = DEPLOY_SPOOL_MAX_SIZE + 1
+        mock_builder.return_value.write.side_effect = FileNotFoundError('video.mp4 was removed')
+
+        def update_app(files):
+            try:
+                files['file'][1].read()
+            except IOError as e:
+                raise requests.ConnectionError(e)
+
+        self.mock_gateway.return_value.update_app.side_effect = update_app
+
+        with self.assertRaises(TypeError) as error, self.assertLogs(level='INFO'):
+            self.command.deploy()
+
+        assert str(error.exception) == LOG_COLOR.ERROR.format(
+            message='Build failed while streaming the archive. video.mp4 was removed')
+        self.mock_set_pushed_digest.assert_not_called()
+
+    #####
+    # --all
+    #####
+    @patch("nak.monorepo.run_apps", autospec=True)
+    @patch("nak.monorepo.find_app_roots", autospec=True)
+    def test_build_all_should_build_every_app_in_processes(self, mock_find_app_roots, mock_run_apps):
+        from nak.monorepo import AppResult
+
+        mock_find_app_roots.return_value = ['./blog', './shop']
+        mock_run_apps.return_value = [AppResult('./blog', 0, 1.0, ''), AppResult('./shop', 0, 2.0, '')]
+
+        with self.assertLogs(level='INFO') as log:
+            result = self.command.build(
+                MagicMock(all=True, processes=2, jobs=None, minify=True, discovery='git', level='auto'))
+
+        assert result is True
+        mock_run_apps.assert_called_once_with(
+            ['./blog', './shop'],
+            ['build', '--jobs', str(max(BUILD_JOBS // 2, 1)), '--minify', '--discovery', 'git', '--level', 'auto'], 2)
+        assert log.output[-1] == f"INFO:root:{LOG_COLOR.SUCCESS.format(message='Build 2 apps successfully.')}"
+
+    @patch("nak.monorepo.run_apps", autospec=True)
+    @patch("nak.monorepo.find_app_roots", autospec=True)
+    def test_push_all_with_failed_app_should_log_its_output(self, mock_find_app_roots, mock_run_apps):
+        from nak.monorepo import AppResult
+
+        mock_find_app_roots.return_value = ['./blog', './shop']
+        mock_run_apps.return_value = [
+            AppResult('./blog', 0, 1.0, 'Push update file to app successfully.'),
+            AppResult('./shop', 1, 2.0, 'Upload file to server failed. file size limit'),
+        ]
+
+        with self.assertLogs(level='INFO') as log:
+            result = self.command.push(MagicMock(all=True, processes=None, force=True, targets=['qa', 'production']))
+
+        assert result is False
+        mock_run_apps.assert_called_once_with(
+            ['./blog', './shop'], ['push', '--force', '--targets', 'qa,production'], 2)
+        assert f"INFO:root:{LOG_COLOR.ERROR.format(message='./shop: Upload file to server failed. file size limit')}" \
+            in log.output
+        assert log.output[-1] == f"INFO:root:{LOG_COLOR.ERROR.format(message='Push failed for 1 of 2 apps.')}"
+
+    @patch("nak.monorepo.find_app_roots", autospec=True)
+    def test_build_all_without_apps_should_raise_error(self, mock_find_app_roots):
+        mock_find_app_roots.return_value = []
+
+        with self.assertRaises(TypeError) as error:
+            self.command.build(MagicMock(all=True))
+
+        assert str(error.exception) == LOG_COLOR.ERROR.format(
+            message='No app found, an app is a directory with a config.yml or .env file.')
+
+    #####
+    # analyze
+    #####
+    def analyze_parser(self, **kwargs):
+        return MagicMock(**dict(dict(file=None, scan=False, top=None, depth=None, json=None, max_size=None), **kwargs))
+
+    @patch("nak.command.get_lastest_build_file", autospec=True)
+    def test_analyze_should_report_latest_build(self, mock_get_lastest_build_file):
+        from nak.builder import make_zinfo
+
+        with tempfile.TemporaryDirectory() as root:
+            build_file = os.path.join(root, 'app.zip')
+            with zipfile.ZipFile(build_file, 'w') as zip_file:
+                zip_file.writestr(make_zinfo('templates/index.html'), b'<html>' * 100, zipfile.ZIP_DEFLATED)
+            mock_get_lastest_build_file.return_value = build_file
+            json_file = os.path.join(root, 'report.json')
+
+            with self.assertLogs(level='INFO') as log:
+                result = self.command.analyze(self.analyze_parser(json=json_file))
+
+            with open(json_file) as f:
+                report = json.load(f)
+
+        assert result is True
+        assert report['source'] == build_file
+        assert report['files'] == 1 and report['size'] == 600
+        assert [row['name'] for row in report['directories']] == ['templates/']
+        assert f'{build_file}: 1 files, 600 B compressed to ' in log.output[0]
+        assert log.output[-1] == f"INFO:root:{LOG_COLOR.INFO.format(message=f'Report written to {json_file}.')}"
+
+    @patch("nak.analyze.scan_files", autospec=True)
+    @patch("nak.command.get_all_file", autospec=True)
+    @patch("nak.command.get_lastest_build_file", autospec=True)
+    def test_analyze_without_build_should_scan_files_of_app(
+        self, mock_get_lastest_build_file, mock_get_file, mock_scan_files
+    ):
+        from nak.analyze import Member
+
+        mock_get_lastest_build_file.return_value = None
+        mock_get_file.return_value = ['./index.html']
+        mock_scan_files.return_value = [Member('index.html', 100, 10)]
+
+        with self.assertLogs(level='INFO') as log:
+            result = self.command.analyze(self.analyze_parser())
+
+        assert result is True
+        mock_scan_files.assert_called_once_with(['./index.html'], '.', ANY)
+        assert log.output[0] == (
+            f"INFO:root:{LOG_COLOR.INFO.format(message='No build file available, analyzing the files of the app.')}")
+
+    @patch("nak.analyze.read_archive", autospec=True)
+    @patch("os.path.isfile", autospec=True)
+    def test_analyze_with_build_over_max_size_should_fail(self, mock_isfile, mock_read_archive):
+        from nak.analyze import Member
+
+        mock_isfile.return_value = True
+        mock_read_archive.return_value = [Member('video.mp4', 2 * 1024 * 1024, 2 * 1024 * 1024, overhead=100)]
+
+        with self.assertLogs(level='INFO') as log:
+            result = self.command.analyze(self.analyze_parser(file='app.zip', max_size='1MB'))
+
+        assert result is False
+        assert log.output[-1] == (
+            f"INFO:root:{LOG_COLOR.ERROR.format(message='Build size 2.0 MB is over the budget of 1.0 MB.')}")
+
+    def test_analyze_with_missing_file_should_raise_error(self):
+        with self.assertRaises(TypeError) as error:
+            self.command.analyze(self.analyze_parser(file='missing.zip'))
+
+        assert str(error.exception) == LOG_COLOR.ERROR.format(message='Build file missing.zip does not exist.')
+
+    #####
+    # watch
+    #####
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.watcher.get_watcher", autospec=True)
+    def test_watch_should_rebuild_and_push_on_every_change(self, mock_get_watcher, mock_path_exists):
+        mock_path_exists.return_value = True
+        mock_watcher = mock_get_watcher.return_value
+        mock_watcher.wait_for_changes.side_effect = [{'index.html'}, {'app.js'}, KeyboardInterrupt]
+
+        with patch.object(self.command, 'build') as mock_build, patch.object(self.command, 'push') as mock_push:
+            with self.assertLogs(level='INFO') as log:
+                with self.assertRaises(KeyboardInterrupt):
+                    self.command.watch(MagicMock(push=True, interval=None, debounce=0.5))
+
+        assert mock_build.call_count == 3
+        assert mock_push.call_count == 3
+        mock_watcher.wait_for_changes.assert_called_with(0.5)
+        mock_watcher.close.assert_called_once_with()
+        assert f"INFO:root:{LOG_COLOR.INFO.format(message='Detected changes in 1 files.')}" in log.output
+
+    @patch("os.path.exists", autospec=True)
+    @patch("nak.watcher.get_watcher", autospec=True)
+    def test_watch_with_failed_build_should_keep_watching(self, mock_get_watcher, mock_path_exists):
+        mock_path_exists.return_value = True
+        mock_watcher = mock_get_watcher.return_value
+        mock_watcher.wait_for_changes.side_effect = [{'index.html'}, KeyboardInterrupt]
+
+        with patch.object(self.command, 'build') as mock_build, patch.object(self.command, 'push') as mock_push:
+            mock_build.side_effect = [TypeError('build failed'), None]
+            with self.assertLogs(level='INFO'):
+                with self.assertRaises(KeyboardInterrupt):
+                    self.command.watch(MagicMock(push=False, interval=None, debounce=None))
+
+        assert mock_build.call_count == 2
+        mock_push.assert_not_called()
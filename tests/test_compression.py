@@ -0,0 +1,150 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from nak import compression
+from nak.compression import CompressionPolicy
+from nak.settings import BUILD_COMPRESSION_LEVEL, DEFLATE_BACKENDS, LOG_COLOR
+
+
+class TestCompression(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def create_file(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    ####
+    # is_compressible
+    ####
+    def test_is_compressible_with_text_should_return_true(self):
+        path = self.create_file('file.txt', b'body { color: red; }\n' * 100)
+        assert compression.is_compressible(path)
+
+    def test_is_compressible_with_random_data_should_return_false(self):
+        path = self.create_file('file.bin', os.urandom(10000))
+        assert not compression.is_compressible(path)
+
+    def test_is_compressible_with_empty_file_should_return_false(self):
+        path = self.create_file('file.txt', b'')
+        assert not compression.is_compressible(path)
+
+    ####
+    # CompressionPolicy
+    ####
+    def test_policy_should_store_media_and_deflate_text_by_default(self):
+        policy = CompressionPolicy()
+
+        assert policy.get_rule('assets/video.MP4') == ('store', None)
+        assert policy.get_rule('assets/app.js') == ('deflate', BUILD_COMPRESSION_LEVEL)
+        assert policy.get_rule('assets/doc.pdf') == ('auto', BUILD_COMPRESSION_LEVEL)
+
+    def test_policy_with_overrides_should_replace_rules(self):
+        policy = CompressionPolicy({
+            'js': {'method': 'deflate', 'level': 9},
+            '.png': 'deflate',
+            'default': 'store',
+        })
+
+        assert policy.get_rule('app.js') == ('deflate', 9)
+        assert policy.get_rule('image.png') == ('deflate', BUILD_COMPRESSION_LEVEL)
+        assert policy.get_rule('doc.pdf') == ('store', None)
+
+    def test_policy_with_invalid_method_should_raise_error(self):
+        with self.assertRaises(TypeError) as error:
+            CompressionPolicy({'.js': 'zstd'})
+
+        assert str(error.exception) == LOG_COLOR.ERROR.format(
+            message='Invalid compression method for .js, use one of store, deflate, auto.')
+
+    def test_policy_with_invalid_level_should_raise_error(self):
+        with self.assertRaises(TypeError) as error:
+            CompressionPolicy({'.js': {'method': 'deflate', 'level': 12}})
+
+        assert str(error.exception) == LOG_COLOR.ERROR.format(
+            message='Invalid compression level for .js, level must be between 0 and 9.')
+
+    def test_set_level_should_keep_rules_from_config_and_stored_files(self):
+        policy = CompressionPolicy({'.js': {'method': 'deflate', 'level': 9}})
+
+        policy.set_level(1)
+
+        assert policy.get_rule('app.js') == ('deflate', 9)
+        assert policy.get_rule('index.html') == ('deflate', 1)
+        assert policy.get_rule('image.png') == ('store', None)
+        assert policy.get_rule('doc.pdf') == ('auto', 1)
+
+        policy = CompressionPolicy({'default': 'deflate'})
+        policy.set_level(1)
+        assert policy.get_rule('doc.pdf') == ('deflate', BUILD_COMPRESSION_LEVEL)
+
+    def test_resolve_with_auto_rule_should_sample_file(self):
+        policy = CompressionPolicy()
+        text = self.create_file('doc.pdf', b'%PDF text ' * 1000)
+        binary = self.create_file('other.pdf', os.urandom(10000))
+
+        assert policy.resolve(text) == ('deflate', BUILD_COMPRESSION_LEVEL)
+        assert policy.resolve(binary) == ('store', None)
+
+    ####
+    # get_deflate_backend
+    ####
+    def test_get_deflate_backend_with_auto_should_return_first_working_backend(self):
+        backend = compression.get_deflate_backend('auto')
+
+        assert backend.name in DEFLATE_BACKENDS
+        assert backend.check()
+
+    @patch('nak.compression.load_backend', autospec=True)
+    def test_get_deflate_backend_without_accelerated_backends_should_fall_back_to_zlib(self, mock_load_backend):
+        def load_backend(name):
+            if name != 'zlib':
+                raise ImportError(name)
+            return compression.ZLIB_BACKEND
+        mock_load_backend.side_effect = load_backend
+
+        assert compression.get_deflate_backend('auto') is compression.ZLIB_BACKEND
+        assert [call[0][0] for call in mock_load_backend.call_args_list] == ['isal', 'zlib-ng', 'zlib']
+
+    @patch('nak.compression.load_backend', autospec=True)
+    def test_get_deflate_backend_with_missing_backend_should_log_and_use_zlib(self, mock_load_backend):
+        mock_load_backend.side_effect = ImportError('isal')
+
+        with self.assertLogs(level='INFO') as log:
+            backend = compression.get_deflate_backend('isal')
+
+        assert backend is compression.ZLIB_BACKEND
+        assert log.output == [
+            f"INFO:root:{LOG_COLOR.INFO.format(message='Deflate backend isal is not available, using zlib.')}"]
+
+    @patch('nak.compression.load_backend', autospec=True)
+    def test_get_deflate_backend_with_broken_backend_should_use_zlib(self, mock_load_backend):
+        broken = MagicMock()
+        broken.compressobj.return_value.compress.return_value = b'not deflate'
+        broken.compressobj.return_value.flush.return_value = b''
+        mock_load_backend.return_value = compression.DeflateBackend('zlib-ng', broken)
+
+        with self.assertLogs(level='INFO'):
+            assert compression.get_deflate_backend('zlib-ng') is compression.ZLIB_BACKEND
+
+    def test_get_deflate_backend_with_invalid_name_should_raise_error(self):
+        with self.assertRaises(TypeError) as error:
+            compression.get_deflate_backend('brotli')
+
+        assert str(error.exception) == LOG_COLOR.ERROR.format(
+            message='Invalid deflate backend brotli, use one of auto, isal, zlib-ng, zlib.')
+
+    def test_deflate_backend_should_map_levels(self):
+        module = MagicMock()
+        backend = compression.DeflateBackend('isal', module, compression.ISAL_LEVELS)
+
+        backend.compressobj(9)
+
+        module.compressobj.assert_called_once_with(3, module.DEFLATED, -15)
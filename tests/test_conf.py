@@ -1,12 +1,19 @@
+import os
+import tempfile
 from unittest import TestCase
 from unittest.mock import call, mock_open, patch
 
+import yaml
+
+from nak import config
 from nak.config import Config
-from nak.settings import LOG_COLOR
+from nak.settings import (BUILD_RETENTION_KEEP, BUILD_RETENTION_MAX_SIZE, LOG_COLOR, REQUEST_CONNECT_TIMEOUT,
+                          REQUEST_READ_TIMEOUT)
 
 
 class TestConfig(TestCase):
     def setUp(self):
+        config.clear_cache()
         self.config = Config()
         self.config.email = 'test@29next.com'
         self.config.password = 'password'
@@ -15,26 +22,125 @@ class TestConfig(TestCase):
     ####
     # read_config
     ####
-    @patch('builtins.open', mock_open(read_data='yaml data'))
-    @patch("yaml.load", autospec=True)
-    @patch("nak.config.env_config", autospec=True)
-    @patch("os.path.exists", autospec=True)
-    def test_read_config_should_read_config_from_file_and_return_config_correctly(
-        self, mock_patch_exists, mock_env, mock_load_yaml
-    ):
-        mock_patch_exists.return_value = True
-        mock_load_yaml.return_value = expected_config = {
-            'client_id': 123456
-        }
-        mock_env.side_effect = ['test@29next.com', 'password']
+    def write_files(self, directory, configs='client_id: 123456\n', env='email=test@29next.com\npassword=password'):
+        config_file = os.path.join(directory, 'config.yml')
+        env_file = os.path.join(directory, '.env')
+        with open(config_file, 'w') as f:
+            f.write(configs)
+        with open(env_file, 'w') as f:
+            f.write(env)
+        return config_file, env_file
+
+    def test_read_config_should_read_config_from_file_and_return_config_correctly(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file, env_file = self.write_files(tmp_dir)
+            with patch('nak.config.CONFIG_FILE', config_file), patch('nak.config.ENV_FILE', env_file):
+                configs, env = self.config.read_config()
+
+        assert configs == {'client_id': 123456}
+        assert env == {'email': 'test@29next.com', 'password': 'password'}
+
+    def test_read_config_without_files_should_return_empty_config(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file, env_file = os.path.join(tmp_dir, 'config.yml'), os.path.join(tmp_dir, '.env')
+            with patch('nak.config.CONFIG_FILE', config_file), patch('nak.config.ENV_FILE', env_file):
+                assert self.config.read_config() == ({}, {})
+
+    def test_read_config_with_unchanged_files_should_not_parse_files_again(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file, env_file = self.write_files(tmp_dir)
+            with patch('nak.config.CONFIG_FILE', config_file), patch('nak.config.ENV_FILE', env_file), \
+                    patch('yaml.load', wraps=yaml.load) as mock_load, \
+                    patch('nak.config.RepositoryEnv', wraps=config.RepositoryEnv) as mock_env:
+                Config()
+                configs, env = Config().read_config()
+
+        assert mock_load.call_count == 1
+        assert mock_env.call_count == 1
+        assert configs == {'client_id': 123456}
+        assert env['email'] == 'test@29next.com'
+
+    def test_read_config_with_changed_file_should_parse_file_again(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file, env_file = self.write_files(tmp_dir)
+            with patch('nak.config.CONFIG_FILE', config_file), patch('nak.config.ENV_FILE', env_file):
+                self.config.read_config()
+                self.write_files(tmp_dir, configs='client_id: 56789012\n', env='email=other@29next.com')
+                configs, env = self.config.read_config()
+
+        assert configs == {'client_id': 56789012}
+        assert env == {'email': 'other@29next.com', 'password': None}
+
+    def test_read_config_should_return_copy_of_cached_config(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file, env_file = self.write_files(tmp_dir)
+            with patch('nak.config.CONFIG_FILE', config_file), patch('nak.config.ENV_FILE', env_file):
+                configs, _ = self.config.read_config()
+                configs['client_id'] = 1
+                assert self.config.read_config()[0] == {'client_id': 123456}
+
+    def test_read_config_should_let_environment_variables_override_env_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file, env_file = self.write_files(tmp_dir)
+            with patch('nak.config.CONFIG_FILE', config_file), patch('nak.config.ENV_FILE', env_file), \
+                    patch.dict(os.environ, {'password': 'secret'}):
+                _, env = self.config.read_config()
+
+        assert env == {'email': 'test@29next.com', 'password': 'secret'}
+
+    def test_yaml_loader_should_be_safe_loader(self):
+        assert config.YAML_LOADER in (getattr(yaml, 'CSafeLoader', None), yaml.SafeLoader)
+        if yaml.__with_libyaml__:
+            assert config.YAML_LOADER is yaml.CSafeLoader
 
-        configs, env = self.config.read_config()
-        expected_env = {
-            'email': 'test@29next.com',
-            'password': 'password'
-        }
-        assert configs == expected_config
-        assert env == expected_env
+    ####
+    # get_timeout
+    ####
+    def test_get_timeout_should_parse_config_value(self):
+        assert Config.get_timeout(None) == (REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT)
+        assert Config.get_timeout(30) == (30, 30)
+        assert Config.get_timeout({'read': 600}) == (REQUEST_CONNECT_TIMEOUT, 600)
+        assert Config.get_timeout({'connect': 5, 'read': 60}) == (5, 60)
+
+    ####
+    # get_targets
+    ####
+    def test_get_targets_should_parse_config_value(self):
+        assert Config.get_targets(None) == {}
+        assert Config.get_targets({'qa': 'ID1', 'production': {'client_id': 'ID2'}, 3: 1234}) == {
+            'qa': 'ID1', 'production': 'ID2', '3': '1234'}
+
+    def test_get_targets_without_client_id_should_raise_error(self):
+        with self.assertRaises(TypeError) as error:
+            Config.get_targets({'qa': {}})
+        assert str(error.exception) == LOG_COLOR.ERROR.format(message='Target qa has no client_id.')
+
+    ####
+    # get_retention
+    ####
+    def test_get_retention_should_parse_config_value(self):
+        assert Config.get_retention(None) == (BUILD_RETENTION_KEEP, BUILD_RETENTION_MAX_SIZE)
+        assert Config.get_retention({'keep': 2}) == (2, BUILD_RETENTION_MAX_SIZE)
+        assert Config.get_retention({'max_size': 1000}) == (BUILD_RETENTION_KEEP, 1000)
+        assert Config.get_retention({'keep': 3, 'max_size': '500MB'}) == (3, 500 * 1024 * 1024)
+        assert Config.get_retention({'max_size': '1.5 GB'}) == (BUILD_RETENTION_KEEP, int(1.5 * 1024 ** 3))
+
+    def test_get_retention_with_invalid_size_should_raise_error(self):
+        with self.assertRaises(TypeError) as error:
+            Config.get_retention({'max_size': 'a lot'})
+        assert str(error.exception) == LOG_COLOR.ERROR.format(
+            message='Invalid size a lot, use bytes or a size like 500MB.')
+
+    def test_get_compression_level_should_parse_config_value(self):
+        assert Config.get_compression_level(None) is None
+        assert Config.get_compression_level('auto') == 'auto'
+        assert Config.get_compression_level(0) == 0
+
+        for level in [10, '9', True]:
+            with self.assertRaises(TypeError) as error:
+                Config.get_compression_level(level)
+            assert str(error.exception) == LOG_COLOR.ERROR.format(
+                message=f'Invalid compression_level {level}, use auto or a level between 0 and 9.')
 
     ####
     # validate_config
@@ -106,6 +212,25 @@ class TestConfig(TestCase):
             with open('.env') as env:
                 assert env.writelines.mock_calls == [call('email=test@29next.com\npassword=password2')]
 
+    @patch("yaml.dump", autospec=True)
+    @patch("nak.config.Config.read_config", autospec=True)
+    def test_write_config_should_keep_other_config_sections(self, mock_read_config, mock_dump_yaml):
+        mock_read_config.return_value = {
+            'client_id': 123456,
+            'compression': {'.js': 'store'},
+        }, {
+            'email': 'test@29next.com',
+            'password': 'password',
+        }
+
+        with patch('builtins.open', mock_open()) as mock_file:
+            self.config.write_config()
+
+        mock_dump_yaml.assert_called_once_with({
+            'client_id': '123456',
+            'compression': {'.js': 'store'},
+        }, mock_file.return_value)
+
     ####
     # save
     ####
@@ -1,10 +1,13 @@
+import io
 from unittest import TestCase
 from unittest.mock import MagicMock, call, patch
 
+import requests
 from requests.auth import HTTPBasicAuth
 
+from benchmarks.server import StandInServer
 from nak.gateway import Gateway
-from nak.settings import API_URL
+from nak.settings import API_URL, REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT
 
 
 class TestGateway(TestCase):
@@ -20,9 +23,10 @@ class TestGateway(TestCase):
     # _request
     ####
     @patch('nak.gateway.requests', autospec=True)
-    def test_request_should_call_requests_correctly(self, mock_requests):
+    def test_request_should_call_session_correctly(self, mock_requests):
         mock_requests.auth.HTTPBasicAuth.return_value = authenticate = HTTPBasicAuth(
             self.email, self.password)
+        mock_session = mock_requests.Session.return_value
 
         request_type = 'POST'
         url = 'test.com'
@@ -35,23 +39,180 @@ class TestGateway(TestCase):
             'POST', 'test.com',
             data={},
             files=files,
-            auth=authenticate)
+            headers=None,
+            timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT))
         ]
-        assert mock_requests.request.mock_calls == expected_calls
+        assert mock_session.request.mock_calls == expected_calls
+        assert mock_session.auth == authenticate
 
     @patch('nak.gateway.requests')
     def test_gateway_update_app_success_should_call_request_correctly(self, mock_requests):
-        mock_requests.request.return_value.json.return_value = {"a": "b"}
-        mock_requests.request.return_value.ok = True
-        mock_requests.request.return_value.headers = {'content-type': 'application/json'}
-        mock_requests.auth.HTTPBasicAuth.return_value = authenticate = HTTPBasicAuth(
-            self.email, self.password)
+        mock_session = mock_requests.Session.return_value
+        mock_session.request.return_value.json.return_value = {"a": "b"}
+        mock_session.request.return_value.ok = True
+        mock_session.request.return_value.status_code = 200
 
-        self.gateway.update_app(self.mock_zip_file)
+        self.gateway.update_app({'file': ('tmp/test.zip', io.BytesIO(b'zip data'))})
 
-        assert mock_requests.request.mock_calls == [
-            # call request
-            call(
-                'PATCH', f'{API_URL}/api/apps/ABCD1234/',
-                data={}, files=self.mock_zip_file, auth=authenticate),
-        ]
+        assert len(mock_session.request.mock_calls) == 1
+        args, kwargs = mock_session.request.call_args
+        body = kwargs['data']
+        assert args == ('PATCH', f'{API_URL}/api/apps/ABCD1234/')
+        assert kwargs['files'] is None
+        assert kwargs['headers'] == {'Content-Type': f'multipart/form-data; boundary={body.boundary}'}
+        assert body.read() == (
+            f'--{body.boundary}\r\n'
+            'Content-Disposition: form-data; name="file"; filename="tmp/test.zip"\r\n\r\n'
+            'zip data\r\n'
+            f'--{body.boundary}--\r\n'
+        ).encode()
+
+    @patch('nak.gateway.requests')
+    def test_gateway_update_app_with_unseekable_file_should_send_chunked_body(self, mock_requests):
+        stream = MagicMock()
+        stream.seekable.return_value = False
+        stream.read.side_effect = [b'zip ', b'data', b'']
+
+        self.gateway.update_app({'file': ('test.zip', stream)})
+
+        kwargs = mock_requests.Session.return_value.request.call_args[1]
+        boundary = kwargs['headers']['Content-Type'].split('boundary=')[1]
+        assert not hasattr(kwargs['data'], '__len__')
+        assert b''.join(kwargs['data']).endswith(
+            f'filename="test.zip"\r\n\r\nzip data\r\n--{boundary}--\r\n'.encode())
+
+    ####
+    # get_retry_delay
+    ####
+    @patch('nak.gateway.random.uniform', autospec=True)
+    def test_get_retry_delay_should_grow_exponentially_with_jitter(self, mock_uniform):
+        mock_uniform.side_effect = lambda low, high: high
+
+        assert [self.gateway.get_retry_delay(attempt) for attempt in range(3)] == [0.5, 1.0, 2.0]
+        assert self.gateway.get_retry_delay(10) == 30
+        assert mock_uniform.call_args_list[0] == call(0, 0.5)
+
+    def test_get_retry_delay_should_respect_retry_after_header(self):
+        response = MagicMock(headers={'Retry-After': '5'})
+        assert self.gateway.get_retry_delay(0, response) == 5
+
+
+@patch('nak.gateway.time.sleep', autospec=True)
+class TestGatewayWithServer(TestCase):
+    def create_gateway(self, server, **kwargs):
+        gateway = Gateway('test@test.com', 'password', 'ABCD1234', **kwargs)
+        self.addCleanup(gateway.close)
+        patcher = patch('nak.gateway.API_URL', server.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return gateway
+
+    def test_update_app_with_transient_errors_should_retry_and_resend_body(self, mock_sleep):
+        with StandInServer([(502, 0), (503, 0)], keep_bodies=True) as server:
+            gateway = self.create_gateway(server)
+            response = gateway.update_app({'file': ('app.zip', io.BytesIO(b'zip data'))})
+
+        assert response.status_code == 200
+        assert len(server.requests) == 3
+        assert mock_sleep.call_count == 2
+        assert all(b'zip data' in request['body'] for request in server.requests)
+        assert len({request['body'] for request in server.requests}) == 1
+        assert server.requests[0]['authorization'].startswith('Basic ')
+
+    def test_update_app_with_persistent_errors_should_return_last_response(self, mock_sleep):
+        with StandInServer([(502, 0)] * 5) as server:
+            gateway = self.create_gateway(server, max_retries=2)
+            response = gateway.update_app({'file': ('app.zip', io.BytesIO(b'zip data'))})
+
+        assert response.status_code == 502
+        assert len(server.requests) == 3
+
+    def test_update_app_with_client_error_should_not_retry(self, mock_sleep):
+        with StandInServer([(400, 0)]) as server:
+            gateway = self.create_gateway(server)
+            response = gateway.update_app({'file': ('app.zip', io.BytesIO(b'zip data'))})
+
+        assert response.status_code == 400
+        assert len(server.requests) == 1
+        mock_sleep.assert_not_called()
+
+    def test_update_app_with_rate_limit_should_not_retry(self, mock_sleep):
+        with StandInServer([(429, 0)]) as server:
+            gateway = self.create_gateway(server)
+            response = gateway.update_app({'file': ('app.zip', io.BytesIO(b'zip data'))})
+
+        assert response.status_code == 429
+        assert len(server.requests) == 1
+
+    def test_update_app_with_slow_server_should_time_out_without_retry(self, mock_sleep):
+        with StandInServer([(200, 1)]) as server:
+            gateway = self.create_gateway(server, timeout=(1, 0.2))
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                gateway.update_app({'file': ('app.zip', io.BytesIO(b'zip data'))})
+
+        assert len(server.requests) == 1
+        mock_sleep.assert_not_called()
+
+    def test_update_app_with_connection_error_should_retry(self, mock_sleep):
+        with StandInServer() as server:
+            gateway = self.create_gateway(server, max_retries=2)
+        # nothing listens on the port of the stopped server
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            gateway.update_app({'file': ('app.zip', io.BytesIO(b'zip data'))})
+
+        assert mock_sleep.call_count == 2
+
+    def test_request_with_slow_server_should_time_out_and_retry(self, mock_sleep):
+        with StandInServer([(200, 1)]) as server:
+            gateway = self.create_gateway(server, timeout=(1, 0.2))
+            response = gateway._request('GET', f'{server.url}/api/apps/ABCD1234/')
+
+        assert response.status_code == 200
+        assert len(server.requests) == 2
+
+    def test_request_with_slow_server_should_raise_when_out_of_retries(self, mock_sleep):
+        with StandInServer([(200, 1)]) as server:
+            gateway = self.create_gateway(server, timeout=(1, 0.2), max_retries=0)
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                gateway._request('GET', f'{server.url}/api/apps/ABCD1234/')
+
+    def test_update_app_with_streamed_body_should_not_retry(self, mock_sleep):
+        stream = MagicMock()
+        stream.seekable.return_value = False
+        stream.read.side_effect = [b'zip data', b'']
+
+        with StandInServer([(502, 0)]) as server:
+            gateway = self.create_gateway(server)
+            response = gateway.update_app({'file': ('app.zip', stream)})
+
+        assert response.status_code == 502
+        assert len(server.requests) == 1
+
+    def test_requests_should_reuse_pooled_connection(self, mock_sleep):
+        with StandInServer() as server:
+            gateway = self.create_gateway(server)
+            for _ in range(3):
+                gateway.update_app({'file': ('app.zip', io.BytesIO(b'zip data'))})
+
+        assert len(server.requests) == 3
+        assert len({request['port'] for request in server.requests}) == 1
+
+    def test_gateways_sharing_session_should_upload_same_buffer_concurrently(self, mock_sleep):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from nak.multipart import BufferReader
+
+        data = b'zip data' * 10000
+        with StandInServer(keep_bodies=True) as server:
+            gateway = self.create_gateway(server)
+            gateways = [Gateway('test@test.com', 'password', client_id, session=gateway.session)
+                        for client_id in ['QA', 'PROD', 'STAGING']]
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                responses = list(executor.map(
+                    lambda target: target.update_app({'file': ('app.zip', BufferReader(data))}), gateways))
+
+        assert all(response.ok for response in responses)
+        assert sorted(request['path'] for request in server.requests) == [
+            '/api/apps/PROD/', '/api/apps/QA/', '/api/apps/STAGING/']
+        assert all(data in request['body'] for request in server.requests)
@@ -0,0 +1,120 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from unittest import TestCase
+
+from nak import gitindex
+from nak.gitindex import GitIndex
+
+
+@unittest.skipIf(shutil.which('git') is None, 'git is not installed')
+class TestGitIndex(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.git('init', '-q')
+        self.files = {
+            'shop/index.html': b'<html></html>',
+            'shop/assets/app.js': b'var a = 1;',
+            'blog/index.html': b'<html>blog</html>',
+        }
+        for name, content in self.files.items():
+            self.write(name, content)
+        self.add_all()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def git(self, *args):
+        return subprocess.run(
+            ['git', '-c', 'user.name=nak', '-c', 'user.email=nak@example.com'] + list(args), cwd=self.root,
+            stdout=subprocess.PIPE, check=True).stdout
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        # files written well before the index is, so git does not see them as racily clean
+        mtime = time.time() - 10 if mtime is None else mtime
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def add_all(self):
+        self.git('add', '-A')
+
+    def read_ls_files(self):
+        entries = {}
+        for line in self.git('ls-files', '-s').decode().splitlines():
+            info, name = line.split('\t')
+            entries[name] = info.split()[1]
+        return entries
+
+    ####
+    # read_index
+    ####
+    def test_read_index_should_return_blobs_of_git_ls_files(self):
+        entries = gitindex.read_index(os.path.join(self.root, '.git', 'index'))
+
+        assert {name: entry[4] for name, entry in entries.items()} == self.read_ls_files()
+        stat = os.stat(os.path.join(self.root, 'shop/index.html'))
+        assert entries['shop/index.html'][1:4] == (stat.st_mtime_ns, stat.st_ino & 0xFFFFFFFF, stat.st_size)
+
+    def test_read_index_of_version_4_should_decode_prefix_compressed_paths(self):
+        self.git('update-index', '--index-version', '4')
+
+        entries = gitindex.read_index(os.path.join(self.root, '.git', 'index'))
+
+        assert {name: entry[4] for name, entry in entries.items()} == self.read_ls_files()
+
+    ####
+    # GitIndex
+    ####
+    def test_get_blob_of_unchanged_file_should_return_blob_relative_to_app(self):
+        git_index = GitIndex(os.path.join(self.root, 'shop'))
+        path = os.path.join(self.root, 'shop/assets/app.js')
+
+        assert len(git_index) == 2
+        assert git_index.get_blob('assets/app.js', os.stat(path)) == self.read_ls_files()['shop/assets/app.js']
+
+    def test_get_blob_of_changed_file_should_return_none(self):
+        path = self.write('shop/index.html', b'<html>changed</html>')
+
+        git_index = GitIndex(os.path.join(self.root, 'shop'))
+
+        assert git_index.get_blob('index.html', os.stat(path)) is None
+
+    def test_get_blob_of_racily_clean_file_should_return_none(self):
+        path = self.write('shop/index.html', b'<html>new</html>', mtime=time.time())
+        self.add_all()
+
+        git_index = GitIndex(os.path.join(self.root, 'shop'))
+
+        assert git_index.get_blob('index.html', os.stat(path)) is None
+
+    def test_git_index_outside_of_checkout_should_be_empty(self):
+        with tempfile.TemporaryDirectory() as root:
+            git_index = GitIndex(root)
+
+            assert git_index.get_blob('index.html', os.stat(root)) is None
+            assert len(git_index) == 0
+
+    ####
+    # list_git_files
+    ####
+    def test_list_git_files_should_list_tracked_and_untracked_files_not_ignored(self):
+        self.write('shop/.gitignore', b'dist/\n')
+        self.write('shop/dist/app.js', b'var built = 1;')
+        self.write('shop/new.html', b'<html>new</html>')
+        os.remove(os.path.join(self.root, 'shop/assets/app.js'))
+
+        actual = gitindex.list_git_files(os.path.join(self.root, 'shop'))
+
+        assert sorted(actual) == ['.gitignore', 'index.html', 'new.html']
+
+    def test_list_git_files_outside_of_checkout_should_return_none(self):
+        with tempfile.TemporaryDirectory() as root:
+            assert gitindex.list_git_files(root) is None
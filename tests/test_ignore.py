@@ -0,0 +1,107 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from nak import ignore
+from nak.ignore import IgnoreMatcher
+
+
+class TestIgnore(TestCase):
+    ####
+    # parse_pattern
+    ####
+    def test_parse_pattern_with_blank_or_comment_should_return_none(self):
+        assert ignore.parse_pattern('') is None
+        assert ignore.parse_pattern('   \n') is None
+        assert ignore.parse_pattern('# comment') is None
+
+    def test_parse_pattern_should_return_flags(self):
+        assert ignore.parse_pattern('!keep.js\n')[1:] == (True, False)
+        assert ignore.parse_pattern('node_modules/')[1:] == (False, True)
+        assert ignore.parse_pattern('\\!important.js')[1:] == (False, False)
+
+    ####
+    # IgnoreMatcher
+    ####
+    def test_match_with_name_pattern_should_match_at_any_depth(self):
+        matcher = IgnoreMatcher(['.env', '*.map'])
+
+        assert matcher.match('.env')
+        assert matcher.match('assets/.env')
+        assert matcher.match('assets/js/app.js.map')
+        assert not matcher.match('my.environment.json')
+        assert not matcher.match('assets/app.js')
+
+    def test_match_with_slash_pattern_should_be_anchored_to_root(self):
+        matcher = IgnoreMatcher(['/build', 'docs/*.html'])
+
+        assert matcher.match('build', is_dir=True)
+        assert not matcher.match('assets/build', is_dir=True)
+        assert matcher.match('docs/index.html')
+        assert not matcher.match('docs/api/index.html')
+        assert not matcher.match('assets/docs/index.html')
+
+    def test_match_with_directory_pattern_should_only_match_directories(self):
+        matcher = IgnoreMatcher(['design/'])
+
+        assert matcher.match('design', is_dir=True)
+        assert matcher.match('assets/design', is_dir=True)
+        assert not matcher.match('design')
+
+    def test_match_with_double_star_should_match_nested_paths(self):
+        matcher = IgnoreMatcher(['**/fixtures', 'src/**/*.psd', 'vendor/**'])
+
+        assert matcher.match('fixtures', is_dir=True)
+        assert matcher.match('a/b/fixtures', is_dir=True)
+        assert matcher.match('src/logo.psd')
+        assert matcher.match('src/a/b/logo.psd')
+        assert matcher.match('vendor/lib/app.js')
+        assert not matcher.match('vendor', is_dir=True)
+
+    def test_match_with_negation_should_use_last_matching_pattern(self):
+        matcher = IgnoreMatcher(['*.js', '!app.js', 'assets/app.js'])
+
+        assert matcher.match('vendor.js')
+        assert not matcher.match('app.js')
+        assert matcher.match('assets/app.js')
+
+    def test_match_with_character_class_and_question_mark(self):
+        matcher = IgnoreMatcher(['page[0-9].html', 'file?.css', 'img[!a].png'])
+
+        assert matcher.match('page1.html')
+        assert not matcher.match('pageA.html')
+        assert matcher.match('file1.css')
+        assert not matcher.match('file10.css')
+        assert matcher.match('imgb.png')
+        assert not matcher.match('imga.png')
+
+    def test_match_without_patterns_should_not_match(self):
+        assert not IgnoreMatcher().match('index.html')
+
+    ####
+    # get_ignore_matcher
+    ####
+    def test_get_ignore_matcher_should_combine_defaults_and_nakignore_file(self):
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, '.nakignore'), 'w') as f:
+                f.write('# dependencies\nnode_modules/\n*.map\n')
+
+            matcher = ignore.get_ignore_matcher(root)
+
+        assert matcher.match('config.yml')
+        assert matcher.match('.tmp', is_dir=True)
+        assert matcher.match('node_modules', is_dir=True)
+        assert matcher.match('assets/app.js.map')
+        assert not matcher.match('assets/app.js')
+
+    def test_get_ignore_matcher_with_negated_excludes_should_still_ignore_them(self):
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, '.nakignore'), 'w') as f:
+                f.write('!.env\n!config.yml\n!.tmp/\n!*\n')
+
+            matcher = ignore.get_ignore_matcher(root)
+
+        assert matcher.match('.env')
+        assert matcher.match('config.yml')
+        assert matcher.match('.tmp', is_dir=True)
+        assert not matcher.match('assets/app.js')
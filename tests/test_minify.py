@@ -0,0 +1,126 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from nak import minify
+from nak.minify import Minifier
+
+
+class TestMinify(TestCase):
+    ####
+    # minify_json
+    ####
+    def test_minify_json_should_remove_whitespace(self):
+        json = '{\n  "a": [1, 2.5, "é"],\n  "b": {"c": null}\n}'
+        assert minify.minify_json(json) == '{"a":[1,2.5,"é"],"b":{"c":null}}'
+
+    def test_minify_json_should_keep_numbers_and_escapes_as_written(self):
+        json = '{"a": 1e5, "b": [1.10, -0.0], "c": "\\u00e9 \\" x"}'
+        assert minify.minify_json(json) == '{"a":1e5,"b":[1.10,-0.0],"c":"\\u00e9 \\" x"}'
+
+    ####
+    # minify_css
+    ####
+    def test_minify_css_should_remove_comments_and_whitespace(self):
+        css = '/* header */\na > b ,  c {\n  color: red ;\n  margin: calc(1px + 2px);\n}\n'
+        assert minify.minify_css(css) == 'a>b,c{color: red;margin: calc(1px + 2px)}'
+
+    def test_minify_css_should_keep_strings_and_important_comments(self):
+        css = '/*! license */\na::after { content: "x  ;}  /* y */" ; }'
+        assert minify.minify_css(css) == '/*! license */a::after{content: "x  ;}  /* y */"}'
+
+    ####
+    # minify_js
+    ####
+    def test_minify_js_should_remove_comments_and_indentation(self):
+        js = '// header\nfunction f(x) {\n    /* block */ return x  +  1;  // trailing\n}\n'
+        assert minify.minify_js(js) == 'function f(x) {\nreturn x + 1;\n}'
+
+    def test_minify_js_should_keep_line_breaks_for_semicolon_insertion(self):
+        js = 'a = b\n\n   ++c\nreturn\n  value'
+        assert minify.minify_js(js) == 'a = b\n++c\nreturn\nvalue'
+
+    def test_minify_js_should_keep_strings_templates_and_regex_literals(self):
+        js = (
+            "var s = '  // not a comment  ';\n"
+            "var t = `multi\n    line /* kept */`;\n"
+            "var r = x.replace(/\\/\\/  +/g, '');\n"
+            "var d = a / b / c;\n"
+        )
+        assert minify.minify_js(js) == js.strip()
+
+    def test_minify_js_should_keep_nested_template_literals(self):
+        js = 'const u = `${`http://x.com`}/a`;\nconst b = 2;\n'
+        assert minify.minify_js(js) == 'const u = `${`http://x.com`}/a`;\nconst b = 2;'
+
+        js = 'a = `x ${ {a: 1}["a"] + `y${z /* } */}` } // c`; // comment\nb'
+        assert minify.minify_js(js) == 'a = `x ${ {a: 1}["a"] + `y${z /* } */}` } // c`;\nb'
+
+    def test_minify_js_with_ambiguous_slash_should_raise_error(self):
+        for js in ['if (x) /a  b/.test(y)', 'total = (a) / b / c', 'x = y[0] /a  b/ 2']:
+            with self.subTest(js=js), self.assertRaises(ValueError):
+                minify.minify_js(js)
+
+        assert minify.minify_js('half = (a  +  b) / 2') == 'half = (a + b) / 2'
+
+    ####
+    # minify_html
+    ####
+    def test_minify_html_should_collapse_whitespace_and_remove_comments(self):
+        html = (
+            '<!-- comment -->\n<div class="a">\n    {% if x %}   <span>{{ x }}</span>   {% endif %}\n'
+            '    <!--[if IE]> ie <![endif]-->\n</div>\n'
+        )
+        assert minify.minify_html(html) == (
+            '<div class="a">\n{% if x %} <span>{{ x }}</span> {% endif %}\n<!--[if IE]> ie <![endif]-->\n</div>')
+
+    def test_minify_html_should_keep_attribute_values(self):
+        html = '<a   title="a   b"\n   data-x=\'c  \n d\'>  x  </a>'
+        assert minify.minify_html(html) == '<a title="a   b"\ndata-x=\'c  \n d\'> x </a>'
+
+    def test_minify_html_should_keep_pre_textarea_script_and_style(self):
+        html = '<pre>  a\n   b</pre>\n<script>\n  var a  =  1; // c\n</script>\n<textarea>  x  </textarea>'
+        assert minify.minify_html(html) == html
+
+    ####
+    # minify_svg
+    ####
+    def test_minify_svg_should_remove_whitespace_between_tags(self):
+        svg = '<!-- c -->\n<svg   xmlns="x">\n  <g>\n    <path d="M 0 0  L 1 1"/>\n  </g>\n  <text>  a </text></svg>'
+        assert minify.minify_svg(svg) == '<svg xmlns="x"><g><path d="M 0 0 L 1 1"/></g><text>  a </text></svg>'
+
+
+class TestMinifier(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_directory = os.path.join(self.tmp_dir.name, 'minify')
+        self.minifier = Minifier(cache_directory=self.cache_directory)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_minify_should_cache_result_by_content(self):
+        data = b'{\n  "a": 1\n}'
+
+        assert self.minifier.minify('settings.json', data) == b'{"a":1}'
+        with patch.dict(minify.MINIFIERS, {'.json': None}):
+            # a cache hit does not run the minifier again, even for another path
+            assert self.minifier.minify('locales/en.json', data) == b'{"a":1}'
+
+        assert len(os.listdir(self.cache_directory)) == 1
+
+    def test_minify_with_invalid_content_should_keep_file(self):
+        assert self.minifier.minify('broken.json', b'{"a": ') == b'{"a": '
+        assert self.minifier.minify('latin.css', b'a { content: "\xe9" }') == b'a { content: "\xe9" }'
+
+    def test_can_minify_should_only_accept_configured_extensions(self):
+        minifier = Minifier(extensions=['css', '.JS'], cache_directory=self.cache_directory)
+
+        assert minifier.can_minify('assets/app.JS')
+        assert minifier.can_minify('assets/app.css')
+        assert not minifier.can_minify('templates/index.html')
+
+    def test_init_with_unsupported_extension_should_raise_error(self):
+        with self.assertRaises(TypeError):
+            Minifier(extensions=['.png'], cache_directory=self.cache_directory)
@@ -0,0 +1,95 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from nak import monorepo
+from nak.monorepo import AppResult
+
+
+class TestMonorepo(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def create_files(self, names):
+        for name in names:
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write('client_id: abc\n' if name.endswith('config.yml') else '<p>app</p>')
+
+    ####
+    # find_app_roots
+    ####
+    def test_find_app_roots_should_return_directories_with_config_or_env(self):
+        self.create_files([
+            'shop/config.yml', 'shop/index.html', 'apps/blog/.env', 'apps/landing/config.yml',
+            'apps/landing/nested/config.yml', 'docs/index.html', 'node_modules/lib/config.yml',
+            '.git/config.yml',
+        ])
+
+        roots = monorepo.find_app_roots(self.root)
+
+        assert roots == [os.path.join(self.root, name) for name in ['apps/blog', 'apps/landing', 'shop']]
+
+    def test_find_app_roots_in_app_directory_should_return_it(self):
+        self.create_files(['config.yml', 'other/config.yml'])
+
+        assert monorepo.find_app_roots(self.root) == [self.root]
+
+    ####
+    # results
+    ####
+    def test_app_result_message_should_be_last_log_line_without_colors(self):
+        result = AppResult('shop', 0, 1.0, (
+            '2020-01-01 01:01:01 INFO \x1b[36;10mfile: ./index.html\x1b[0m\n'
+            '2020-01-01 01:01:01 INFO \x1b[32;10mBuild successfully.\x1b[0m\n\n'))
+
+        assert result.ok
+        assert result.lines == ['file: ./index.html', 'Build successfully.']
+        assert result.message == 'Build successfully.'
+        assert not AppResult('shop', 1, 1.0, '').ok
+
+    def test_format_summary_should_list_every_app(self):
+        lines = monorepo.format_summary([
+            AppResult('./shop', 0, 1.25, 'Build successfully.'),
+            AppResult('./apps/blog', 1, 0.5, 'Unable to locate config or env file.'),
+        ])
+
+        assert lines == [
+            'app         status    time s  message',
+            './shop      ok           1.2  Build successfully.',
+            './apps/blog failed       0.5  Unable to locate config or env file.',
+        ]
+
+    @patch('nak.monorepo.run_app', autospec=True)
+    def test_run_apps_should_return_results_in_roots_order(self, mock_run_app):
+        mock_run_app.side_effect = lambda root, argv: AppResult(root, 0 if root != 'b' else 1, 0.1, '')
+
+        with self.assertLogs(level='INFO') as log:
+            results = monorepo.run_apps(['a', 'b', 'c'], ['build'], workers=2)
+
+        assert [(result.root, result.ok) for result in results] == [('a', True), ('b', False), ('c', True)]
+        assert sorted(argv for _, argv in (call[0] for call in mock_run_app.call_args_list)) == [['build']] * 3
+        assert len(log.output) == 3
+
+    def test_run_app_should_run_nak_in_app_directory(self):
+        self.create_files(['config.yml', 'index.html'])
+
+        result = monorepo.run_app(self.root, ['build', '--jobs', '1'])
+
+        assert result.ok, result.output
+        assert result.message == 'Build successfully.'
+        assert any(name.endswith('.zip') for name in os.listdir(os.path.join(self.root, '.tmp')))
+
+    def test_run_app_with_failed_command_should_return_error_status(self):
+        self.create_files(['index.html'])
+
+        result = monorepo.run_app(self.root, ['build'])
+
+        assert result.returncode == 1
+        assert result.message.startswith('Unable to locate config or env file.')
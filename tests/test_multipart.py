@@ -0,0 +1,104 @@
+import io
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from urllib3.fields import RequestField
+from urllib3.filepost import encode_multipart_formdata
+
+from nak.multipart import BufferReader, MultipartEncoder
+
+
+class TestMultipartEncoder(TestCase):
+    def setUp(self):
+        self.tmp_file = tempfile.NamedTemporaryFile(delete=False)
+        self.content = os.urandom(300 * 1024)
+        self.tmp_file.write(self.content)
+        self.tmp_file.close()
+        self.fileobj = open(self.tmp_file.name, 'rb')
+
+    def tearDown(self):
+        self.fileobj.close()
+        os.remove(self.tmp_file.name)
+
+    def get_expected_body(self, boundary):
+        field = RequestField(name='file', data=self.content, filename='.tmp/app.zip')
+        field.make_multipart()
+        body, _ = encode_multipart_formdata([('name', 'app'), field], boundary=boundary)
+        return body
+
+    def test_read_should_encode_same_body_as_requests(self):
+        encoder = MultipartEncoder(fields={'name': 'app'}, files={'file': ('.tmp/app.zip', self.fileobj)})
+
+        body = encoder.read()
+
+        assert body == self.get_expected_body(encoder.boundary)
+        assert len(encoder) == len(body)
+        assert encoder.content_type == f'multipart/form-data; boundary={encoder.boundary}'
+
+    def test_iter_should_stream_body_in_chunks(self):
+        encoder = MultipartEncoder(
+            fields={'name': 'app'}, files={'file': ('.tmp/app.zip', self.fileobj)}, chunk_size=1000)
+
+        chunks = list(encoder)
+
+        assert max(len(chunk) for chunk in chunks) == 1000
+        assert b''.join(chunks) == self.get_expected_body(encoder.boundary)
+
+    def test_read_should_call_callback_with_file_bytes_read(self):
+        callback = MagicMock()
+        encoder = MultipartEncoder(files={'file': ('app.zip', io.BytesIO(b'12345'))}, callback=callback)
+        header_size = len(encoder.parts[0][0])
+
+        encoder.read(header_size + 2)
+        encoder.read()
+
+        # part headers are not counted, so the total is the size of the file
+        assert callback.call_args_list[0][0] == (2, 5)
+        assert callback.call_args_list[-1][0] == (5, 5)
+
+        encoder.rewind()
+        encoder.read(header_size + 1)
+        assert callback.call_args_list[-1][0] == (1, 5)
+
+    def test_rewind_should_read_body_again(self):
+        encoder = MultipartEncoder(files={'file': ('.tmp/app.zip', self.fileobj)})
+        first = encoder.read()
+
+        encoder.rewind()
+
+        assert encoder.read() == first
+
+    def test_read_with_truncated_file_should_raise_error(self):
+        encoder = MultipartEncoder(files={'file': ('.tmp/app.zip', self.fileobj)})
+        with open(self.tmp_file.name, 'wb') as f:
+            f.write(b'short')
+
+        with self.assertRaises(IOError):
+            encoder.read()
+
+    def test_encoder_with_buffer_reader_should_encode_same_body(self):
+        files = {'file': ('.tmp/app.zip', BufferReader(self.content))}
+        encoder = MultipartEncoder(fields={'name': 'app'}, files=files)
+
+        assert encoder.read() == self.get_expected_body(encoder.boundary)
+        encoder.rewind()
+        assert encoder.read() == self.get_expected_body(encoder.boundary)
+
+
+class TestBufferReader(TestCase):
+    def test_readers_should_keep_their_own_position(self):
+        data = b'0123456789'
+        first, second = BufferReader(data), BufferReader(data)
+
+        assert first.read(4) == b'0123'
+        assert second.read(2) == b'01'
+        assert first.read() == b'456789'
+        assert first.read(1) == b''
+
+        assert second.seek(-3, os.SEEK_END) == 7
+        assert second.read(10) == b'789'
+        assert second.seek(-2, os.SEEK_CUR) == 8
+        assert second.tell() == 8
+        assert second.seekable()
@@ -0,0 +1,203 @@
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from nak import nak
+from nak.timings import timings
+
+# cumulative import time of nak.nak reported by python -X importtime, in microseconds
+STARTUP_IMPORT_BUDGET = 80000
+HEAVY_MODULES = ['requests', 'yaml', 'decouple', 'zipfile', 'nak.command', 'nak.config', 'nak.gateway']
+STARTUP_SCRIPT = '''
+import sys
+before = set(sys.modules)
+sys.argv = ['nak'] + sys.argv[1:]
+from nak.nak import main
+try:
+    main()
+except SystemExit:
+    pass
+print(' '.join(sorted(set(sys.modules) - before)))
+'''
+
+
+class TestNak(TestCase):
+    def run_cold(self, *args):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        modules = set(result.stdout.splitlines()[-1].split())
+        import_times = {}
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and '|' in line:
+                _, cumulative, name = line.split('|')
+                if cumulative.strip().isdigit():
+                    import_times[name.strip()] = int(cumulative)
+        return modules, import_times
+
+    ####
+    # startup
+    ####
+    def test_help_should_not_import_heavy_modules(self):
+        for args in [['--help'], ['build', '--help'], ['unknown']]:
+            modules, _ = self.run_cold(*args)
+
+            imported = [name for name in HEAVY_MODULES if name in modules]
+            assert imported == [], f'nak {" ".join(args)} imported {imported}'
+
+    def test_cold_start_import_time_should_stay_in_budget(self):
+        _, import_times = self.run_cold('--help')
+
+        assert import_times['nak.nak'] < STARTUP_IMPORT_BUDGET
+
+    def get_args(self, mock_parser):
+        args = mock_parser.return_value.create_parser.return_value.parse_args.return_value
+        args.timings = args.profile = None
+        return args
+
+    ####
+    # main
+    ####
+    @patch('nak.nak.Parser', autospec=True)
+    def test_main_with_type_error_should_log_error(self, mock_parser):
+        args = self.get_args(mock_parser)
+        args.func.side_effect = TypeError('argument client_id is required.')
+
+        with self.assertLogs(level='ERROR') as log:
+            status = nak.main()
+
+        assert log.output == ['ERROR:root:argument client_id is required.']
+        assert status == 1
+
+    @patch('nak.nak.Parser', autospec=True)
+    def test_main_with_http_error_should_log_error(self, mock_parser):
+        from requests.exceptions import HTTPError
+        args = self.get_args(mock_parser)
+        args.func.side_effect = HTTPError('502 Server Error')
+
+        with self.assertLogs(level='ERROR') as log:
+            status = nak.main()
+
+        assert log.output == ['ERROR:root:502 Server Error']
+        assert status == 1
+
+    @patch('nak.nak.Parser', autospec=True)
+    def test_main_should_return_exit_status_of_command(self, mock_parser):
+        args = self.get_args(mock_parser)
+
+        args.func.return_value = None
+        assert nak.main() == 0
+        args.func.return_value = True
+        assert nak.main() == 0
+        args.func.return_value = False
+        assert nak.main() == 1
+
+    @patch('nak.nak.Parser', autospec=True)
+    def test_main_with_other_error_should_raise(self, mock_parser):
+        args = self.get_args(mock_parser)
+        args.func.side_effect = ValueError('unexpected')
+
+        with self.assertRaises(ValueError):
+            nak.main()
+
+    @patch('nak.nak.Parser', autospec=True)
+    def test_main_with_attribute_error_in_command_should_raise(self, mock_parser):
+        args = self.get_args(mock_parser)
+        args.func.side_effect = AttributeError("'NoneType' object has no attribute 'ok'")
+
+        # a bug must fail the command, not pass for a missing command
+        with self.assertRaises(AttributeError):
+            nak.main()
+
+    def test_main_without_command_should_print_help_hint(self):
+        with patch.object(sys, 'argv', ['nak']), patch('builtins.print') as mock_print:
+            assert nak.main() == 0
+
+        mock_print.assert_called_once_with('Use nak -h or --help to see available commands')
+
+    @patch('nak.command.Command', autospec=True)
+    def test_main_should_create_command_only_when_running_it(self, mock_command):
+        with patch.object(sys, 'argv', ['nak', 'build', '--jobs', '2']):
+            nak.main()
+
+        mock_command.assert_called_once_with()
+        args = mock_command.return_value.build.call_args[0][0]
+        assert args.jobs == 2
+
+    @patch('nak.server.forward', autospec=True)
+    @patch('nak.nak.Parser', autospec=True)
+    def test_main_with_daemon_running_should_forward_command(self, mock_parser, mock_forward):
+        mock_forward.return_value = 1
+
+        with patch.object(sys, 'argv', ['nak', 'build', '--minify']), patch('os.path.exists', return_value=True):
+            assert nak.main() == 1
+
+        mock_forward.assert_called_once_with(['build', '--minify'])
+        mock_parser.assert_not_called()
+
+    @patch('nak.server.forward', autospec=True)
+    @patch('nak.nak.Parser', autospec=True)
+    def test_main_with_stale_socket_should_run_command_here(self, mock_parser, mock_forward):
+        mock_forward.return_value = None
+        args = self.get_args(mock_parser)
+        args.func.return_value = True
+
+        with patch.object(sys, 'argv', ['nak', 'push']), patch('os.path.exists', return_value=True):
+            assert nak.main() == 0
+
+        args.func.assert_called_once_with(args)
+
+    @patch('nak.server.forward', autospec=True)
+    @patch('nak.nak.Parser', autospec=True)
+    def test_main_should_not_forward_setup_or_when_disabled(self, mock_parser, mock_forward):
+        self.get_args(mock_parser)
+
+        with patch('os.path.exists', return_value=True):
+            for argv, env in [(['nak', 'setup'], {}), (['nak', 'build'], {'NAK_NO_SERVE': '1'})]:
+                with patch.object(sys, 'argv', argv), patch.dict(os.environ, env):
+                    nak.main()
+
+        mock_forward.assert_not_called()
+
+    def test_parser_should_not_create_command(self):
+        with patch('nak.command.Command', MagicMock()) as mock_command:
+            parser = nak.Parser().create_parser()
+            parser.parse_args(['push'])
+
+        mock_command.assert_not_called()
+
+    @patch('nak.command.Command', autospec=True)
+    def test_main_with_timings_should_write_phases_as_json(self, mock_command):
+        def build(args):
+            with timings.phase('scan', files=2):
+                pass
+
+        mock_command.return_value.build.side_effect = build
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'timings.json')
+            with patch.object(sys, 'argv', ['nak', 'build', '--timings', output]):
+                nak.main()
+
+            with open(output) as f:
+                phases = json.load(f)['phases']
+
+        assert [(phase['name'], phase['calls']) for phase in phases] == [('total', 1), ('scan', 1)]
+        assert phases[1]['files'] == 2
+        assert not timings.enabled
+
+    @patch('nak.command.Command', autospec=True)
+    def test_main_with_profile_should_dump_stats(self, mock_command):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'nak.prof')
+            with patch.object(sys, 'argv', ['nak', 'push', '--profile', output]), self.assertLogs(level='INFO'):
+                nak.main()
+
+            stats = pstats.Stats(output)
+
+        mock_command.return_value.push.assert_called_once()
+        assert stats.total_calls > 0
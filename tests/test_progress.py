@@ -0,0 +1,88 @@
+import io
+from unittest import TestCase
+from unittest.mock import patch
+
+from nak.progress import Progress, format_size
+
+
+class TestProgress(TestCase):
+    ####
+    # format_size
+    ####
+    def test_format_size_should_use_readable_units(self):
+        assert format_size(512) == '512 B'
+        assert format_size(1536) == '1.5 KB'
+        assert format_size(400 * 1024 * 1024) == '400.0 MB'
+        assert format_size(3 * 1024 ** 5) == '3072.0 TB'
+
+    ####
+    # report
+    ####
+    @patch('nak.progress.time.monotonic', autospec=True)
+    def test_report_on_terminal_should_redraw_at_capped_rate(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        stream = io.StringIO()
+        progress = Progress(1000, stream=stream, is_tty=True, redraw_interval=0.1)
+
+        for _ in range(10):
+            progress.advance(10)
+        mock_monotonic.return_value = 100.2
+        progress.advance(10)
+
+        assert stream.getvalue().count('\r') == 2
+        assert stream.getvalue().endswith('11.0% 110 B/1000 B 550 B/s\033[K')
+
+    @patch('nak.progress.time.monotonic', autospec=True)
+    def test_report_should_weight_progress_by_bytes(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        stream = io.StringIO()
+        progress = Progress(1000, stream=stream, is_tty=True, length=10)
+
+        mock_monotonic.return_value = 101.0
+        progress.advance(900)
+
+        assert '█' * 9 + '-' in stream.getvalue()
+        assert '90.0%' in stream.getvalue()
+
+    @patch('nak.progress.time.monotonic', autospec=True)
+    def test_report_without_terminal_should_log_sparse_lines(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        stream = io.StringIO()
+        progress = Progress(stream=stream, is_tty=False, prefix='Uploading:', log_interval=10)
+
+        with self.assertLogs(level='INFO') as log:
+            for second in range(25):
+                mock_monotonic.return_value = 100.0 + second
+                progress.report(second * 1024, 25 * 1024)
+            progress.finish()
+
+        assert stream.getvalue() == ''
+        assert len(log.output) == 3
+        assert 'Uploading: 40.0% 10.0 KB/25.0 KB' in log.output[0]
+        assert 'Uploading: 96.0% 24.0 KB/25.0 KB' in log.output[-1]
+
+    def test_finish_without_progress_should_not_draw(self):
+        stream = io.StringIO()
+
+        with Progress(100, stream=stream, is_tty=True):
+            pass
+
+        assert stream.getvalue() == ''
+
+    def test_disabled_progress_should_only_count(self):
+        stream = io.StringIO()
+
+        with Progress(100, stream=stream, is_tty=True, enabled=False) as progress:
+            progress.advance(50)
+
+        assert progress.done == 50
+        assert stream.getvalue() == ''
+
+    def test_finish_on_terminal_should_end_line(self):
+        stream = io.StringIO()
+
+        with Progress(100, stream=stream, is_tty=True) as progress:
+            progress.advance(100)
+
+        assert stream.getvalue().endswith('\n')
+        assert '100.0%' in stream.getvalue().splitlines()[-1]
@@ -0,0 +1,189 @@
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from nak import server
+from nak.server import Daemon, FileIndex, StreamWriter
+
+
+class TestFileIndex(TestCase):
+    @patch('nak.utils.get_all_file', autospec=True)
+    def test_get_files_should_walk_only_after_changes(self, mock_get_all_file):
+        mock_get_all_file.return_value = ['./index.html']
+        watcher = MagicMock()
+        watcher.poll.side_effect = [set(), {'./new.html'}]
+        file_index = FileIndex(watcher)
+
+        assert file_index.get_files('.') == ['./index.html']
+        assert file_index.refresh() is False
+        assert file_index.get_files('.') == ['./index.html']
+        assert mock_get_all_file.call_count == 1
+
+        mock_get_all_file.return_value = ['./index.html', './new.html']
+        assert file_index.refresh() is True
+        assert file_index.get_files('.') == ['./index.html', './new.html']
+        assert mock_get_all_file.call_count == 2
+        assert watcher.poll.call_count == 2
+        watcher.poll.assert_called_with(0)
+
+
+class TestStreamWriter(TestCase):
+    def test_write_should_send_json_lines(self):
+        wfile = io.BytesIO()
+        writer = StreamWriter(wfile, 'stderr')
+
+        writer.write('line\n')
+        writer.write('')
+
+        assert wfile.getvalue() == b'{"stream": "stderr", "data": "line\\n"}\n'
+        assert not writer.isatty()
+
+    def test_write_after_client_left_should_drop_output(self):
+        wfile = MagicMock()
+        wfile.write.side_effect = BrokenPipeError
+        writer = StreamWriter(wfile, 'stdout')
+
+        assert writer.write('one') == 3
+        assert writer.write('two') == 3
+        assert wfile.write.call_count == 1
+
+
+class TestDaemon(TestCase):
+    def setUp(self):
+        self.parser = MagicMock()
+        self.daemon = Daemon(self.parser, socket_path='nak.sock')
+        self.daemon.file_index = MagicMock()
+        self.daemon.file_index.refresh.return_value = False
+
+    @patch('nak.utils.get_lastest_build_file', autospec=True)
+    @patch('nak.nak.run', autospec=True)
+    def test_execute_same_build_without_changes_should_skip_build(self, mock_run, mock_get_lastest_build_file):
+        mock_run.return_value = 0
+        mock_get_lastest_build_file.return_value = '.tmp/app.zip'
+
+        assert self.daemon.execute(['build']) == 0
+        with self.assertLogs(level='INFO') as log:
+            assert self.daemon.execute(['build']) == 0
+
+        assert mock_run.call_count == 1
+        assert 'No file changed since the last build, .tmp/app.zip is up to date.' in log.output[0]
+
+        self.daemon.execute(['build', '--minify'])
+        self.daemon.file_index.refresh.return_value = True
+        self.daemon.execute(['build', '--minify'])
+        assert mock_run.call_count == 3
+
+    @patch('nak.nak.run', autospec=True)
+    def test_execute_after_config_change_should_reload_command(self, mock_run):
+        mock_run.return_value = 0
+
+        with patch.object(self.daemon, 'get_control_mtimes', side_effect=[{'config.yml': 1}, {'config.yml': 1},
+                                                                          {'config.yml': 2}]):
+            self.daemon.execute(['push'])
+            self.daemon.execute(['push'])
+            self.daemon.execute(['push'])
+
+        assert self.parser.reset_command.call_count == 2
+        assert self.parser.command.file_index is self.daemon.file_index
+
+    def test_run_with_invalid_arguments_should_return_status_of_argparse(self):
+        self.daemon.argument_parser.parse_args.side_effect = SystemExit(2)
+
+        with self.assertLogs(level='INFO'):
+            assert self.daemon.run(['build', '--unknown'], io.BytesIO()) == 2
+
+    @patch('nak.nak.run', autospec=True)
+    def test_run_should_send_output_of_command(self, mock_run):
+        def run(args):
+            print('{"files": 1}')
+            import logging
+            logging.info('Build successfully.')
+            return 0
+        mock_run.side_effect = run
+        wfile = io.BytesIO()
+
+        with self.assertLogs(level='INFO'):
+            assert self.daemon.run(['analyze'], wfile) == 0
+
+        messages = [json.loads(line) for line in wfile.getvalue().splitlines()]
+        assert messages[0] == {'stream': 'stdout', 'data': '{"files": 1}'}
+        assert messages[-1]['stream'] == 'stderr' and messages[-1]['data'].endswith(' INFO Build successfully.\n')
+
+    @patch('nak.nak.run', autospec=True)
+    def test_run_with_failing_command_should_keep_serving(self, mock_run):
+        mock_run.side_effect = ValueError('bug')
+        wfile = io.BytesIO()
+
+        with self.assertLogs(level='INFO'):
+            assert self.daemon.run(['build'], wfile) == 1
+
+        assert 'ValueError: bug' in wfile.getvalue().decode()
+
+
+class TestForward(TestCase):
+    def test_forward_without_daemon_should_return_none(self):
+        with tempfile.TemporaryDirectory() as root:
+            assert server.forward(['build'], socket_path=os.path.join(root, 'nak.sock')) is None
+
+
+@unittest.skipUnless(hasattr(server.socket, 'AF_UNIX'), 'Unix domain sockets are not available')
+class TestServe(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        for name, content in [('config.yml', 'client_id: test\n'), ('templates/index.html', '<html>' * 100)]:
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+        self.socket_path = os.path.join(self.root, '.tmp', 'nak.sock')
+
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=package_root)
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'nak.nak', 'serve'], cwd=self.root, env=env, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while not server.is_running(self.socket_path):
+            assert time.monotonic() < deadline and self.process.poll() is None, 'nak serve did not start'
+            time.sleep(0.05)
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.tmp_dir.cleanup()
+
+    def forward(self, *argv):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        status = server.forward(list(argv), socket_path=self.socket_path, stdout=stdout, stderr=stderr)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_serve_should_only_let_the_user_connect(self):
+        assert os.stat(self.socket_path).st_mode & 0o777 == 0o600
+
+    def test_serve_should_run_forwarded_commands(self):
+        status, _, output = self.forward('build')
+        assert status == 0 and 'Build successfully.' in output
+
+        status, _, output = self.forward('build')
+        assert status == 0 and 'No file changed since the last build' in output
+
+        status, report, _ = self.forward('analyze', '--json')
+        assert status == 0 and json.loads(report)['files'] == 1
+
+        status, _, output = self.forward('build', '--unknown')
+        assert status == 2 and 'unrecognized arguments: --unknown' in output
+
+        self.process.send_signal(signal.SIGTERM)
+        assert self.process.wait(10) == 0
+        assert not os.path.exists(self.socket_path)
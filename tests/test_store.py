@@ -0,0 +1,114 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from nak.store import BuildStore
+
+
+class TestBuildStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, '.tmp')
+        os.mkdir(self.directory)
+        self.index_file = os.path.join(self.directory, 'index.json')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_store(self):
+        return BuildStore(self.directory, self.index_file)
+
+    def create_build(self, name, size=10, ctime=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def add_builds(self, store, sizes):
+        for index, size in enumerate(sizes):
+            store.add(self.create_build(f'app-{index}.zip', size), f'digest{index}')
+
+    def read_index(self):
+        with open(self.index_file) as f:
+            return json.load(f)['builds']
+
+    def test_get_latest_without_builds_should_return_none(self):
+        store = self.get_store()
+
+        assert store.get_latest() is None
+        assert store.get_latest_file() is None
+        assert not os.path.exists(self.index_file)
+
+    def test_add_should_record_build_as_latest(self):
+        store = self.get_store()
+        self.add_builds(store, [10, 20])
+
+        latest = self.get_store().get_latest()
+
+        assert (latest['name'], latest['digest'], latest['size']) == ('app-1.zip', 'digest1', 20)
+        assert latest['pushed'] is None
+        assert self.get_store().get_latest_file() == os.path.join(self.directory, 'app-1.zip')
+        assert [build['name'] for build in self.read_index()] == ['app-0.zip', 'app-1.zip']
+
+    def test_add_with_same_name_should_replace_entry(self):
+        store = self.get_store()
+        self.add_builds(store, [10, 20])
+        store.add(self.create_build('app-0.zip', 30), 'digest2')
+
+        builds = self.read_index()
+        assert [(build['name'], build['size']) for build in builds] == [('app-1.zip', 20), ('app-0.zip', 30)]
+
+    def test_load_without_index_should_scan_zip_files_by_creation_time(self):
+        for name in ['app-20200101.zip', 'app-20200102.zip', 'notes.txt']:
+            self.create_build(name)
+
+        store = self.get_store()
+
+        assert [build['name'] for build in store.builds] == ['app-20200101.zip', 'app-20200102.zip']
+        assert store.get_latest()['digest'] is None
+        assert [build['name'] for build in self.read_index()] == ['app-20200101.zip', 'app-20200102.zip']
+
+    def test_get_latest_with_removed_archive_should_fall_back_to_previous_build(self):
+        store = self.get_store()
+        self.add_builds(store, [10, 20])
+        os.remove(os.path.join(self.directory, 'app-1.zip'))
+
+        assert self.get_store().get_latest()['name'] == 'app-0.zip'
+        assert [build['name'] for build in self.read_index()] == ['app-0.zip']
+
+    def test_mark_pushed_should_record_push_time(self):
+        store = self.get_store()
+        self.add_builds(store, [10])
+
+        store.mark_pushed(os.path.join(self.directory, 'app-0.zip'))
+
+        assert self.read_index()[0]['pushed'] is not None
+
+    def test_prune_should_keep_newest_builds(self):
+        store = self.get_store()
+        self.add_builds(store, [10, 10, 10, 10])
+
+        removed = store.prune(keep=2)
+
+        assert [build['name'] for build in removed] == ['app-1.zip', 'app-0.zip']
+        assert sorted(os.listdir(self.directory)) == ['app-2.zip', 'app-3.zip', 'index.json']
+        assert [build['name'] for build in self.read_index()] == ['app-2.zip', 'app-3.zip']
+
+    def test_prune_with_max_size_should_remove_oldest_builds_over_limit(self):
+        store = self.get_store()
+        self.add_builds(store, [10, 30, 20, 10])
+
+        removed = store.prune(keep=10, max_size=35)
+
+        assert [build['name'] for build in removed] == ['app-1.zip', 'app-0.zip']
+        assert [build['name'] for build in store.builds] == ['app-2.zip', 'app-3.zip']
+
+    def test_prune_should_always_keep_latest_build(self):
+        store = self.get_store()
+        self.add_builds(store, [10, 100])
+
+        removed = store.prune(keep=0, max_size=1)
+
+        assert [build['name'] for build in removed] == ['app-0.zip']
+        assert store.get_latest()['name'] == 'app-1.zip'
@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from nak.timings import NULL_PHASE, Timings
+
+
+class TestTimings(TestCase):
+    def setUp(self):
+        self.timings = Timings()
+        self.timings.enable()
+
+    ####
+    # phase
+    ####
+    def test_phase_should_sum_runs_and_counters(self):
+        for size in [10, 20]:
+            with self.timings.phase('archive', files=1) as phase:
+                phase.add(bytes_in=size)
+
+        phase = self.timings.phases['archive']
+        assert phase.calls == 2
+        assert phase.wall >= 0 and phase.cpu >= 0
+        assert phase.counters == {'files': 2, 'bytes_in': 30}
+
+    def test_phase_when_disabled_should_not_record(self):
+        self.timings.reset()
+
+        with self.timings.phase('archive', files=1) as phase:
+            phase.add(bytes_in=10)
+
+        assert phase is NULL_PHASE
+        assert self.timings.phases == {}
+
+    def test_phase_should_record_runs_from_many_threads(self):
+        def run():
+            for _ in range(100):
+                with self.timings.phase('archive.compress') as phase:
+                    phase.add(files=1)
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert self.timings.phases['archive.compress'].calls == 400
+        assert self.timings.phases['archive.compress'].counters == {'files': 400}
+
+    def test_phase_should_record_failed_run(self):
+        with self.assertRaises(ValueError):
+            with self.timings.phase('push'):
+                raise ValueError()
+
+        assert self.timings.phases['push'].calls == 1
+
+    ####
+    # report
+    ####
+    def test_report_should_log_phases_in_start_order(self):
+        with self.timings.phase('archive'):
+            with self.timings.phase('archive.write', bytes_out=5):
+                pass
+
+        with self.assertLogs(level='INFO') as log:
+            self.timings.report()
+
+        lines = self.timings.format_summary()
+        assert len(log.output) == len(lines) == 3
+        assert lines[0].split()[0] == 'phase'
+        assert lines[1].startswith('archive ')
+        assert lines[2].startswith('  write ')
+        assert lines[2].split()[1] == '1'
+        assert lines[2].split()[-1] == '5'
+
+    def test_report_with_file_should_write_json(self):
+        with self.timings.phase('scan', files=3):
+            pass
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'timings.json')
+            with patch('logging.info'):
+                self.timings.report(output)
+            with open(output) as f:
+                result = json.load(f)
+
+        assert result['phases'][0]['name'] == 'scan'
+        assert result['phases'][0]['files'] == 3
+        assert set(result['phases'][0]) >= {'calls', 'wall_seconds', 'cpu_seconds'}
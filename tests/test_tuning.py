@@ -0,0 +1,104 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from nak.compression import ZLIB_BACKEND, CompressionPolicy
+from nak.settings import TUNING_UPLOAD_SAMPLES
+from nak.tuning import Tuner
+
+MB = 1024 * 1024
+# level: (bytes per second, ratio), level 1 is fast and level 9 small
+LEVELS = {1: (100 * MB, 0.5), 6: (20 * MB, 0.3), 9: (2 * MB, 0.28)}
+
+
+class TestTuner(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.state_file = os.path.join(self.root, '.tmp', 'tuning.json')
+        self.files = []
+        for name, content in [
+            ('templates/index.html', b'<div class="product">hello</div>\n' * 3000),
+            ('assets/app.js', b'var total = price * quantity;\n' * 3000),
+            ('assets/logo.png', os.urandom(4096)),
+        ]:
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.files.append(path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def create_tuner(self, rate=None, level=None):
+        tuner = Tuner(state_file=self.state_file)
+        if rate is not None:
+            tuner.state['uploads'] = [[rate, 1]]
+        if level is not None:
+            tuner.state['level'] = level
+        return tuner
+
+    ####
+    # record_upload
+    ####
+    def test_record_upload_should_keep_recent_uploads_and_return_median_rate(self):
+        tuner = self.create_tuner()
+        assert tuner.get_upload_rate() is None
+
+        for rate in [1, 8, 2, 3, 9, 4]:
+            tuner.record_upload(rate * MB, 1.0)
+        tuner.record_upload(1024, 0.5)
+
+        tuner = self.create_tuner()
+        assert len(tuner.state['uploads']) == TUNING_UPLOAD_SAMPLES
+        assert tuner.get_upload_rate() == 4 * MB
+
+    ####
+    # sample_levels
+    ####
+    def test_sample_levels_should_measure_every_level(self):
+        levels = self.create_tuner().sample_levels(self.files[:2], ZLIB_BACKEND)
+
+        assert sorted(levels) == list(range(1, 10))
+        assert all(speed > 0 and 0 < ratio < 0.1 for speed, ratio in levels.values())
+        assert levels[9][1] <= levels[1][1]
+
+    def test_sample_levels_without_data_should_return_nothing(self):
+        assert self.create_tuner().sample_levels([], ZLIB_BACKEND) == {}
+
+    ####
+    # choose
+    ####
+    def test_choose_without_upload_should_return_none(self):
+        assert self.create_tuner().choose(self.files, CompressionPolicy()) == (None, {})
+
+    def test_choose_should_compress_more_on_slow_uploads(self):
+        with patch.object(Tuner, 'sample_levels', return_value=LEVELS):
+            fast, predictions = self.create_tuner(rate=1000 * MB).choose(self.files, CompressionPolicy(), jobs=1)
+            slow, _ = self.create_tuner(rate=MB // 100).choose(self.files, CompressionPolicy(), jobs=1)
+
+        assert (fast.level, slow.level) == (1, 9)
+        # the png is stored whatever the level
+        size = sum(os.path.getsize(path) for path in self.files[:2])
+        assert predictions[6].compress_seconds == size / (20 * MB)
+        assert predictions[6].upload_seconds == size * 0.3 / (1000 * MB)
+        assert self.create_tuner().state['level'] == 9
+
+    def test_choose_should_keep_last_level_unless_much_faster(self):
+        levels = {5: (10 * MB, 0.3), 6: (10 * MB, 0.31)}
+        with patch.object(Tuner, 'sample_levels', return_value=levels):
+            best, _ = self.create_tuner(rate=MB, level=6).choose(self.files, CompressionPolicy())
+            assert best.level == 6
+
+            best, _ = self.create_tuner(rate=MB, level=1).choose(self.files, CompressionPolicy())
+            assert best.level == 5
+
+    def test_choose_should_reuse_sampled_levels(self):
+        with patch.object(Tuner, 'sample_levels', return_value=LEVELS) as mock_sample_levels:
+            self.create_tuner(rate=MB).choose(self.files, CompressionPolicy())
+            self.create_tuner(rate=MB).choose(self.files, CompressionPolicy())
+
+        mock_sample_levels.assert_called_once()
+        assert mock_sample_levels.call_args[0][0] == sorted(self.files[:2])
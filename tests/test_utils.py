@@ -1,5 +1,9 @@
+import hashlib
+import json
+import os
+import tempfile
 from unittest import TestCase
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, call, patch
 
 from nak import utils
 
@@ -40,68 +44,158 @@ class TestUtils(TestCase):
     ####
     # get_all_file
     ####
-    @patch('os.listdir')
-    def test_get_all_file_with_allow_file_should_return_correctly_file_list(self, mock_listdir):
-        mock_listdir.return_value = [
-            'test1.html', 'test2.html', 'test.json'
-        ]
+    def create_files(self, root, names):
+        for name in names:
+            path = os.path.join(root, name)
+            if name.endswith('/'):
+                os.makedirs(path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(name)
 
-        actual = utils.get_all_file('.')
+    def test_get_all_file_with_allow_file_should_return_correctly_file_list(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.create_files(root, ['test1.html', 'test2.html', 'test.json'])
 
-        assert actual == ['./test1.html', './test2.html', './test.json']
+            actual = utils.get_all_file(root)
 
-    @patch('os.listdir')
-    def test_get_all_file_with_not_allow_file_should_return_correctly_file_list(self, mock_listdir):
-        mock_listdir.return_value = [
-            '.env', 'config.yml', '.tmp', 'test1.a', 'test2.b', 'test.c'
-        ]
+        assert sorted(actual) == sorted(os.path.join(root, name) for name in ['test1.html', 'test2.html', 'test.json'])
+
+    def test_get_all_file_with_not_allow_file_should_return_correctly_file_list(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.create_files(root, ['.env', 'config.yml', '.tmp/build.zip', '.tmp/test.html', 'test1.a', 'test2.b'])
+
+            actual = utils.get_all_file(root)
 
-        actual = utils.get_all_file('.')
         assert actual == []
 
-    @patch('os.listdir')
-    def test_get_all_file_with_required_extension_file_should_return_correctly_file_list(self, mock_listdir):
-        mock_listdir.return_value = [
-            'test1.a', 'test2.b', 'test.c', 'test_zip1.zip', 'test_zip2.zip'
-        ]
+    def test_get_all_file_with_required_extension_file_should_return_correctly_file_list(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.create_files(root, ['test1.a', 'test2.b', 'test.c', 'test_zip1.zip', 'test_zip2.zip'])
+
+            actual = utils.get_all_file(root, required_extension='.zip')
+
+        assert sorted(actual) == [os.path.join(root, 'test_zip1.zip'), os.path.join(root, 'test_zip2.zip')]
+
+    def test_get_all_file_with_nested_directories_should_return_all_files(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.create_files(root, [
+                'index.html', 'assets/css/app.css', 'assets/jquery.ui/ui.js', 'assets/empty/', 'assets/notes.txt'
+            ])
+
+            actual = utils.get_all_file(root)
+
+        assert sorted(actual) == sorted(os.path.join(root, name) for name in [
+            'index.html', 'assets/css/app.css', 'assets/jquery.ui/ui.js'
+        ])
+
+    @patch('os.scandir', wraps=os.scandir)
+    def test_iter_files_should_not_enter_excluded_directories(self, mock_scandir):
+        with tempfile.TemporaryDirectory() as root:
+            self.create_files(root, ['index.html', '.tmp/old/test.html'])
+
+            actual = list(utils.iter_files(root))
+            scandir_calls = mock_scandir.call_args_list[:]
+
+        assert actual == [os.path.join(root, 'index.html')]
+        assert scandir_calls == [call(root)]
+
+    def test_get_all_file_should_only_exclude_exact_names(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.create_files(root, ['my.environment.json', 'assets/.env', 'assets/config.yml.html'])
+
+            actual = utils.get_all_file(root)
+
+        assert sorted(actual) == sorted(os.path.join(root, name) for name in [
+            'my.environment.json', 'assets/config.yml.html'
+        ])
+
+    @patch('os.scandir', wraps=os.scandir)
+    def test_iter_files_should_apply_nakignore_and_prune_directories(self, mock_scandir):
+        with tempfile.TemporaryDirectory() as root:
+            self.create_files(root, [
+                'index.html', 'node_modules/lib/index.js', 'assets/app.js', 'assets/app.js.map.json',
+                'assets/keep.json', 'assets/data.json',
+            ])
+            with open(os.path.join(root, '.nakignore'), 'w') as f:
+                f.write('node_modules/\n*.map.json\nassets/*.json\n!keep.json\n')
+
+            actual = list(utils.iter_files(root))
+            scandir_calls = mock_scandir.call_args_list[:]
 
-        actual = utils.get_all_file('.', required_extension='.zip')
-        assert actual == ['./test_zip1.zip', './test_zip2.zip']
+        assert sorted(actual) == sorted(os.path.join(root, name) for name in [
+            'index.html', 'assets/app.js', 'assets/keep.json'
+        ])
+        assert call(os.path.join(root, 'node_modules')) not in scandir_calls
+
+    def test_iter_files_should_yield_files_lazily(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.create_files(root, ['test1.html', 'test2.html'])
+
+            files = utils.iter_files(root)
+
+            assert next(files).startswith(root)
+
+    def test_filter_listed_files_should_apply_extensions_and_nakignore(self):
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, '.nakignore'), 'w') as f:
+                f.write('node_modules/\n*.map.json\n')
+
+            actual = utils.filter_listed_files(root, [
+                'index.html', 'node_modules/lib/index.js', 'assets/app.js', 'assets/app.js.map.json',
+                'assets/README.md', 'config.yml', '.nakignore',
+            ])
+
+        assert actual == [os.path.join(root, name) for name in ['index.html', 'assets/app.js']]
 
     ####
     # get_lastest_build_file
     ###
-    @patch("nak.utils.Path")
-    def test_get_lastest_build_file_with_no_zip_file_should_return_none(self, mock_path):
-        mock_dir = MagicMock()
-        mock_path.return_value = mock_dir
-
-        mock_dir.iterdir.return_value = [
-            MagicMock(
-                is_file=MagicMock(return_value=True), suffix='.txt', as_posix=MagicMock(return_value='file1.txt')),
-            MagicMock(
-                is_file=MagicMock(return_value=True), suffix='.txt', as_posix=MagicMock(return_value='file2.txt'))
-        ]
+    @patch("nak.utils.BuildStore", autospec=True)
+    def test_get_lastest_build_file_should_return_latest_build_of_store(self, mock_store):
+        mock_store.return_value.get_latest_file.return_value = '.tmp/file2.zip'
 
         result = utils.get_lastest_build_file()
-        assert result is None
 
-    @patch("nak.utils.Path")
-    def test_get_lastest_build_file_with_have_zip_fiile_should_return_latest_file(self, mock_path):
-        mock_dir = MagicMock()
-        mock_path.return_value = mock_dir
+        assert result == '.tmp/file2.zip'
+        mock_store.assert_called_once_with()
+
+    ####
+    # build digests
+    ####
+    def test_get_build_digest_should_use_digest_recorded_in_manifest(self):
+        with tempfile.TemporaryDirectory() as root:
+            manifest_file = os.path.join(root, 'manifest.json')
+            build_file = os.path.join(root, 'app.zip')
+            with open(manifest_file, 'w') as f:
+                json.dump({'archive': build_file, 'digest': 'recorded'}, f)
 
-        mock_file1 = MagicMock(
-            is_file=MagicMock(return_value=True), suffix='.zip', as_posix=MagicMock(return_value='file1.txt'))
-        mock_file1.stat.return_value.st_ctime = 1000
-        mock_file1.as_posix.return_value = 'file1.zip'
+            actual = utils.get_build_digest(build_file, manifest_file)
 
-        mock_file2 = MagicMock(
-            is_file=MagicMock(return_value=True), suffix='.zip', as_posix=MagicMock(return_value='file2.txt'))
-        mock_file2.stat.return_value.st_ctime = 2000
-        mock_file2.as_posix.return_value = 'file2.zip'
+        assert actual == 'recorded'
 
-        mock_dir.iterdir.return_value = [mock_file1, mock_file2]
+    def test_get_build_digest_of_other_build_should_hash_file(self):
+        with tempfile.TemporaryDirectory() as root:
+            manifest_file = os.path.join(root, 'manifest.json')
+            build_file = os.path.join(root, 'old.zip')
+            with open(manifest_file, 'w') as f:
+                json.dump({'archive': os.path.join(root, 'app.zip'), 'digest': 'recorded'}, f)
+            with open(build_file, 'wb') as f:
+                f.write(b'zip data')
 
-        result = utils.get_lastest_build_file()
-        assert result == 'file2.zip'
+            actual = utils.get_build_digest(build_file, manifest_file)
+
+        assert actual == hashlib.sha256(b'zip data').hexdigest()
+
+    def test_set_pushed_digest_should_keep_digest_per_client_id(self):
+        with tempfile.TemporaryDirectory() as root:
+            state_file = os.path.join(root, '.tmp', 'pushed.json')
+            assert utils.get_pushed_digest('client1', state_file) is None
+
+            utils.set_pushed_digest('client1', 'digest1', state_file)
+            utils.set_pushed_digest('client2', 'digest2', state_file)
+            utils.set_pushed_digest('client1', 'digest3', state_file)
+
+            assert utils.get_pushed_digest('client1', state_file) == 'digest3'
+            assert utils.get_pushed_digest('client2', state_file) == 'digest2'
@@ -0,0 +1,140 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from nak import watcher
+from nak.watcher import InotifyWatcher, PollingWatcher
+
+
+class WatcherTestMixin(object):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.write('index.html', 'index')
+        self.write('assets/app.js', 'app')
+        self.watcher = self.create_watcher()
+
+    def tearDown(self):
+        self.watcher.close()
+        self.tmp_dir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_poll_without_changes_should_return_empty_set(self):
+        assert self.watcher.poll(0.05) == set()
+
+    def test_poll_with_changed_file_should_return_path(self):
+        path = self.write('assets/app.js', 'changed app')
+
+        assert path in self.watcher.poll(1)
+
+    def test_poll_with_deleted_file_should_return_path(self):
+        path = os.path.join(self.root, 'index.html')
+        os.remove(path)
+
+        assert path in self.watcher.poll(1)
+
+    def test_poll_with_file_in_new_directory_should_return_path(self):
+        os.makedirs(os.path.join(self.root, 'assets/css'))
+        self.watcher.poll(0.2)
+        path = self.write('assets/css/app.css', 'css')
+
+        assert path in self.watcher.poll(1)
+
+    def test_poll_with_ignored_files_should_return_empty_set(self):
+        self.write('.tmp/build.zip', 'zip')
+        self.write('notes.txt', 'text')
+        self.write('.env', 'email=test@29next.com')
+
+        assert self.watcher.poll(0.2) == set()
+
+    def test_wait_for_changes_should_collect_changes_until_quiet(self):
+        def write_files():
+            for index in range(3):
+                time.sleep(0.05)
+                self.write(f'page{index}.html', 'page')
+
+        thread = threading.Thread(target=write_files)
+        thread.start()
+        changes = self.watcher.wait_for_changes(debounce=0.3)
+        thread.join()
+
+        assert {os.path.join(self.root, f'page{index}.html') for index in range(3)} <= changes
+
+
+class TestPollingWatcher(WatcherTestMixin, TestCase):
+    def create_watcher(self):
+        return PollingWatcher(self.root, interval=0.02)
+
+    def test_poll_with_same_mtime_and_size_should_not_report_change(self):
+        path = os.path.join(self.root, 'index.html')
+        stat = os.stat(path)
+        self.write('index.html', 'INDEX')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        assert self.watcher.poll(0.05) == set()
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is only available on Linux')
+class TestInotifyWatcher(WatcherTestMixin, TestCase):
+    def create_watcher(self):
+        return InotifyWatcher(self.root)
+
+    def test_should_not_watch_ignored_directories(self):
+        self.watcher.close()
+        os.makedirs(os.path.join(self.root, 'node_modules/lib'))
+        with open(os.path.join(self.root, '.nakignore'), 'w') as f:
+            f.write('node_modules/\n')
+
+        self.watcher = self.create_watcher()
+
+        assert sorted(self.watcher.directories.values()) == [self.root, os.path.join(self.root, 'assets')]
+
+    def test_poll_with_event_queue_overflow_should_report_root(self):
+        with patch.object(self.watcher, 'read_events', return_value=[(-1, watcher.IN_Q_OVERFLOW, '')]), \
+                patch('nak.watcher.select.select', return_value=([self.watcher.fd], [], [])):
+            assert self.watcher.poll(0) == {self.root}
+
+
+class TestGetWatcher(TestCase):
+    @patch('nak.watcher.InotifyWatcher', autospec=True)
+    @patch('nak.watcher.sys')
+    def test_get_watcher_on_linux_should_use_inotify(self, mock_sys, mock_inotify):
+        mock_sys.platform = 'linux'
+
+        assert watcher.get_watcher('.') == mock_inotify.return_value
+
+    @patch('nak.watcher.PollingWatcher', autospec=True)
+    @patch('nak.watcher.InotifyWatcher', autospec=True)
+    @patch('nak.watcher.sys')
+    def test_get_watcher_with_inotify_error_should_fall_back_to_polling(self, mock_sys, mock_inotify, mock_polling):
+        mock_sys.platform = 'linux'
+        mock_inotify.side_effect = OSError(28, 'No space left on device')
+
+        assert watcher.get_watcher('.', interval=2) == mock_polling.return_value
+        mock_polling.assert_called_once_with('.', interval=2)
+
+    @patch('nak.watcher.PollingWatcher', autospec=True)
+    @patch('nak.watcher.sys')
+    def test_get_watcher_on_other_platform_should_use_polling(self, mock_sys, mock_polling):
+        mock_sys.platform = 'darwin'
+
+        assert watcher.get_watcher('.') == mock_polling.return_value
+
+
+class TestWatcherBase(TestCase):
+    def test_wait_for_changes_should_block_until_first_change(self):
+        base = watcher.Watcher('.')
+        base.poll = MagicMock(side_effect=[set(), {'a.html'}, {'b.html'}, set()])
+
+        assert base.wait_for_changes(debounce=0.1) == {'a.html', 'b.html'}